@@ -1,56 +1,908 @@
 import os
-import pandas as pd
-from groq import Groq
-from uuid import uuid4
-from langchain_core.documents import Document
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.schema import Document
+import json
+import heapq
+import time
+import pickle
+import asyncio
+import logging
+import queue
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from faiss_utils import (
+  load_manifest, read_mapped_index, apply_search_params, enable_reconstruct, search_parameters, search_subset,
+  load_shards, resolve_index_path, version_marker
+)
+from attribute_index import AttributeIndex
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from telemetry import LatencyRecorder
+from answer_cache import AnswerCache, SingleFlight, answer_key
+from llm_scheduler import LLMScheduler
+from embedding_backends import embedding_config, embedding_kwargs, manifest_embedding, check_compatible
+from context_packer import count_tokens, truncate, passage_tag, passage_tokens, format_passage, select_passages
+from lazy_imports import LazyImport, deferred_imports
 
+# torch (through langchain_huggingface), groq and langchain_community are
+# imported on first use, so importing this module and answering health
+# checks do not wait for them (see lazy_imports.py)
+httpx = LazyImport("httpx")
+Groq = LazyImport("groq", "Groq")
+AsyncGroq = LazyImport("groq", "AsyncGroq")
+DefaultHttpxClient = LazyImport("groq", "DefaultHttpxClient")
+DefaultAsyncHttpxClient = LazyImport("groq", "DefaultAsyncHttpxClient")
+Document = LazyImport("langchain_core.documents", "Document")
+FAISS = LazyImport("langchain_community.vectorstores", "FAISS")
+HuggingFaceEmbeddings = LazyImport("langchain_huggingface", "HuggingFaceEmbeddings")
+load_compact = LazyImport("compact_store", "load_compact")
+
+# Child of the "chatbot" logger configured in botInterface.py
+logger = logging.getLogger("chatbot.rag")
+
+# Filters matching at most this many documents are searched exactly over the matches
+EXACT_FILTER_LIMIT = 2048
+
+# vector: dense FAISS search, lexical: BM25 only, hybrid: both fused with reciprocal rank fusion
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# In hybrid mode each retriever contributes this many times k candidates to the fusion
+HYBRID_CANDIDATES = 4
+
+
+def _running_loop():
+  try:
+    return asyncio.get_running_loop()
+  except RuntimeError:
+    return None
+
+
+class QueryCache():
+  """
+  Bounded LRU cache of retrieval results keyed on the normalized query text
+  and k. Each entry holds the query vector and the ids and contents of the
+  top-k documents. Entries belong to one index generation: looking up with
+  a different generation empties the cache, so a reloaded index never
+  serves results from the previous one.
+  """
+
+  def __init__(self, max_size=1024):
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._generation = None
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def normalize(query):
+    return " ".join(query.lower().split())
+
+  def get(self, query, k, generation):
+    with self._lock:
+      if generation != self._generation:
+        self._entries.clear()
+        self._generation = generation
+      entry = self._entries.get((query, k))
+      if entry is None:
+        self.misses += 1
+        return None
+      self._entries.move_to_end((query, k))
+      self.hits += 1
+      return entry
+
+  def put(self, query, k, generation, entry):
+    with self._lock:
+      if generation != self._generation or self.max_size <= 0:
+        return
+      self._entries[(query, k)] = entry
+      self._entries.move_to_end((query, k))
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "size": len(self._entries),
+        "max_size": self.max_size,
+        "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+      }
+
+
+class MicroBatcher():
+  """
+  Collects single queries submitted concurrently from several threads for
+  up to window_ms (or until max_batch are waiting) and serves them with one
+  call to handler, which takes a list of queries and returns their results
+  in the same order. submit blocks until the caller's result is ready.
+  """
+
+  def __init__(self, handler, window_ms=5, max_batch=32):
+    self.handler = handler
+    self.window = window_ms / 1000
+    self.max_batch = max_batch
+    self.batches = 0
+    self.batched_queries = 0
+    self._queue = queue.Queue()
+    self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+    self._worker.start()
+
+  def submit(self, query):
+    future = Future()
+    self._queue.put((query, future))
+    return future.result()
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      deadline = time.monotonic() + self.window
+      while len(batch) < self.max_batch:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        try:
+          batch.append(self._queue.get(timeout=remaining))
+        except queue.Empty:
+          break
+      self.batches += 1
+      self.batched_queries += len(batch)
+      try:
+        results = self.handler([query for query, _ in batch])
+        for (_, future), result in zip(batch, results):
+          future.set_result(result)
+      except Exception as e:
+        for _, future in batch:
+          future.set_exception(e)
+
+
+class LoadedIndex():
+  """
+  One version of the index: the vector store with its search settings and
+  its attribute and BM25 sidecars. ChatBot swaps versions as a whole, and a
+  query keeps using the version it started with.
+
+  A sharded index (build_index.py --sharded) has no store of its own: shards
+  maps each shard name to a LoadedIndex of one source, and searches fan out
+  over parts().
+  """
+
+  def __init__(self, path, version, store=None, config=None, attributes=None, lexical=None,
+               store_format=None, shards=None, sources=None):
+    self.path = path
+    self.version = version
+    # version_marker of FAISS_INDEX_PATH and load generation, set by ChatBot._load_index
+    self.marker = None
+    self.generation = 0
+    self.store = store
+    self.config = config
+    self.attributes = attributes
+    self.lexical = lexical
+    self.store_format = store_format
+    self.shards = shards or {}
+    # Sources a shard holds, None for every source
+    self.sources = sources
+    self.docstore_to_faiss_id = {docstore_id: faiss_id for faiss_id, docstore_id in store.index_to_docstore_id.items()} if store else {}
+    self.loaded_at = time.time()
+
+  def parts(self, filters=None):
+    """
+    The indexes a search visits: the shards, or this index itself. Shards
+    holding none of the sources in a "sources" filter are skipped.
+    """
+    if not self.shards:
+      return [self]
+    wanted = {str(name).lower() for name in (filters or {}).get("sources") or []}
+    return [
+      shard for shard in self.shards.values()
+      if not wanted or any(source.lower() in wanted for source in shard.sources)
+    ]
+
+  @property
+  def documents(self):
+    return sum(int(part.store.index.ntotal) for part in self.parts())
+
+  @property
+  def has_lexical(self):
+    return all(part.lexical is not None for part in self.parts())
+
+  def part_of(self, docstore_id):
+    """The shard storing a document, or None."""
+    for part in self.parts():
+      if docstore_id in part.docstore_to_faiss_id:
+        return part
+    return None
+
+  def document(self, docstore_id):
+    return self.part_of(docstore_id).store.docstore.search(docstore_id)
+
+  def vector(self, docstore_id):
+    """Stored vector of a document, see enable_reconstruct."""
+    part = self.part_of(docstore_id)
+    return part.store.index.reconstruct(int(part.docstore_to_faiss_id[docstore_id]))
+
+
+class IndexWatcher():
+  """
+  Polls FAISS_INDEX_PATH every interval seconds and reloads the ChatBot
+  when a new index is published. A version that failed to load is not
+  retried until another one is published.
+  """
+
+  def __init__(self, chatbot, interval=30.0):
+    self.chatbot = chatbot
+    self.interval = interval
+    self._failed_marker = None
+    self._stopping = threading.Event()
+    self._worker = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+    self._worker.start()
+
+  def _run(self):
+    while not self._stopping.wait(self.interval):
+      # The first load is not over yet (ChatBot.load_in_background)
+      if not self.chatbot.ready.is_set():
+        continue
+      marker = version_marker(self.chatbot.index_root)
+      active = self.chatbot.active_index
+      if marker is None or marker == self._failed_marker or (active is not None and marker == active.marker):
+        continue
+      try:
+        self.chatbot.reload_index()
+      except Exception:
+        # Logged by reload_index, the active version keeps serving
+        self._failed_marker = marker
+
+  def stop(self):
+    self._stopping.set()
+    self._worker.join(timeout=self.interval + 1.0)
 
 
 class ChatBot():
+  """
+  The RAG pipeline: query embedding, retrieval over the active index and
+  the Groq calls. The model and the index are loaded by the constructor,
+  or with load=False later by load_faiss_index or load_in_background, so
+  that a server can answer health checks meanwhile. ready is set once
+  loading is over, whether the index could be loaded or not.
+  """
 
-  def __init__(self):
+  def __init__(self, load=True):
     self.data_path = os.environ.get("DATA_PATH", "data")
-    self.faiss_index_path = os.environ.get("FAISS_INDEX_PATH", "faiss_index")
+    # An index directory, or the root of a versioned layout (build_index.py --versioned)
+    self.index_root = os.environ.get("FAISS_INDEX_PATH", "faiss_index")
+    # Directory of the active version
+    self.faiss_index_path = self.index_root
     self.k = 5
-    self.model_name = 'sentence-transformers/all-mpnet-base-v2'
-    self.load_faiss_index()
+    # Model and runtime (EMBEDDING_BACKEND) of the query embeddings, which must match the index
+    self.embedding = embedding_config()
+    self.model_name = self.embedding["model_name"]
+    self.llm_model = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
+    self.retrieval_mode = os.environ.get("RETRIEVAL_MODE", "vector")
+    if self.retrieval_mode not in RETRIEVAL_MODES:
+      raise ValueError(f"RETRIEVAL_MODE must be one of: {', '.join(RETRIEVAL_MODES)}")
+    self.query_cache = QueryCache(int(os.environ.get("QUERY_CACHE_SIZE", "1024")))
+    # Rolling per-stage latency histograms over the last LATENCY_WINDOW samples, shown in the health check
+    self.latency = LatencyRecorder(int(os.environ.get("LATENCY_WINDOW", "1000")))
+    # The prompt context is packed from CONTEXT_CANDIDATES retrieved passages into
+    # CONTEXT_TOKEN_BUDGET tokens, skipping near-duplicates (see build_context)
+    self.context_candidates = int(os.environ.get("CONTEXT_CANDIDATES", str(3 * self.k)))
+    self.context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+    self.context_mmr_lambda = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+    self.context_duplicate_threshold = float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.92"))
+    # One Groq client per ChatBot so HTTP connections and TLS sessions are reused
+    self._client = None
+    self._async_clients = {}
+    self._client_lock = threading.Lock()
+    self.index_generation = 0
+    # FAISS_MMAP=1 maps the stored vectors instead of copying them into every process (see api.py)
+    self.faiss_mmap = os.environ.get("FAISS_MMAP", "0") == "1"
+    # auto loads the compact store (build_index.py --compact) when the index has one, pickle never does
+    self.index_format = os.environ.get("INDEX_FORMAT", "auto")
+    if self.index_format not in ("auto", "compact", "pickle"):
+      raise ValueError("INDEX_FORMAT must be one of: auto, compact, pickle")
+    # The version being served, replaced as a whole by reload_index
+    self.active_index = None
+    self.reloads = 0
+    self.reload_failures = 0
+    self.last_reload_error = None
+    self._reload_lock = threading.Lock()
+    # Threads searching the shards of a sharded index in parallel, created on first use
+    self.shard_search_threads = int(os.environ.get("SHARD_SEARCH_THREADS", "4"))
+    self._shard_pool = None
+    # Opt-in: ANSWER_CACHE_PATH keeps answers in a SQLite file shared by every process, see answer_cache.py
+    cache_path = os.environ.get("ANSWER_CACHE_PATH")
+    self.answer_cache = AnswerCache(
+      cache_path,
+      ttl=float(os.environ.get("ANSWER_CACHE_TTL", "86400")),
+      max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+    ) if cache_path else None
+    # Identical questions asked at the same time share one LLM call (ANSWER_COALESCE=0 turns it off)
+    self.single_flight = SingleFlight(os.environ.get("ANSWER_COALESCE", "1") == "1")
+    # Groq calls wait for a slot under the in-flight cap and the account's rate limits, see llm_scheduler.py
+    self.llm_scheduler = LLMScheduler(
+      max_in_flight=int(os.environ.get("LLM_MAX_IN_FLIGHT", "8")),
+      requests_per_minute=int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "0")),
+      tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0")),
+      max_retries=int(os.environ.get("LLM_MAX_RETRIES", "3")),
+      latency=self.latency
+    )
+    # Completion tokens expected per answer, charged to the tokens-per-minute budget with the prompt
+    self.llm_completion_tokens = int(os.environ.get("LLM_COMPLETION_TOKENS", "256"))
+    # Opt-in: MICRO_BATCH_WINDOW_MS > 0 groups concurrent busca_contexto calls
+    window_ms = float(os.environ.get("MICRO_BATCH_WINDOW_MS", "0"))
+    self.micro_batcher = MicroBatcher(
+      self._batched_entries,
+      window_ms=window_ms,
+      max_batch=int(os.environ.get("MICRO_BATCH_MAX_SIZE", "32"))
+    ) if window_ms > 0 else None
+    # Startup timings, shown in the health checks and by benchmark.py startup
+    self.ready = threading.Event()
+    self.load_error = None
+    self.load_seconds = None
+    self.model_load_seconds = None
+    self.index_load_seconds = None
+    self.warmup_seconds = None
+    if load:
+      self.load_faiss_index()
+      self.ready.set()
+    # Opt-in: INDEX_WATCH_INTERVAL > 0 reloads new index versions as they are published
+    watch_interval = float(os.environ.get("INDEX_WATCH_INTERVAL", "0"))
+    self.index_watcher = IndexWatcher(self, watch_interval) if watch_interval > 0 else None
+
+  # The active version's parts, for callers that do not need them consistent with each other.
+  # A sharded index has no single vector store: faiss_index is None, check active_index instead.
+  @property
+  def faiss_index(self):
+    return self.active_index.store if self.active_index else None
+
+  @property
+  def index_config(self):
+    return self.active_index.config if self.active_index else None
+
+  @property
+  def attributes(self):
+    return self.active_index.attributes if self.active_index else None
+
+  @property
+  def lexical(self):
+    return self.active_index.lexical if self.active_index else None
+
+  @property
+  def store_format(self):
+    return self.active_index.store_format if self.active_index else None
+
+  @property
+  def index_version(self):
+    return self.active_index.version if self.active_index else None
 
   def load_faiss_index(self):
-    embeddings = HuggingFaceEmbeddings(model_name=self.model_name)
+    """Loads the embedding model and the index, replacing both."""
+    started = time.perf_counter()
+    # The first call also imports langchain_huggingface and torch
+    self.embeddings = HuggingFaceEmbeddings(model_name=self.model_name, **embedding_kwargs(self.embedding))
+    self.model_load_seconds = time.perf_counter() - started
     try:
-      print(f'Loading FAISS index from: {self.faiss_index_path}')
-      self.faiss_index = FAISS.load_local(self.faiss_index_path, embeddings, allow_dangerous_deserialization=True)
-      print('FAISS index loaded successfully.')
+      self._activate(self._load_index())
+      self.load_error = None
     except Exception as e:
       print(f'ERROR: Failed to load FAISS index from {self.faiss_index_path}. Exception: {e}')
       print('Please ensure the index has been built using build_index.py before running the application.')
-      self.faiss_index = None
+      self.active_index = None
+      self.load_error = str(e)
+    self.load_seconds = time.perf_counter() - started
+    self.index_load_seconds = self.load_seconds - self.model_load_seconds
+
+  def load_in_background(self, warm=True):
+    """
+    Starts load_faiss_index, then warm_up, on a thread and returns it; for a
+    ChatBot created with load=False. ready is set when both are done or
+    loading failed, with the error in load_error.
+    """
+    def load():
+      try:
+        self.load_faiss_index()
+        if warm and self.active_index:
+          self.warm_up()
+        logger.info("ChatBot loaded", extra={"props": self.startup_stats()})
+      except Exception as e:
+        self.load_error = str(e)
+        logger.error(f"Failed to load the model and the index: {str(e)}", extra={
+          "props": {"error_type": type(e).__name__}
+        })
+      finally:
+        self.ready.set()
+    thread = threading.Thread(target=load, name="chatbot-load", daemon=True)
+    thread.start()
+    return thread
+
+  def startup_stats(self):
+    """Readiness and the time each startup step took, for the health checks."""
+    def seconds(value):
+      return round(value, 3) if value is not None else None
+    return {
+      "ready": self.ready.is_set(),
+      "index_loaded": bool(self.active_index),
+      "load_error": self.load_error,
+      "model_load_seconds": seconds(self.model_load_seconds),
+      "index_load_seconds": seconds(self.index_load_seconds),
+      "warmup_seconds": seconds(self.warmup_seconds),
+      # Heavy modules imported on first use, see lazy_imports.py
+      "deferred_imports": deferred_imports()
+    }
+
+  def _load_index(self):
+    """Loads the version FAISS_INDEX_PATH points to as a LoadedIndex, without activating it."""
+    # Taken first, so that a version published during the load is noticed afterwards
+    marker = version_marker(self.index_root)
+    path = resolve_index_path(self.index_root)
+    print(f'Loading FAISS index from: {path}')
+    sharded = load_shards(path)
+    if sharded:
+      check_compatible(manifest_embedding(sharded), self.embedding)
+      shards = {}
+      for name, shard in sharded["shards"].items():
+        shard_path = os.path.join(path, shard["path"])
+        shards[name] = self._load_part(shard_path, load_manifest(shard_path) or {}, shard["sources"])
+      index = LoadedIndex(
+        path, sharded.get("version"), config=sharded.get("index", {"type": "flat", "params": {}}),
+        store_format=next(iter(shards.values())).store_format if shards else None, shards=shards
+      )
+      print(f'FAISS index loaded successfully ({len(shards)} shards: {", ".join(shards)}).')
+    else:
+      manifest = load_manifest(path) or {}
+      if manifest:
+        check_compatible(manifest_embedding(manifest), self.embedding)
+      index = self._load_part(path, manifest)
+      print(f'FAISS index loaded successfully ({index.config["type"]}, version {index.version}).')
+    index.marker = marker
+    # Every load starts a new generation, which invalidates the query cache
+    self.index_generation += 1
+    index.generation = self.index_generation
+    return index
+
+  def _load_part(self, path, manifest, sources=None):
+    """The vector store in path with its sidecars, in the format INDEX_FORMAT selects."""
+    if self.index_format == "compact" or (self.index_format == "auto" and manifest.get("compact")):
+      # Memory-mapped codes and an Arrow docstore read row by row, nothing is unpickled
+      store, store_format = load_compact(path, self.embeddings), "compact"
+    elif self.faiss_mmap:
+      store, store_format = self._load_mapped_store(path, self.embeddings), "pickle"
+    else:
+      store, store_format = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True), "pickle"
+    # Search settings (efSearch, nprobe) chosen at build time live in the manifest
+    config = manifest.get("index", {"type": "flat", "params": {}})
+    apply_search_params(store.index, config)
+    # Stored vectors are read back to spot near-duplicate passages
+    enable_reconstruct(store.index, config)
+    return LoadedIndex(
+      path, manifest.get("version"), store, config,
+      # Year, region, source, attack class and industry columns used by filtered searches
+      AttributeIndex.load(path),
+      # BM25 postings for the lexical and hybrid retrieval modes
+      BM25Index.load(path),
+      store_format,
+      sources=sources
+    )
+
+  def _activate(self, index):
+    # A single reference assignment: a query reads active_index once and keeps that version
+    self.active_index = index
+    self.faiss_index_path = index.path
 
-  def busca_contexto(self, query):
-    if not self.faiss_index:
+  def _load_mapped_store(self, path, embeddings):
+    """FAISS.load_local, with the index vectors memory-mapped read-only."""
+    index = read_mapped_index(path)
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+      docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+  def reload_index(self, warm=True):
+    """
+    Loads the index FAISS_INDEX_PATH points to now, next to the active one,
+    warms it up and swaps it in. The embedding model is kept. Queries that
+    already started finish on the previous version, which is freed when the
+    last of them returns. On failure the error is logged and raised and the
+    active version keeps serving. Returns the new version.
+    """
+    with self._reload_lock:
+      started = time.perf_counter()
+      previous = self.index_version
+      try:
+        index = self._load_index()
+        if warm:
+          self._warm_index(index)
+      except Exception as e:
+        self.reload_failures += 1
+        self.last_reload_error = str(e)
+        logger.error(f"Index reload failed: {str(e)}", extra={
+          "props": {"error_type": type(e).__name__, "index_version": previous}
+        })
+        raise
+      self._activate(index)
+      self.reloads += 1
+      self.last_reload_error = None
+      logger.info("Index reloaded", extra={
+        "props": {
+          "index_version": index.version,
+          "previous_index_version": previous,
+          "documents": index.documents,
+          "reload_seconds": round(time.perf_counter() - started, 3)
+        }
+      })
+      return index.version
+
+  def reload_in_background(self):
+    """Starts reload_index on a thread, e.g. from a signal handler."""
+    def reload():
+      try:
+        self.reload_index()
+      except Exception:
+        pass
+    thread = threading.Thread(target=reload, name="index-reload", daemon=True)
+    thread.start()
+    return thread
+
+  def _warm_index(self, index, query="ransomware attack on a water utility"):
+    """
+    One search on a version that is not active yet, touching the pages of
+    its index, docstore and sidecars. Nothing goes to the query cache or
+    the latency histograms.
+    """
+    vectors = np.asarray(self.embeddings.embed_documents([query]), dtype=np.float32)
+    for part in index.parts():
+      _, labels = part.store.index.search(vectors, self.context_candidates)
+      for label in labels[0]:
+        if label != -1:
+          part.store.docstore.search(part.store.index_to_docstore_id[int(label)])
+          part.store.index.reconstruct(int(label))
+      if part.lexical is not None:
+        part.lexical.search(query, self.k)
+
+  def warm_up(self, query="ransomware attack on a water utility"):
+    """
+    Runs one embedding and one search so that lazy initialisation in torch and
+    FAISS happens at startup instead of on the first user message.
+    Returns the time it took in seconds.
+    """
+    started = time.perf_counter()
+    self.busca_contexto(query)
+    self.warmup_seconds = time.perf_counter() - started
+    # The cold warm-up timings would skew the latency histograms
+    self.latency.clear()
+    return self.warmup_seconds
+
+  def busca_contexto(self, query, filters=None, mode=None):
+    """
+    Returns the contents of the k documents closest to the query. filters
+    restricts the search to documents matching all of them, e.g.
+    {"regions": ["Europe"], "year_from": 2022}; see attribute_index.FILTER_KEYS.
+    mode overrides RETRIEVAL_MODE for this call (vector, lexical or hybrid).
+    """
+    if not self.active_index:
         print("FAISS index is not loaded. Cannot perform search.")
         return []
-    results = self.faiss_index.similarity_search(query, k= self.k)
-    return [result.page_content for result in results]
+    if self.micro_batcher is not None and not filters and mode is None:
+      # The micro-batcher fetches the context candidates, the best k come first
+      return list(self._submit(query)["contents"][:self.k])
+    return self.busca_contexto_batch([query], filters=filters, mode=mode)[0]
+
+  def busca_contexto_batch(self, queries, k=None, filters=None, mode=None):
+    """
+    Returns the contexts of several queries at once, in the same order.
+    Queries missing from the cache are embedded in one batched forward pass
+    and searched with a single multi-query FAISS call.
+    """
+    index = self.active_index
+    if not index:
+        print("FAISS index is not loaded. Cannot perform search.")
+        return [[] for _ in queries]
+    entries = self._entries(index, queries, k or self.k, filters, mode or self.retrieval_mode)
+    return [list(entry["contents"]) for entry in entries]
+
+  def _batched_entries(self, queries):
+    """Micro-batcher handler: the entries of a batch, each with the stage timings of the whole batch."""
+    with self.latency.request() as batch:
+      entries = self._entries(self.active_index, queries, self.context_candidates, None, self.retrieval_mode)
+    return [(entry, batch["timings"]) for entry in entries]
+
+  def _submit(self, query):
+    """Entry of a query served by the micro-batcher. Its batch's embed and search time count towards the caller's request."""
+    entry, timings = self.micro_batcher.submit(query)
+    self.latency.attribute(timings)
+    return entry
+
+  def _entries(self, index, queries, k, filters, mode):
+    """Cache entries (query vector, docstore ids, contents) of the queries, searching the missing ones in index."""
+    generation = index.generation
+    normalized = [QueryCache.normalize(query) for query in queries]
+    search_key = mode + (json.dumps(filters, sort_keys=True) if filters else "")
+
+    # Repeated questions are answered from the cache without touching the model or the index
+    entries, originals = {}, {}
+    for query, original in zip(normalized, queries):
+      if query not in entries:
+        entries[query] = self.query_cache.get((query, search_key), k, generation)
+        originals[query] = original
+    missing = [query for query, entry in entries.items() if entry is None]
+
+    if missing:
+      # The normalized text is only the cache key, the model sees the query as it was asked
+      vectors, results = self._retrieve(index, [originals[query] for query in missing], k, filters, mode)
+      for query, vector, hits in zip(missing, vectors, results):
+        entries[query] = {
+          "generation": generation,
+          "vector": vector,
+          "ids": [docstore_id for docstore_id, _, _ in hits],
+          "contents": [document.page_content for _, document, _ in hits]
+        }
+        self.query_cache.put((query, search_key), k, generation, entries[query])
+    return [entries[query] for query in normalized]
 
+  def retrieve(self, queries, k=None, filters=None, mode=None):
+    """
+    Uncached retrieval: per query, a list of (docstore_id, document, score)
+    tuples, best first. The score is an L2 distance in vector mode, a BM25
+    score in lexical mode and a fused reciprocal rank score in hybrid mode.
+    """
+    return self._retrieve(self.active_index, queries, k or self.k, filters, mode or self.retrieval_mode)[1]
 
-  def llamaResponse(self, query):
+  def _retrieve(self, index, queries, k, filters, mode):
+    if mode not in RETRIEVAL_MODES:
+      raise ValueError(f"Unknown retrieval mode '{mode}'. Use: {', '.join(RETRIEVAL_MODES)}")
+    if mode != "vector" and not index.has_lexical:
+      raise ValueError("This index has no lexical index. Rebuild it with build_index.py to use lexical or hybrid retrieval.")
+    if mode == "lexical":
+      with self.latency.span("search"):
+        return [None] * len(queries), [self._search_lexical(index, query, k, filters) for query in queries]
+
+    with self.latency.span("embed"):
+      vectors = self.embeddings.embed_documents(queries)
+    if mode == "vector":
+      with self.latency.span("search"):
+        return vectors, self._search_vectors(index, vectors, k, filters)
+
+    candidates = k * HYBRID_CANDIDATES
+    with self.latency.span("search"):
+      dense_results = self._search_vectors(index, vectors, candidates, filters)
+      lexical_results = [self._search_lexical(index, query, candidates, filters) for query in queries]
+    results = []
+    for dense, lexical in zip(dense_results, lexical_results):
+      documents = {docstore_id: document for docstore_id, document, _ in dense + lexical}
+      fused = reciprocal_rank_fusion([[hit[0] for hit in dense], [hit[0] for hit in lexical]])
+      results.append([(docstore_id, documents[docstore_id], score) for docstore_id, score in fused[:k]])
+    return vectors, results
+
+  def _matching_ids(self, index, filters):
+    if index.attributes is None:
+      raise ValueError("This index has no attribute index. Rebuild it with build_index.py to use filters.")
+    return index.attributes.matching_ids(filters)
+
+  def _fan_out(self, search, parts):
+    """Runs search on every part, on the shard search threads when there are several."""
+    if len(parts) == 1:
+      return [search(parts[0])]
+    if self._shard_pool is None:
+      with self._client_lock:
+        if self._shard_pool is None:
+          self._shard_pool = ThreadPoolExecutor(self.shard_search_threads, thread_name_prefix="shard-search")
+    # FAISS releases the GIL while it searches, so the shards are scanned concurrently
+    return list(self._shard_pool.map(search, parts))
+
+  def _search_lexical(self, index, query, k, filters=None):
+    """
+    BM25 search of one query, as a list of (docstore_id, document, score)
+    tuples. The top k of every shard are merged by score; each shard scores
+    with its own document frequencies.
+    """
+    results = self._fan_out(lambda part: self._search_part_lexical(part, query, k, filters), index.parts(filters))
+    if len(results) == 1:
+      return results[0]
+    return heapq.nlargest(k, (hit for hits in results for hit in hits), key=lambda hit: hit[2])
+
+  def _search_part_lexical(self, index, query, k, filters):
+    allowed = self._matching_ids(index, filters) if filters else None
+    faiss_ids, scores = index.lexical.search(query, k, allowed)
+    store = index.store
+    hits = []
+    for faiss_id, score in zip(faiss_ids, scores):
+      docstore_id = store.index_to_docstore_id[int(faiss_id)]
+      hits.append((docstore_id, store.docstore.search(docstore_id), float(score)))
+    return hits
+
+  def _search_vectors(self, index, vectors, k, filters=None):
+    """
+    Searches all query vectors with one FAISS call and returns, per query,
+    a list of (docstore_id, document, distance) tuples. With filters, the
+    matching ids are taken from the attribute index and passed to FAISS as
+    a selector, so only matching documents are visited. A sharded index is
+    searched shard by shard in parallel and the k nearest overall are kept.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    results = self._fan_out(lambda part: self._search_part_vectors(part, matrix, k, filters), index.parts(filters))
+    if not results:
+      # The filter excludes every shard
+      return [[] for _ in matrix]
+    if len(results) == 1:
+      return results[0]
+    return [
+      heapq.nsmallest(k, (hit for hits in query_hits for hit in hits), key=lambda hit: hit[2])
+      for query_hits in zip(*results)
+    ]
+
+  def _search_part_vectors(self, index, matrix, k, filters):
+    store = index.store
+    if not filters:
+      distances, labels = store.index.search(matrix, k)
+    else:
+      matching = self._matching_ids(index, filters)
+      if len(matching) == 0:
+        return [[] for _ in matrix]
+      if len(matching) <= EXACT_FILTER_LIMIT:
+        distances, labels = search_subset(store.index, matrix, matching, k)
+      else:
+        selector = AttributeIndex.selector(matching)
+        distances, labels = store.index.search(matrix, k, params=search_parameters(index.config, selector))
+    results = []
+    for row_distances, row_labels in zip(distances, labels):
+      hits = []
+      for distance, label in zip(row_distances, row_labels):
+        if label == -1:
+          # Fewer than k documents in the index
+          continue
+        docstore_id = store.index_to_docstore_id[int(label)]
+        hits.append((docstore_id, store.docstore.search(docstore_id), float(distance)))
+      results.append(hits)
+    return results
+
+  def _groq_options(self):
+    """
+    Settings shared by the sync and async clients. GROQ_BASE_URL points the
+    clients at another server (e.g. groq_stub.py), GROQ_TIMEOUT and
+    GROQ_CONNECT_TIMEOUT are in seconds, and GROQ_MAX_CONNECTIONS /
+    GROQ_MAX_KEEPALIVE bound the connection pool.
+    """
     api_key = os.environ.get("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY environment variable not set.")
-    client = Groq(
-        # This is the default and can be omitted
-        api_key=api_key,
+    options = {
+      "api_key": api_key,
+      "base_url": os.environ.get("GROQ_BASE_URL") or None,
+      # Retries go through the scheduler, which spaces them out for every session
+      "max_retries": 0,
+      "timeout": httpx.Timeout(
+        float(os.environ.get("GROQ_TIMEOUT", "60")),
+        connect=float(os.environ.get("GROQ_CONNECT_TIMEOUT", "5"))
+      )
+    }
+    limits = httpx.Limits(
+      max_connections=int(os.environ.get("GROQ_MAX_CONNECTIONS", "20")),
+      max_keepalive_connections=int(os.environ.get("GROQ_MAX_KEEPALIVE", "10")),
+      keepalive_expiry=30
     )
+    return options, limits
 
-    chat_completion = client.chat.completions.create(
+  def _groq_client(self):
+    """Returns the long-lived Groq client, created on first use."""
+    with self._client_lock:
+      if self._client is None:
+        options, limits = self._groq_options()
+        self._client = Groq(http_client=DefaultHttpxClient(limits=limits), **options)
+      return self._client
 
-        messages=[
+  async def _async_groq_client(self):
+    """
+    Returns the AsyncGroq client of the running event loop. httpx async pools
+    are bound to the loop that opened their connections, so each loop gets
+    its own client, closed when the loop shuts down its async generators
+    (asyncio.run does on exit) or by close(), whichever comes first.
+    """
+    loop = asyncio.get_running_loop()
+    with self._client_lock:
+      entry = self._async_clients.get(loop)
+      if entry is None:
+        options, limits = self._groq_options()
+        client = AsyncGroq(http_client=DefaultAsyncHttpxClient(limits=limits), **options)
+        entry = self._async_clients[loop] = (client, self._closing_with_loop(loop, client))
+      else:
+        return entry[0]
+    # The first step registers the generator with the loop
+    await entry[1].asend(None)
+    return entry[0]
+
+  async def _closing_with_loop(self, loop, client):
+    """Holds the client of loop until the generator is closed, then drops and closes it."""
+    try:
+      yield
+    finally:
+      with self._client_lock:
+        self._async_clients.pop(loop, None)
+      await client.close()
+
+  def close(self):
+    """Closes the pooled Groq connections, the shard search threads and the answer cache."""
+    if self.answer_cache is not None:
+      self.answer_cache.close()
+      self.answer_cache = None
+    with self._client_lock:
+      if self._client is not None:
+        self._client.close()
+        self._client = None
+      async_clients, self._async_clients = self._async_clients, {}
+      if self._shard_pool is not None:
+        self._shard_pool.shutdown(wait=False)
+        self._shard_pool = None
+    # Each async client is closed on its own loop
+    for loop, (_, closer) in async_clients.items():
+      if loop.is_closed():
+        # Its connections went with the loop, which skipped shutdown_asyncgens
+        continue
+      if not loop.is_running():
+        loop.run_until_complete(closer.aclose())
+      elif loop is _running_loop():
+        loop.create_task(closer.aclose())
+      else:
+        asyncio.run_coroutine_threadsafe(closer.aclose(), loop)
+
+  def build_context(self, query, filters=None, mode=None):
+    """
+    Assembles the prompt context: over-fetches CONTEXT_CANDIDATES passages,
+    drops near-duplicates (the same incident reported by several sources)
+    with maximal marginal relevance over their stored vectors, and fills
+    CONTEXT_TOKEN_BUDGET with the rest using the token counts computed at
+    build time. Passages are written one per line with their source tag.
+    """
+    index = self.active_index
+    if not index:
+        print("FAISS index is not loaded. Cannot perform search.")
+        return ""
+    if self.micro_batcher is not None and not filters and mode is None:
+      entry = self._submit(query)
+    else:
+      entry = self._entries(index, [query], self.context_candidates, filters, mode or self.retrieval_mode)[0]
+    if entry["generation"] != index.generation:
+      # The batch was searched on a version swapped in since this query started
+      entry = self._entries(index, [query], self.context_candidates, None, self.retrieval_mode)[0]
+    documents = [index.document(docstore_id) for docstore_id in entry["ids"]]
+    if not documents:
+      return ""
+
+    budget = self.context_token_budget
+    tokens = [min(passage_tokens(document), budget) for document in documents]
+    vectors = [index.vector(docstore_id) for docstore_id in entry["ids"]]
+    selected, duplicates = select_passages(
+      vectors, tokens, budget, entry["vector"], self.context_mmr_lambda, self.context_duplicate_threshold
+    )
+    passages = []
+    for i in selected:
+      document = documents[i]
+      if passage_tokens(document) > budget:
+        text_budget = budget - count_tokens(passage_tag(document) + " \n")
+        document = Document(page_content=truncate(document.page_content, text_budget), metadata=document.metadata)
+      passages.append(format_passage(document))
+    context = "\n".join(passages)
+
+    # What the prompt used to hold: the repr of the top-k contents
+    naive_tokens = count_tokens(str(entry["contents"][:self.k]))
+    context_tokens = count_tokens(context)
+    logger.info("Context packed", extra={
+      "props": {
+        "candidates": len(documents),
+        "passages": len(passages),
+        "duplicates_dropped": duplicates,
+        "context_tokens": context_tokens,
+        "naive_context_tokens": naive_tokens,
+        "prompt_tokens_saved": naive_tokens - context_tokens
+      }
+    })
+    return context
+
+  def _build_messages(self, query):
+    with self.latency.span("prompt_build"):
+      return self._prompt_messages(query)
+
+  def _prompt_messages(self, query):
+    return [
 
             {
                 "role": "system",
@@ -61,7 +913,8 @@ class ChatBot():
                 Please, only answer the question with the context provided, not with your knowledge. If the context
                 do not provide the answer to the user question just say 'I don't know'.
 
-                The context is: {self.busca_contexto(query)}
+                The context is:
+{self.build_context(query)}
                 """
             },
 
@@ -73,10 +926,175 @@ class ChatBot():
 
             }
 
-        ],
+        ]
 
-        model="llama-3.3-70b-versatile",
+  def _answer_key(self, query, messages):
+    """Answers are reused for the same question, context, model and index version."""
+    index = self.active_index
+    version = (index.version or index.marker) if index else None
+    return answer_key(QueryCache.normalize(query), messages[0]["content"], self.llm_model, version)
 
-    )
+  def _cached_answer(self, key):
+    return self.answer_cache.get(key) if self.answer_cache is not None else None
+
+  def _store_answer(self, key, answer):
+    if self.answer_cache is not None:
+      self.answer_cache.put(key, answer, self.llm_model, self.index_version)
+
+  def _request_tokens(self, messages):
+    """Tokens a request is expected to cost: its prompt plus LLM_COMPLETION_TOKENS."""
+    return sum(count_tokens(message["content"]) for message in messages) + self.llm_completion_tokens
+
+  def llamaResponse(self, query, request_id=None, session=None):
+    """
+    The answer to query. session (e.g. a UI session or API client) is the
+    key the LLM scheduler queues requests fairly by.
+    """
+    with self.latency.request(request_id) as request:
+      messages = self._build_messages(query)
+      key = self._answer_key(query, messages)
+      answer, source = self._cached_answer(key), "cache"
+      if answer is None:
+        flight, leader = self.single_flight.join(key)
+        with self.latency.span("llm_total"):
+          if leader:
+            try:
+              raw = self.llm_scheduler.call(
+                # The client is only created when Groq is actually asked
+                lambda: self._groq_client().chat.completions.with_raw_response.create(
+
+                    messages=messages,
+
+                    model=self.llm_model,
+
+                ),
+                session, self._request_tokens(messages), request=request
+              )
+              chat_completion = raw.parse()
+            except Exception as e:
+              self.single_flight.finish(key, flight, e)
+              raise
+            answer, source = chat_completion.choices[0].message.content, "llm"
+            flight.add(answer)
+            self.single_flight.finish(key, flight)
+            self._store_answer(key, answer)
+          else:
+            # Another request is asking the same question right now
+            answer, source = flight.result(), "coalesced"
+    self._log_request("LLM response finished", request, answer_source=source)
+
+    return answer
+
+  async def allamaResponse(self, query, request_id=None, session=None):
+    """
+    Async counterpart of llamaResponse. Retrieval runs in a worker thread
+    and the completion is awaited on the async client, so concurrent
+    sessions do not each hold a thread while Groq generates.
+    """
+    with self.latency.request(request_id) as request:
+      # to_thread copies the context, so the thread's spans land in this request
+      messages = await asyncio.to_thread(self._build_messages, query)
+      key = self._answer_key(query, messages)
+      answer, source = self._cached_answer(key), "cache"
+      if answer is None:
+        flight, leader = self.single_flight.join(key)
+        with self.latency.span("llm_total"):
+          if leader:
+            try:
+              async def send():
+                client = await self._async_groq_client()
+                return await client.chat.completions.with_raw_response.create(
+                    messages=messages,
+                    model=self.llm_model,
+                )
+              raw = await self.llm_scheduler.acall(
+                send,
+                session, self._request_tokens(messages), request=request
+              )
+              chat_completion = await raw.parse()
+            except Exception as e:
+              self.single_flight.finish(key, flight, e)
+              raise
+            answer, source = chat_completion.choices[0].message.content, "llm"
+            flight.add(answer)
+            self.single_flight.finish(key, flight)
+            self._store_answer(key, answer)
+          else:
+            answer, source = await asyncio.wrap_future(flight.future), "coalesced"
+    self._log_request("LLM response finished", request, answer_source=source)
+
+    return answer
+
+  def _log_request(self, message, request, **props):
+    """One structured line per request with the timing of every stage, e.g. embed_ms, llm_total_ms."""
+    logger.info(message, extra={
+      "props": {
+        "request_id": request["request_id"],
+        "llm_model": self.llm_model,
+        **request["timings"],
+        **props
+      }
+    })
+
+  def llamaResponseStream(self, query, request_id=None, session=None):
+    """
+    Yields the answer in pieces as Groq generates them. Stage timings,
+    including time to the first token and total generation time, are logged
+    once the stream is finished. A cached answer comes in one piece, and a
+    question already being answered follows that stream.
+    """
+    with self.latency.request(request_id) as request:
+      messages = self._build_messages(query)
+      key = self._answer_key(query, messages)
+      cached = self._cached_answer(key)
+    if cached is not None:
+      self._log_request("LLM stream finished", request, stream_chunks=1, answer_source="cache")
+      yield cached
+      return
+
+    flight, leader = self.single_flight.join(key)
+    started = time.perf_counter()
+    first_token = True
+    chunks = 0
+    holds_slot = False
+    try:
+      if leader:
+        # The scheduler slot is held until the stream is read to the end
+        raw = self.llm_scheduler.call(
+          lambda: self._groq_client().chat.completions.with_raw_response.create(
+              messages=messages,
+              model=self.llm_model,
+              stream=True,
+          ),
+          session, self._request_tokens(messages), keep_slot=True, request=request
+        )
+        holds_slot = True
+        contents = (chunk.choices[0].delta.content for chunk in raw.parse() if chunk.choices)
+      else:
+        contents = iter(flight)
+      for content in contents:
+        if not content:
+          continue
+        if leader:
+          flight.add(content)
+        if first_token:
+          self.latency.record("llm_first_token", (time.perf_counter() - started) * 1000, request)
+          first_token = False
+        chunks += 1
+        yield content
+    except BaseException as e:
+      if leader:
+        # Followers get the error too; a stream closed by its reader counts as one
+        error = e if isinstance(e, Exception) else RuntimeError("The answer stream was closed before it finished")
+        self.single_flight.finish(key, flight, error)
+      raise
+    finally:
+      if holds_slot:
+        self.llm_scheduler.release()
+    if leader:
+      self.single_flight.finish(key, flight)
+      self._store_answer(key, "".join(flight.chunks))
 
-    return chat_completion.choices[0].message.content
+    self.latency.record("llm_total", (time.perf_counter() - started) * 1000, request)
+    self._log_request("LLM stream finished", request, stream_chunks=chunks,
+                      answer_source="llm" if leader else "coalesced")
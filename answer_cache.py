@@ -0,0 +1,233 @@
+"""
+Answers of the LLM, reused for identical questions.
+
+AnswerCache keeps answers in a SQLite file shared by every process serving
+the index, keyed on the normalized question, the prompt context it was
+answered from, the model and the index version. Entries expire after a TTL
+and the least recently used ones are evicted beyond max_entries.
+
+SingleFlight coalesces identical questions asked at the same time: the
+first caller asks the LLM, and the others wait for its answer, or follow
+its stream, instead of sending their own request.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+# Child of the "chatbot" logger configured in botInterface.py
+logger = logging.getLogger("chatbot.answer_cache")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    answer TEXT NOT NULL,
+    model TEXT,
+    index_version TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+"""
+
+
+def answer_key(query, context, model, index_version):
+    """
+    Cache key of an answer. query is expected normalized; context is the
+    packed prompt context, which stands for the retrieved passages and
+    their order.
+    """
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    payload = json.dumps([query, context_hash, model, index_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache():
+    """
+    SQLite answer cache. Lookups and writes never fail a request: a database
+    error is logged, counted and treated as a miss.
+    """
+
+    def __init__(self, path, ttl=86400.0, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        # Readers in other processes do not block writers
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def get(self, key):
+        """The cached answer, or None when it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._db.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] + self.ttl < now:
+                    self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+                    self.expired += 1
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._db.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                self._failed("lookup", e)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, answer, model=None, index_version=None):
+        if self.max_entries <= 0 or not answer:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers (key, answer, model, index_version, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, answer, model, index_version, now, now)
+                )
+                self.expired += self._db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,)).rowcount
+                excess = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self.evictions += self._db.execute(
+                        "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used LIMIT ?)", (excess,)
+                    ).rowcount
+            except sqlite3.Error as e:
+                self._failed("write", e)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM answers")
+
+    def _failed(self, operation, error):
+        self.errors += 1
+        logger.warning(f"Answer cache {operation} failed: {str(error)}", extra={
+            "props": {"error_type": type(error).__name__, "answer_cache_path": self.path}
+        })
+
+    def stats(self):
+        with self._lock:
+            try:
+                size = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            except sqlite3.Error:
+                size = None
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "size": size,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Flight():
+    """
+    One LLM call shared by every caller of the same key. The leader adds
+    the answer, whole or chunk by chunk, then finishes it; followers read it
+    with result(), by iterating over the chunks as they arrive, or by
+    awaiting future.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.error = None
+        self.done = False
+        self.future = Future()
+        self._changed = threading.Condition()
+
+    def add(self, chunk):
+        with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+        if error is None:
+            self.future.set_result("".join(chunk for chunk in self.chunks if chunk))
+        else:
+            self.future.set_exception(error)
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def __iter__(self):
+        sent = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(self.chunks) > sent or self.done)
+                chunks, done, error = self.chunks[sent:], self.done, self.error
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if done and sent == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight():
+    """
+    Registry of the flights in progress. join returns the flight of a key
+    and whether the caller leads it; the leader must call finish. Disabled,
+    every caller leads its own flight.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        with self._lock:
+            flight = self._flights.get(key) if self.enabled else None
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = Flight()
+            if self.enabled:
+                self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights)
+            }
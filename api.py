@@ -0,0 +1,427 @@
+"""
+Headless HTTP API over the RAG pipeline, for integrations that do not go
+through the Streamlit UI.
+
+    POST /query     {"query": "...", "stream": false}
+                    -> {"answer": "...", "request_id": "..."}, or with
+                    "stream": true server-sent events {"token": "..."}
+                    followed by {"done": true, "request_id": "..."}
+    POST /retrieve  {"query": "..." or "queries": [...], "k": 5, "filters": {...}, "mode": "hybrid"}
+                    -> {"results": [{"docstore_id", "source", "id", "year", "score", "content"}, ...]}
+    POST /reload    loads the index version FAISS_INDEX_PATH points to and swaps it in
+                    -> {"version": "...", "previous_version": "..."}
+    GET  /health    index, concurrency, latency and cache status of the worker,
+                    answered while the model and the index are still loading
+    GET  /ready     200 once the worker has loaded its index, 503 before
+
+Several worker processes accept connections on one listening socket. Each
+loads the index with FAISS_MMAP=1, so the vectors are mapped from
+index.faiss and shared through the page cache instead of copied into every
+worker. Each worker serves at most --max-concurrent requests at a time;
+requests that cannot get a slot within --queue-timeout seconds are answered
+503 with a Retry-After header. A worker accepts connections as soon as it
+starts and loads the model and the index in the background; until then
+/health reports "starting" and the other routes answer 503. SIGHUP makes every worker reload the index
+in the background; /reload only reaches the worker that accepts it.
+
+    python api.py --port 8000 --workers 4 --max-concurrent 8
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from RAG import ChatBot, RETRIEVAL_MODES
+from telemetry import new_request_id
+from log_shipping import setup_logging, shipping_stats
+
+# Child of the "chatbot" logger configured by log_shipping.setup_logging
+logger = logging.getLogger("chatbot.api")
+
+# Upper bound of "k" accepted by /retrieve
+MAX_K = 100
+
+
+class ApiError(Exception):
+    """A request the API refuses, answered with status and message."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Streamed tokens are small writes; without this Nagle's algorithm delays them
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/health":
+            self._send_json(200, self.server.api.health())
+        elif path == "/ready":
+            startup = self.server.api.chatbot.startup_stats()
+            ready = startup["ready"] and startup["index_loaded"]
+            self._send_json(200 if ready else 503, startup, None if ready else {"Retry-After": "1"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        api = self.server.api
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?")[0] == "/reload":
+            # Outside the request slots: loading takes long and must not wait behind queries
+            self._reload()
+            return
+        routes = {"/query": self._query, "/retrieve": self._retrieve}
+        route = routes.get(self.path.split("?")[0])
+        if route is None:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        if not api.slots.acquire(timeout=api.queue_timeout):
+            api._count("rejected")
+            self._send_json(503, {"error": "Too many concurrent requests"}, {"Retry-After": "1"})
+            return
+        api._count("in_flight")
+        try:
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                raise ApiError(400, "The request body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise ApiError(400, "The request body must be a JSON object")
+            if not api.chatbot.ready.is_set():
+                raise ApiError(503, "The model and the FAISS index are still loading", {"Retry-After": "1"})
+            if not api.chatbot.active_index:
+                raise ApiError(503, "The FAISS index is not loaded")
+            route(payload)
+            api._count("served")
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)}, e.headers)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            api._count("errors")
+            logger.error(f"Error serving {self.path}: {str(e)}", extra={
+                "props": {"error_type": type(e).__name__, "path": self.path}
+            })
+            self._send_json(500, {"error": "Internal error"})
+        finally:
+            api._count("in_flight", -1)
+            api.slots.release()
+
+    def _query(self, payload):
+        chatbot = self.server.api.chatbot
+        query = _text(payload.get("query"), "query")
+        request_id = new_request_id()
+        # The LLM scheduler serves waiting sessions in turn; by default each client address is one
+        session = str(payload.get("session") or self.client_address[0])
+        if not payload.get("stream"):
+            answer = chatbot.llamaResponse(query, request_id=request_id, session=session)
+            self._send_json(200, {"answer": answer, "request_id": request_id})
+            return
+
+        tokens = chatbot.llamaResponseStream(query, request_id=request_id, session=session)
+        # Errors before the first token are still answered with a status code
+        first = next(tokens, None)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            if first is not None:
+                self._write_event({"token": first})
+                for token in tokens:
+                    self._write_event({"token": token})
+            self._write_event({"done": True, "request_id": request_id})
+        except (BrokenPipeError, ConnectionResetError):
+            raise
+        except Exception as e:
+            # The status line is gone, report the failure in the stream itself
+            logger.error(f"Error streaming an answer: {str(e)}", extra={
+                "props": {"error_type": type(e).__name__, "request_id": request_id}
+            })
+            self._write_event({"error": "Internal error", "request_id": request_id})
+        self._write_chunk(b"")
+
+    def _retrieve(self, payload):
+        chatbot = self.server.api.chatbot
+        if "queries" in payload:
+            queries = payload["queries"]
+            if not isinstance(queries, list) or not queries:
+                raise ApiError(400, "'queries' must be a non-empty list of strings")
+            queries = [_text(query, "queries") for query in queries]
+        else:
+            queries = [_text(payload.get("query"), "query")]
+        k = payload.get("k", chatbot.k)
+        if not isinstance(k, int) or not 0 < k <= MAX_K:
+            raise ApiError(400, f"'k' must be an integer between 1 and {MAX_K}")
+        filters = payload.get("filters")
+        if filters is not None and not isinstance(filters, dict):
+            raise ApiError(400, "'filters' must be an object")
+        mode = payload.get("mode")
+        if mode is not None and mode not in RETRIEVAL_MODES:
+            raise ApiError(400, f"'mode' must be one of: {', '.join(RETRIEVAL_MODES)}")
+
+        try:
+            results = chatbot.retrieve(queries, k, filters, mode)
+        except ValueError as e:
+            # Unknown filter keys or values, or filters on an index built without attributes
+            raise ApiError(400, str(e))
+        results = [[_passage(docstore_id, document, score) for docstore_id, document, score in hits] for hits in results]
+        self._send_json(200, {"results": results if "queries" in payload else results[0]})
+
+    def _reload(self):
+        chatbot = self.server.api.chatbot
+        if not chatbot.ready.is_set():
+            self._send_json(503, {"error": "The first index load is not over yet"}, {"Retry-After": "1"})
+            return
+        previous = chatbot.index_version
+        try:
+            version = chatbot.reload_index()
+        except Exception as e:
+            # Logged by reload_index; the previous version is still served
+            self._send_json(500, {"error": f"Index reload failed: {str(e)}", "version": previous})
+            return
+        self._send_json(200, {"version": version, "previous_version": previous})
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _write_event(self, event):
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+
+def _text(value, name):
+    if not isinstance(value, str) or not value.strip():
+        raise ApiError(400, f"'{name}' must be a non-empty string")
+    return value
+
+
+def _passage(docstore_id, document, score):
+    metadata = document.metadata
+    return {
+        "docstore_id": docstore_id,
+        "source": metadata.get("source"),
+        "id": metadata.get("id"),
+        "year": metadata.get("year"),
+        "duplicates": metadata.get("duplicates", []),
+        "score": float(score),
+        "content": document.page_content
+    }
+
+
+class ApiServer():
+    """
+    Serves one ChatBot over HTTP on a background thread, one thread per
+    connection. Use it as a context manager:
+
+        with ApiServer(ChatBot(), max_concurrent=8) as api:
+            httpx.post(api.base_url + "/query", json={"query": "..."})
+
+    A listening socket shared with other processes can be passed as sock.
+    """
+
+    def __init__(self, chatbot, host="127.0.0.1", port=0, max_concurrent=8, queue_timeout=5.0, sock=None):
+        self.chatbot = chatbot
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.in_flight = 0
+        self.served = 0
+        self.rejected = 0
+        self.errors = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+        if sock is None:
+            self._server = ThreadingHTTPServer((host, port), _ApiHandler)
+        else:
+            self._server = ThreadingHTTPServer(sock.getsockname()[:2], _ApiHandler, bind_and_activate=False)
+            self._server.socket.close()
+            self._server.socket = sock
+            self._server.server_address = sock.getsockname()[:2]
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def health(self):
+        chatbot = self.chatbot
+        index = chatbot.active_index
+        startup = chatbot.startup_stats()
+        return {
+            "status": "starting" if not startup["ready"] else "healthy" if index else "degraded",
+            "pid": os.getpid(),
+            "uptime_seconds": int(time.time() - self.started),
+            "index": {
+                "loaded": bool(index),
+                "type": (chatbot.index_config or {}).get("type"),
+                "documents": index.documents if index else 0,
+                "format": chatbot.store_format,
+                "memory_mapped": chatbot.faiss_mmap or chatbot.store_format == "compact",
+                "version": chatbot.index_version,
+                "reloads": chatbot.reloads,
+                "reload_failures": chatbot.reload_failures,
+                # Documents per shard of a sharded index
+                "shards": {name: int(shard.store.index.ntotal) for name, shard in index.shards.items()} if index and index.shards else None
+            },
+            # Readiness and model, index and warm-up times
+            "startup": startup,
+            "requests": {
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "served": self.served,
+                "rejected": self.rejected,
+                "errors": self.errors
+            },
+            "latency": chatbot.latency.snapshot(),
+            "query_cache": chatbot.query_cache.stats(),
+            "answer_cache": chatbot.answer_cache.stats() if chatbot.answer_cache else None,
+            "single_flight": chatbot.single_flight.stats(),
+            "llm_scheduler": chatbot.llm_scheduler.stats(),
+            "log_shipping": shipping_stats(logging.getLogger("chatbot"))
+        }
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def run_worker(sock, max_concurrent, queue_timeout):
+    """Loads the ChatBot in this process and serves the shared socket until killed."""
+    # Set up after the fork: the log shipping thread does not survive it
+    setup_logging()
+    # Connections are served at once: /health answers while the model and the index load
+    chatbot = ChatBot(load=False)
+    server = ApiServer(chatbot, max_concurrent=max_concurrent, queue_timeout=queue_timeout, sock=sock)
+    chatbot.load_in_background()
+    logger.info("API worker started", extra={"props": {"pid": os.getpid()}})
+    # kill -HUP on the master reloads the index in every worker, once the first load is over
+    signal.signal(signal.SIGHUP, lambda signum, frame: chatbot.reload_in_background() if chatbot.ready.is_set() else None)
+    server.serve_forever()
+
+
+def serve(host, port, workers, max_concurrent, queue_timeout):
+    """
+    Binds the listening socket and forks the workers, which all accept on it.
+    Workers that die are replaced until the server gets SIGINT or SIGTERM.
+    SIGHUP is passed on to the workers, which reload the index.
+    """
+    # Every worker maps the same index file instead of holding its own copy
+    os.environ.setdefault("FAISS_MMAP", "1")
+    sock = socket.create_server((host, port), backlog=128)
+    host, port = sock.getsockname()[:2]
+    print(f"API listening on http://{host}:{port} with {workers} workers", flush=True)
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # Until the worker has set up its ChatBot, a reload request has nothing to do
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            try:
+                run_worker(sock, max_concurrent, queue_timeout)
+            finally:
+                os._exit(1)
+        return pid
+
+    children = {fork_worker() for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"WARNING: API worker {pid} exited with status {status}, starting a new one", flush=True)
+            children.add(fork_worker())
+    sock.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="HTTP API over the RAG pipeline.")
+    parser.add_argument("--host", default=os.environ.get("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("API_WORKERS", "2")),
+                        help="worker processes sharing the listening socket and the mapped index")
+    parser.add_argument("--max-concurrent", type=int, default=int(os.environ.get("API_MAX_CONCURRENT", "8")),
+                        help="requests served at once by each worker")
+    parser.add_argument("--queue-timeout", type=float, default=float(os.environ.get("API_QUEUE_TIMEOUT", "5")),
+                        help="seconds a request waits for a slot before it is answered 503")
+    args = parser.parse_args()
+    if sys.platform == "win32":
+        sys.exit("api.py forks its workers and needs a POSIX system.")
+    serve(args.host, args.port, args.workers, args.max_concurrent, args.queue_timeout)
@@ -0,0 +1,143 @@
+import os
+import faiss
+import numpy as np
+
+# Name of the file written next to the FAISS index with the per-document attributes
+ATTRIBUTES_FILE = "attributes.npz"
+
+# Region flag columns shared by all datasets, one bit each in the regions bitmask
+REGIONS = ['Africa', 'Asia', 'Australia', 'Europe', 'North America', 'South America']
+
+# Categorical attributes stored as small integer codes (0 means missing)
+CATEGORICAL = ("source", "attack_class", "industry")
+
+# Filter keys accepted by AttributeIndex.mask and ChatBot.busca_contexto
+FILTER_KEYS = ("year_from", "year_to", "regions", "sources", "attack_classes", "industries")
+
+
+class AttributeIndex():
+    """
+    Columnar attributes of every indexed document, aligned on FAISS ids:
+    year (int16, 0 when unknown), a regions bitmask (uint8), dictionary
+    encoded source, attack class and industry (uint16 codes) and a sources
+    bitmask (uint64) over the source vocabulary. A document merged from
+    several reports (dedup.merge_cluster) has the bit of every contributing
+    source, so a "sources" filter finds it under any of them. Filters are
+    evaluated with numpy over these columns and turned into a FAISS id
+    selector, so a filtered search only visits the matching documents.
+    """
+
+    def __init__(self, faiss_ids, year, regions, codes, vocabularies, sources=None):
+        self.faiss_ids = faiss_ids
+        self.year = year
+        self.regions = regions
+        self.codes = codes
+        self.vocabularies = vocabularies
+        if sources is None:
+            # Files written before the bitmask: each row has its own source only
+            codes = self.codes["source"].astype(np.uint64)
+            sources = np.where(codes > 0, np.left_shift(np.uint64(1), np.maximum(codes, 1) - np.uint64(1)), np.uint64(0))
+        self.sources = sources
+
+    @classmethod
+    def from_documents(cls, faiss_ids, documents):
+        """Builds the columns from documents whose metadata carries the attributes."""
+        order = np.argsort(np.asarray(faiss_ids, dtype=np.int64), kind="stable")
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)[order]
+        metadata = [documents[i].metadata for i in order]
+
+        year = np.array([m.get("year") or 0 for m in metadata], dtype=np.int16)
+        regions = np.array(
+            [sum(1 << REGIONS.index(r) for r in m.get("regions", [])) for m in metadata],
+            dtype=np.uint8
+        )
+        codes, vocabularies = {}, {}
+        for field in CATEGORICAL:
+            values = [m.get(field) for m in metadata]
+            vocabularies[field] = sorted({v for v in values if v})
+            lookup = {value: code for code, value in enumerate(vocabularies[field], start=1)}
+            codes[field] = np.array([lookup.get(v, 0) for v in values], dtype=np.uint16)
+        row_sources = [set(m.get("sources") or []) | ({m["source"]} if m.get("source") else set()) for m in metadata]
+        vocabularies["source"] = sorted(set(vocabularies["source"]).union(*row_sources))
+        if len(vocabularies["source"]) > 64:
+            raise ValueError(f"At most 64 sources fit in the sources bitmask, got {len(vocabularies['source'])}")
+        lookup = {value: code for code, value in enumerate(vocabularies["source"], start=1)}
+        codes["source"] = np.array([lookup.get(m.get("source"), 0) for m in metadata], dtype=np.uint16)
+        sources = np.array([sum(1 << (lookup[name] - 1) for name in names) for names in row_sources], dtype=np.uint64)
+        return cls(faiss_ids, year, regions, codes, vocabularies, sources)
+
+    def save(self, faiss_index_path):
+        path = os.path.join(faiss_index_path, ATTRIBUTES_FILE)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            faiss_ids=self.faiss_ids,
+            year=self.year,
+            regions=self.regions,
+            sources=self.sources,
+            **{f"{field}_codes": self.codes[field] for field in CATEGORICAL},
+            **{f"{field}_names": np.array(self.vocabularies[field], dtype=str) for field in CATEGORICAL}
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, faiss_index_path):
+        """Loads the attributes saved next to an index, or None if there are none."""
+        path = os.path.join(faiss_index_path, ATTRIBUTES_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(
+                data["faiss_ids"],
+                data["year"],
+                data["regions"],
+                {field: data[f"{field}_codes"] for field in CATEGORICAL},
+                {field: data[f"{field}_names"].tolist() for field in CATEGORICAL},
+                data["sources"] if "sources" in data.files else None
+            )
+
+    def _codes_for(self, field, names):
+        wanted = {str(name).lower() for name in names}
+        return [code for code, value in enumerate(self.vocabularies[field], start=1) if value.lower() in wanted]
+
+    def mask(self, filters):
+        """
+        Boolean mask over the rows matching every given filter:
+        year_from / year_to (inclusive), and regions, sources, attack_classes
+        or industries as lists where any listed value matches.
+        """
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}. Use: {', '.join(FILTER_KEYS)}")
+        mask = np.ones(len(self.faiss_ids), dtype=bool)
+        if filters.get("year_from") is not None:
+            mask &= self.year >= int(filters["year_from"])
+        if filters.get("year_to") is not None:
+            mask &= (self.year <= int(filters["year_to"])) & (self.year > 0)
+        if filters.get("regions"):
+            bits = 0
+            for region in filters["regions"]:
+                matches = [i for i, name in enumerate(REGIONS) if name.lower() == str(region).lower()]
+                if not matches:
+                    raise ValueError(f"Unknown region '{region}'. Use: {', '.join(REGIONS)}")
+                bits |= 1 << matches[0]
+            mask &= (self.regions & bits) != 0
+        if filters.get("sources"):
+            bits = np.uint64(sum(1 << (code - 1) for code in self._codes_for("source", filters["sources"])))
+            mask &= (self.sources & bits) != 0
+        for key, field in (("attack_classes", "attack_class"), ("industries", "industry")):
+            if filters.get(key):
+                mask &= np.isin(self.codes[field], self._codes_for(field, filters[key]))
+        return mask
+
+    def matching_ids(self, filters):
+        """FAISS ids of the documents matching the filters."""
+        return self.faiss_ids[self.mask(filters)]
+
+    @staticmethod
+    def selector(faiss_ids):
+        """A bitmap id selector over the given FAISS ids."""
+        size = int(faiss_ids.max()) + 1 if len(faiss_ids) else 1
+        bitmap = np.zeros(size, dtype=bool)
+        bitmap[faiss_ids] = True
+        return faiss.IDSelectorBitmap(np.packbits(bitmap, bitorder="little"))
@@ -0,0 +1,1124 @@
+"""
+Benchmarks for the retrieval stack. Each subcommand prints a table and can
+write its results as JSON with --out.
+
+    python benchmark.py index        # recall@5, latency and size per FAISS index type
+    python benchmark.py retrieval    # quality and latency of vector, lexical and hybrid retrieval
+    python benchmark.py --out rag.json rag --query-file benchmark_queries.jsonl --baseline rag_main.json
+                                     # end-to-end RAG latency against a local Groq stub, fails on regressions
+    python benchmark.py api --workers 2 --concurrency 16 --requests 400
+                                     # load test of api.py (started here, with a local Groq stub) or of --url
+    python benchmark.py embeddings --backends torch onnx onnx_int8
+                                     # latency, throughput, RSS and retrieval agreement per embedding backend
+    python benchmark.py store        # cold start, RSS and row fetch time of the pickled and compact stores
+    python benchmark.py --out startup.json startup --baseline startup_main.json
+                                     # import time per module and model/index load time, fails on regressions
+    python benchmark.py --out load.json load --concurrency 10 50 200 --duration 30
+                                     # replays queries against the ChatBot at rising load, finds the saturation point
+"""
+import os
+import sys
+import json
+import time
+import types
+import pickle
+import resource
+import argparse
+import itertools
+import multiprocessing
+import tempfile
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from faiss_utils import load_manifest, index_config, make_index, training_size
+from context_packer import count_tokens
+from embedding_backends import EMBEDDING_BACKENDS, QUANTIZATIONS, embedding_config, embedding_kwargs, manifest_embedding, describe
+from groq_stub import GroqStubServer
+
+# Index configurations compared by `benchmark.py index` unless --configs is given
+DEFAULT_INDEX_CONFIGS = [
+    {"type": "flat"},
+    {"type": "hnsw", "M": 16, "efSearch": 32},
+    {"type": "hnsw", "M": 32, "efSearch": 64},
+    {"type": "hnsw", "M": 32, "efSearch": 128},
+    {"type": "ivf_flat", "nlist": 128, "nprobe": 4},
+    {"type": "ivf_flat", "nlist": 128, "nprobe": 16},
+    {"type": "ivf_pq", "nlist": 128, "nprobe": 16, "pq_m": 48},
+    {"type": "ivf_pq", "nlist": 128, "nprobe": 16, "pq_m": 96},
+]
+
+
+def percentiles(latencies_ms):
+    """p50/p95/p99 of a list of latencies in milliseconds."""
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+    }
+
+
+def recall_at_k(found, expected, k):
+    """Mean fraction of the expected top-k ids that were found."""
+    hits = [len(set(f[:k]) & set(e[:k])) / k for f, e in zip(found, expected)]
+    return round(float(np.mean(hits)), 4)
+
+
+def load_corpus_vectors(faiss_index_path):
+    """Reads the vectors and FAISS ids stored in a built index."""
+    stored = faiss.read_index(os.path.join(faiss_index_path, "index.faiss"))
+    if isinstance(stored, faiss.IndexIDMap2):
+        # `stored` owns the wrapped index and has to stay referenced while it is used
+        ids = faiss.vector_to_array(stored.id_map)
+        index = faiss.downcast_index(stored.index)
+    else:
+        ids = np.arange(stored.ntotal, dtype=np.int64)
+        index = stored
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        print("WARNING: reading vectors back from an IVF index, PQ codes are lossy. Benchmark from a flat index for exact figures.")
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal), ids
+
+
+def load_queries(args, vectors, manifest):
+    """
+    Query vectors: the embedded "query" field of every line of --query-file,
+    or else --queries corpus vectors with a little gaussian noise added.
+    """
+    if args.query_file:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        with open(args.query_file, "r", encoding="utf-8") as f:
+            texts = [json.loads(line)["query"] for line in f if line.strip()]
+        embedding = manifest_embedding(manifest)
+        embeddings = HuggingFaceEmbeddings(model_name=embedding["model_name"], **embedding_kwargs(embedding))
+        return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    rng = np.random.default_rng(args.seed)
+    picked = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    noise = rng.normal(scale=0.05 * float(vectors.std()), size=picked.shape)
+    return (picked + noise).astype(np.float32)
+
+
+def search_one_by_one(index, queries, k):
+    """Searches each query alone, like the chatbot does, and times every call."""
+    found, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, labels = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(labels[0].tolist())
+    return found, latencies
+
+
+def bench_index(args):
+    load_dotenv()
+    faiss_index_path = args.index_path or os.environ.get("FAISS_INDEX_PATH", "faiss_index")
+    manifest = load_manifest(faiss_index_path) or {}
+    vectors, ids = load_corpus_vectors(faiss_index_path)
+    queries = load_queries(args, vectors, manifest)
+    configs = json.loads(args.configs) if args.configs else DEFAULT_INDEX_CONFIGS
+    print(f"Benchmarking {len(configs)} index configurations on {len(vectors)} vectors with {len(queries)} queries")
+
+    exact = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+    exact.add_with_ids(vectors, ids)
+    expected, _ = search_one_by_one(exact, queries, args.k)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for spec in configs:
+            spec = dict(spec)
+            config = index_config(spec.pop("type"), **spec)
+            started = time.perf_counter()
+            index = make_index(config, vectors.shape[1])
+            if training_size(config):
+                sample = np.random.default_rng(args.seed).choice(len(vectors), size=min(training_size(config), len(vectors)), replace=False)
+                index.train(vectors[sample])
+            index.add_with_ids(vectors, ids)
+            build_seconds = time.perf_counter() - started
+
+            path = os.path.join(tmp, "index.faiss")
+            faiss.write_index(index, path)
+            found, latencies = search_one_by_one(index, queries, args.k)
+            results.append({
+                "type": config["type"],
+                "params": config["params"],
+                f"recall@{args.k}": recall_at_k(found, expected, args.k),
+                **percentiles(latencies),
+                "size_mb": round(os.path.getsize(path) / 2**20, 2),
+                "build_s": round(build_seconds, 2),
+            })
+
+    print(f"{'type':<9} {'params':<48} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8} {'size MB':>8} {'build s':>8}")
+    for row in results:
+        params = ", ".join(f"{name}={value}" for name, value in row["params"].items())
+        print(f"{row['type']:<9} {params:<48} {row[f'recall@{args.k}']:>9.3f} {row['p50_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['size_mb']:>8.2f} {row['build_s']:>8.2f}")
+    return {"benchmark": "index", "vectors": len(vectors), "queries": len(queries), "k": args.k, "results": results}
+
+
+def load_labelled_queries(args, index):
+    """
+    (query, relevant row keys) pairs: every line of --query-file with its
+    "query" and optional "expected" (or "relevant") row keys, e.g.
+    "ICSSTRIVE:12", or else --queries known-item queries made from random
+    documents: their identifier keywords plus a few words of their text,
+    with the document itself as the answer. Unlabelled queries get None.
+    """
+    if args.query_file:
+        with open(args.query_file, "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        return [(line["query"], set(line.get("expected") or line.get("relevant") or []) or None) for line in lines]
+    rng = np.random.default_rng(args.seed)
+    docstore_ids = [docstore_id for part in index.parts() for docstore_id in part.store.index_to_docstore_id.values()]
+    picked = rng.choice(len(docstore_ids), size=min(args.queries, len(docstore_ids)), replace=False)
+    queries = []
+    for i in picked:
+        queries.append((known_item_query(index.document(docstore_ids[i]), rng), {docstore_ids[i]}))
+    return queries
+
+
+def known_item_query(document, rng):
+    """A query made from a document: its identifier keywords plus six consecutive words of its text."""
+    words = str(document.page_content).split()
+    start = int(rng.integers(0, max(len(words) - 6, 1)))
+    text = " ".join(words[start:start + 6])
+    return f"{document.metadata.get('keywords') or ''} {text}".strip()
+
+
+def hit_rows(hits):
+    """Row keys behind each retrieved document, including the rows merged into it by --dedup."""
+    return [{docstore_id, *document.metadata.get("duplicates", [])} for docstore_id, document, _ in hits]
+
+
+def labelled_recall(found_rows, relevant, k):
+    """Share of the relevant rows found in the top k, out of at most k."""
+    found = set().union(*found_rows[:k]) if found_rows else set()
+    return min(1.0, len(found & relevant) / min(len(relevant), k))
+
+
+def bench_retrieval(args):
+    load_dotenv()
+    if args.index_path:
+        os.environ["FAISS_INDEX_PATH"] = args.index_path
+    from RAG import ChatBot
+    chatbot = ChatBot()
+    if chatbot.active_index is None:
+        sys.exit("The index could not be loaded, build it with build_index.py first.")
+    queries = load_labelled_queries(args, chatbot.active_index)
+    print(f"Benchmarking {', '.join(args.modes)} retrieval with {len(queries)} queries")
+
+    results = []
+    for mode in args.modes:
+        # One warm-up call so model and index initialisation are not timed
+        chatbot.retrieve([queries[0][0]], args.k, mode=mode)
+        found, latencies = [], []
+        for query, _ in queries:
+            started = time.perf_counter()
+            hits = chatbot.retrieve([query], args.k, mode=mode)[0]
+            latencies.append((time.perf_counter() - started) * 1000)
+            found.append(hit_rows(hits))
+        labelled = [(f, relevant) for f, (_, relevant) in zip(found, queries) if relevant]
+        hits_at_k = [labelled_recall(f, relevant, args.k) for f, relevant in labelled]
+        reciprocal_ranks = [
+            next((1 / rank for rank, rows in enumerate(f, start=1) if rows & relevant), 0.0)
+            for f, relevant in labelled
+        ]
+        results.append({
+            "mode": mode,
+            f"recall@{args.k}": round(float(np.mean(hits_at_k)), 4),
+            "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+            **percentiles(latencies),
+        })
+
+    print(f"{'mode':<8} {'recall@' + str(args.k):>9} {'MRR':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in results:
+        print(f"{row['mode']:<8} {row[f'recall@{args.k}']:>9.3f} {row['mrr']:>7.3f} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+    return {"benchmark": "retrieval", "queries": len(queries), "k": args.k, "results": results}
+
+
+# Metrics compared by --baseline, as (report key, sub key, higher is better)
+REGRESSION_METRICS = [
+    ("cold_start_s", None, False),
+    ("embed", "p95_ms", False),
+    ("search", "p95_ms", False),
+    ("end_to_end", "p95_ms", False),
+    ("end_to_end", "p99_ms", False),
+    ("prompt_tokens", "mean", False),
+    ("recall", None, True),
+]
+
+# Metrics of `benchmark.py startup` compared by --baseline
+STARTUP_REGRESSION_METRICS = [
+    ("import_s", None, False),
+    ("model_load_s", None, False),
+    ("index_load_s", None, False),
+    ("ready_s", None, False),
+]
+
+# Latency differences below this many milliseconds are noise, not regressions
+LATENCY_SLACK_MS = 1.0
+
+
+def find_regressions(report, baseline, tolerance=0.2, recall_tolerance=0.02, metrics=REGRESSION_METRICS):
+    """
+    Compares a rag (or startup) report with a baseline one. Costs may grow
+    by at most tolerance (relative), recall may drop by at most
+    recall_tolerance (absolute). Returns a description of every regression.
+    """
+    regressions = []
+    for key, sub_key, higher_is_better in metrics:
+        current, previous = report.get(key), baseline.get(key)
+        if sub_key is not None:
+            current = current.get(sub_key) if current else None
+            previous = previous.get(sub_key) if previous else None
+        if current is None or previous is None:
+            continue
+        name = f"{key}.{sub_key}" if sub_key else key
+        if higher_is_better:
+            if current < previous - recall_tolerance:
+                regressions.append(f"{name} dropped from {previous} to {current}")
+        else:
+            slack = LATENCY_SLACK_MS if name.endswith("_ms") else 0.0
+            if current > previous * (1 + tolerance) + slack:
+                regressions.append(f"{name} grew from {previous} to {current} (more than {tolerance:.0%})")
+    return regressions
+
+
+def bench_rag(args):
+    """
+    Runs the real ChatBot path, retrieval plus prompt assembly plus the Groq
+    client, against a real index and the local Groq stub. The query and
+    answer caches are disabled so every query is embedded, searched and sent.
+    """
+    load_dotenv()
+    if args.index_path:
+        os.environ["FAISS_INDEX_PATH"] = args.index_path
+    os.environ["QUERY_CACHE_SIZE"] = "0"
+    os.environ.pop("ANSWER_CACHE_PATH", None)
+    with GroqStubServer(latency=args.llm_latency, tokens_per_second=args.tokens_per_second) as stub:
+        os.environ["GROQ_BASE_URL"] = stub.base_url
+        os.environ["GROQ_API_KEY"] = "stub"
+        from RAG import ChatBot
+        started = time.perf_counter()
+        chatbot = ChatBot()
+        if chatbot.active_index is None:
+            sys.exit("The index could not be loaded, build it with build_index.py first.")
+        chatbot.warm_up()
+        cold_start = time.perf_counter() - started
+        queries = load_labelled_queries(args, chatbot.active_index)
+        print(f"Benchmarking the RAG path with {len(queries)} queries (cold start {cold_start:.2f}s)")
+
+        embed_ms, search_ms, total_ms, prompt_tokens, recalls = [], [], [], [], []
+        for query, expected in queries:
+            started = time.perf_counter()
+            vectors = chatbot.embeddings.embed_documents([query])
+            embed_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            # Fans out over the shards of a sharded index
+            chatbot._search_vectors(chatbot.active_index, vectors, args.k)
+            search_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            chatbot.llamaResponse(query)
+            total_ms.append((time.perf_counter() - started) * 1000)
+            prompt_tokens.append(sum(count_tokens(m["content"]) for m in stub.last_request["messages"]))
+
+            if expected:
+                recalls.append(labelled_recall(hit_rows(chatbot.retrieve([query], args.k)[0]), expected, args.k))
+        chatbot.close()
+
+    report = {
+        "benchmark": "rag",
+        "queries": len(queries),
+        "k": args.k,
+        "retrieval_mode": chatbot.retrieval_mode,
+        "cold_start_s": round(cold_start, 4),
+        "model_load_s": round(chatbot.model_load_seconds, 4),
+        "index_load_s": round(chatbot.index_load_seconds, 4),
+        "warmup_s": round(chatbot.warmup_seconds, 4),
+        "embed": percentiles(embed_ms),
+        "search": percentiles(search_ms),
+        "end_to_end": percentiles(total_ms),
+        "prompt_tokens": {
+            "mean": round(float(np.mean(prompt_tokens)), 1),
+            "p95": round(float(np.percentile(prompt_tokens, 95)), 1),
+            "max": int(max(prompt_tokens)),
+        },
+        "recall": round(float(np.mean(recalls)), 4) if recalls else None,
+        "labelled_queries": len(recalls),
+    }
+
+    print(f"{'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage in ("embed", "search", "end_to_end"):
+        row = report[stage]
+        print(f"{stage:<12} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+    print(f"prompt tokens: mean {report['prompt_tokens']['mean']}, max {report['prompt_tokens']['max']}")
+    if report["recall"] is not None:
+        print(f"recall@{args.k}: {report['recall']:.3f} over {len(recalls)} labelled queries")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = find_regressions(report, baseline, args.tolerance, args.recall_tolerance)
+        for regression in report["regressions"]:
+            print(f"REGRESSION: {regression}")
+    return report
+
+
+def start_api(args, stub):
+    """Starts api.py in a subprocess answering from the stub; returns the process and its base URL."""
+    env = dict(os.environ, GROQ_BASE_URL=stub.base_url, GROQ_API_KEY="stub", QUERY_CACHE_SIZE="0", ANSWER_COALESCE="0")
+    env.pop("ANSWER_CACHE_PATH", None)
+    if args.index_path:
+        env["FAISS_INDEX_PATH"] = args.index_path
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py"),
+        "--host", "127.0.0.1", "--port", "0", "--workers", str(args.workers),
+        "--max-concurrent", str(args.max_concurrent)
+    ]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("API listening on "):
+        process.kill()
+        sys.exit(f"api.py did not start: {line.strip()}")
+    # Keep draining the workers' logs so they never block on a full pipe
+    threading.Thread(target=lambda: [None for _ in process.stdout], daemon=True).start()
+    return process, line.split()[3]
+
+
+def wait_until_ready(url, workers, timeout=600):
+    """Polls /health until `workers` distinct worker processes have loaded and warmed up their index."""
+    ready = set()
+    deadline = time.monotonic() + timeout
+    while len(ready) < workers:
+        if time.monotonic() > deadline:
+            sys.exit(f"The API at {url} did not become ready in {timeout}s")
+        try:
+            health = httpx.get(url + "/health", timeout=5).json()
+            if health["status"] == "starting":
+                time.sleep(0.2)
+            elif health["index"]["loaded"]:
+                ready.add(health["pid"])
+            elif health["status"] == "degraded":
+                sys.exit("The API could not load the index, build it with build_index.py first.")
+        except httpx.HTTPError:
+            time.sleep(0.2)
+
+
+def bench_api(args):
+    """
+    Sends --requests /query (or /retrieve) requests from --concurrency
+    parallel clients and reports throughput, latency percentiles, time to
+    the first streamed byte and the status codes, 503s from the concurrency
+    limit included.
+    """
+    load_dotenv()
+    if not args.query_file:
+        sys.exit("benchmark.py api needs --query-file, e.g. benchmark_queries.jsonl")
+    queries = [query for query, _ in load_labelled_queries(args, None)]
+    path = "/retrieve" if args.endpoint == "retrieve" else "/query"
+    stream = args.endpoint == "stream"
+
+    stub = process = None
+    url = args.url
+    if url is None:
+        stub = GroqStubServer(latency=args.llm_latency, tokens_per_second=args.tokens_per_second).start()
+        process, url = start_api(args, stub)
+    try:
+        wait_until_ready(url, args.workers if process else 1)
+        print(f"Load testing {url}{path} with {args.requests} requests from {args.concurrency} clients")
+        client = httpx.Client(timeout=args.timeout, limits=httpx.Limits(max_connections=args.concurrency))
+
+        def send(i):
+            body = {"query": queries[i % len(queries)], "k": args.k} if path == "/retrieve" else \
+                   {"query": queries[i % len(queries)], "stream": stream}
+            started = time.perf_counter()
+            first_byte = None
+            try:
+                with client.stream("POST", url + path, json=body) as response:
+                    for _ in response.iter_bytes():
+                        if first_byte is None:
+                            first_byte = (time.perf_counter() - started) * 1000
+                    return response.status_code, (time.perf_counter() - started) * 1000, first_byte
+            except httpx.HTTPError:
+                return None, (time.perf_counter() - started) * 1000, None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(send, range(args.requests)))
+        elapsed = time.perf_counter() - started
+        client.close()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if stub is not None:
+            stub.stop()
+
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status or "error")] = statuses.get(str(status or "error"), 0) + 1
+    ok = [result for result in results if result[0] == 200]
+    report = {
+        "benchmark": "api",
+        "endpoint": args.endpoint,
+        "url": args.url,
+        "workers": args.workers if process else None,
+        "max_concurrent": args.max_concurrent if process else None,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "status_codes": statuses,
+        "latency": percentiles([ms for _, ms, _ in ok]) if ok else None,
+        "first_byte": percentiles([first for _, _, first in ok if first is not None]) if ok else None,
+    }
+
+    print(f"{len(ok)}/{args.requests} succeeded in {elapsed:.2f}s: {report['throughput_rps']} requests/s, status codes {statuses}")
+    if ok:
+        print(f"{'':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name in ("latency", "first_byte"):
+            row = report[name]
+            print(f"{name:<12} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+    return report
+
+
+# Run by `benchmark.py startup` in a fresh interpreter with -X importtime. The
+# marker line splits the import log into what `import RAG` loads and what is
+# imported later, on first use, while the model and the index load.
+STARTUP_PROBE = """
+import sys, json, time, contextlib
+started = time.perf_counter()
+import RAG
+import_s = time.perf_counter() - started
+print("startup-probe: imported", file=sys.stderr, flush=True)
+result = {"import_s": import_s}
+if not IMPORT_ONLY:
+    with contextlib.redirect_stdout(sys.stderr):
+        chatbot = RAG.ChatBot(load=False)
+        chatbot.load_faiss_index()
+        if chatbot.active_index:
+            chatbot.warm_up()
+    result.update(chatbot.startup_stats(), ready_s=time.perf_counter() - started)
+print(json.dumps(result))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Splits the -X importtime log of the startup probe into the modules
+    imported by `import RAG` and those deferred to the first use. Returns
+    both as {module: (self ms, cumulative ms)}.
+    """
+    eager, deferred = {}, {}
+    modules = eager
+    for line in stderr.splitlines():
+        if line.startswith("startup-probe: imported"):
+            modules = deferred
+            continue
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    return eager, deferred
+
+
+def by_package(modules):
+    """Self import time in ms summed per top-level package, largest first."""
+    packages = {}
+    for name, (self_ms, _) in modules.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_ms
+    return {package: round(ms, 2) for package, ms in sorted(packages.items(), key=lambda item: -item[1])}
+
+
+def bench_startup(args):
+    """
+    Profiles a cold start in fresh interpreters: the time `import RAG` takes
+    and which packages it spends it on, then the model load, the index load
+    and the warm-up, with the packages imported on first use along the way.
+    The times are medians over --runs; --baseline fails on regressions.
+    """
+    load_dotenv()
+    env = dict(os.environ)
+    if args.index_path:
+        env["FAISS_INDEX_PATH"] = args.index_path
+    probe = STARTUP_PROBE.replace("IMPORT_ONLY", str(args.import_only))
+    root = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(args.runs):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=root, env=env,
+                                 capture_output=True, text=True)
+        if process.returncode != 0:
+            errors = "\n".join(line for line in process.stderr.splitlines() if not line.startswith("import time:"))
+            sys.exit(f"The startup probe failed:\n{errors[-2000:]}")
+        runs.append((json.loads(process.stdout.splitlines()[-1]), process.stderr))
+    result, stderr = runs[-1]
+    eager, deferred = parse_importtime(stderr)
+
+    def median(key):
+        values = [run[key] for run, _ in runs if run.get(key) is not None]
+        return round(float(np.median(values)), 4) if values else None
+
+    report = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "import_s": median("import_s"),
+        "model_load_s": median("model_load_seconds"),
+        "index_load_s": median("index_load_seconds"),
+        "warmup_s": median("warmup_seconds"),
+        "ready_s": median("ready_s"),
+        "index_loaded": result.get("index_loaded"),
+        "load_error": result.get("load_error"),
+        "import_packages": dict(list(by_package(eager).items())[:args.top]),
+        "deferred_packages": dict(list(by_package(deferred).items())[:args.top]),
+        "slowest_modules": [
+            {"module": name, "self_ms": round(self_ms, 2), "cumulative_ms": round(cumulative_ms, 2)}
+            for name, (self_ms, cumulative_ms) in sorted({**eager, **deferred}.items(), key=lambda item: -item[1][0])[:args.top]
+        ],
+    }
+
+    print(f"import RAG: {report['import_s']:.3f}s (median of {args.runs} runs)")
+    if not args.import_only:
+        print(f"model load: {report['model_load_s']}s, index load: {report['index_load_s']}s, "
+              f"warm-up: {report['warmup_s']}s, ready after {report['ready_s']}s")
+        if report["load_error"]:
+            print(f"WARNING: the index was not loaded: {report['load_error']}")
+    for title, key in (("imported by RAG", "import_packages"), ("imported on first use", "deferred_packages")):
+        if report[key]:
+            print(f"{'package ' + title:<40} {'ms':>9}")
+            for package, ms in report[key].items():
+                print(f"{package:<40} {ms:>9.2f}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = find_regressions(report, baseline, args.tolerance, metrics=STARTUP_REGRESSION_METRICS)
+        for regression in report["regressions"]:
+            print(f"REGRESSION: {regression}")
+    return report
+
+
+def synthetic_queries(data_path, n, seed):
+    """n known-item queries made from incident descriptions sampled from the CSV sources."""
+    # pandas is only needed here
+    from sources import load_documents
+    documents, _ = load_documents(data_path)
+    if not documents:
+        sys.exit(f"No documents found in {data_path}")
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(documents), size=n, replace=len(documents) < n)
+    return [known_item_query(documents[i], rng) for i in picked]
+
+
+class ResourceSampler():
+    """
+    Samples the CPU use (all threads, in percent of one core) and the RSS of
+    this process every interval seconds on a background thread.
+    """
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self.started = time.monotonic()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    @staticmethod
+    def rss_mb():
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+        except (OSError, ValueError, IndexError):
+            # Peak rather than current RSS where /proc is missing
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def _run(self):
+        wall, cpu = time.monotonic(), time.process_time()
+        while not self._stopping.wait(self.interval):
+            now, now_cpu = time.monotonic(), time.process_time()
+            self.samples.append({
+                "t_s": round(now - self.started, 2),
+                "cpu_percent": round(100 * (now_cpu - cpu) / max(now - wall, 1e-9), 1),
+                "rss_mb": round(self.rss_mb(), 1),
+            })
+            wall, cpu = now, now_cpu
+
+    def summary(self, since, until):
+        """Mean and peak CPU and peak RSS of the samples taken between since and until (elapsed seconds)."""
+        samples = [sample for sample in self.samples if since <= sample["t_s"] <= until + self.interval]
+        if not samples:
+            return {"cpu_percent_mean": None, "cpu_percent_max": None, "rss_mb_max": round(self.rss_mb(), 1)}
+        return {
+            "cpu_percent_mean": round(float(np.mean([sample["cpu_percent"] for sample in samples])), 1),
+            "cpu_percent_max": max(sample["cpu_percent"] for sample in samples),
+            "rss_mb_max": max(sample["rss_mb"] for sample in samples),
+        }
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join(timeout=self.interval + 1.0)
+
+
+def run_load_level(chatbot, queries, duration, concurrency=None, rate=None, stream=True, max_clients=512, seed=0):
+    """
+    Sends queries to the ChatBot for duration seconds, then waits for the
+    requests in flight. With concurrency, that many clients each send their
+    next query as soon as the previous answer is complete (closed loop).
+    With rate, queries arrive at that many per second with exponential
+    gaps whatever the answers take (open loop), on up to max_clients
+    threads; their latency counts from the arrival, queueing included.
+    Returns [(succeeded, latency ms, first token ms)].
+    """
+    results = []
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def send(query, arrived):
+        first_token = None
+        try:
+            if stream:
+                for _ in chatbot.llamaResponseStream(query):
+                    if first_token is None:
+                        first_token = (time.perf_counter() - arrived) * 1000
+            else:
+                chatbot.llamaResponse(query)
+            succeeded = True
+        except Exception:
+            succeeded = False
+        with lock:
+            results.append((succeeded, (time.perf_counter() - arrived) * 1000, first_token))
+
+    deadline = time.perf_counter() + duration
+    if concurrency is not None:
+        def client():
+            while time.perf_counter() < deadline:
+                send(queries[next(counter) % len(queries)], time.perf_counter())
+        clients = [threading.Thread(target=client, name=f"load-client-{i}", daemon=True) for i in range(concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return results
+
+    rng = np.random.default_rng(seed)
+    arrival = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_clients, thread_name_prefix="load-client") as pool:
+        while arrival < deadline:
+            time.sleep(max(arrival - time.perf_counter(), 0.0))
+            pool.submit(send, queries[next(counter) % len(queries)], arrival)
+            arrival += rng.exponential(1.0 / rate)
+    return results
+
+
+def find_saturation(levels, key, gain=0.1):
+    """
+    Index of the level past which more load stops paying off, or None when
+    every level still scaled. For concurrency levels that is the last one
+    before throughput grows by less than gain (relative); for arrival rates,
+    the last one before throughput falls below (1 - gain) of the offered
+    rate, or the first level if that one already does.
+    """
+    for i, level in enumerate(levels):
+        if key == "rate_rps":
+            if level["throughput_rps"] < (1 - gain) * level["rate_rps"]:
+                return max(i - 1, 0)
+        elif i > 0 and level["throughput_rps"] < (1 + gain) * levels[i - 1]["throughput_rps"]:
+            return i - 1
+    return None
+
+
+def bench_load(args):
+    """
+    Replays queries against the whole ChatBot pipeline (embedding, retrieval,
+    prompt assembly, the LLM scheduler and the Groq client) answered by the
+    local Groq stub, at each --concurrency or --rate level for --duration
+    seconds. Reports throughput, end-to-end and per-stage latency
+    percentiles, CPU and RSS per level and over time, and the saturation
+    point. The query and answer caches are off unless --with-caches.
+    """
+    load_dotenv()
+    if args.index_path:
+        os.environ["FAISS_INDEX_PATH"] = args.index_path
+    if not args.with_caches:
+        os.environ["QUERY_CACHE_SIZE"] = "0"
+        os.environ["ANSWER_COALESCE"] = "0"
+        os.environ.pop("ANSWER_CACHE_PATH", None)
+    # Every sample of a level must count in its stage percentiles
+    os.environ["LATENCY_WINDOW"] = str(10 ** 6)
+    if args.query_file:
+        queries = [query for query, _ in load_labelled_queries(args, None)]
+    else:
+        queries = synthetic_queries(args.data_path or os.environ.get("DATA_PATH", "data"), args.synthetic, args.seed)
+    key, values = ("rate_rps", args.rate) if args.rate else ("concurrency", args.concurrency)
+
+    reply = " ".join(["token"] * args.reply_tokens) if args.reply_tokens else None
+    stub_options = {"reply": reply} if reply else {}
+    with GroqStubServer(latency=args.llm_latency, tokens_per_second=args.tokens_per_second, **stub_options) as stub:
+        os.environ["GROQ_BASE_URL"] = stub.base_url
+        os.environ["GROQ_API_KEY"] = "stub"
+        from RAG import ChatBot
+        chatbot = ChatBot()
+        if chatbot.active_index is None:
+            sys.exit("The index could not be loaded, build it with build_index.py first.")
+        chatbot.warm_up()
+        print(f"Replaying {len(queries)} queries at {key} {', '.join(str(value) for value in values)}, "
+              f"{args.duration:g}s per level")
+
+        sampler = ResourceSampler(args.sample_interval).start()
+        levels = []
+        try:
+            for value in values:
+                chatbot.latency.clear()
+                since = sampler.elapsed()
+                started = time.perf_counter()
+                results = run_load_level(
+                    chatbot, queries, args.duration, stream=not args.plain, max_clients=args.max_clients, seed=args.seed,
+                    **{"rate" if key == "rate_rps" else "concurrency": value}
+                )
+                elapsed = time.perf_counter() - started
+                ok = [result for result in results if result[0]]
+                first_tokens = [first for _, _, first in ok if first is not None]
+                stages = {
+                    stage: {name: row[name] for name in ("count", "p50_ms", "p95_ms", "p99_ms") if name in row}
+                    for stage, row in chatbot.latency.snapshot().items()
+                }
+                level = {
+                    key: value,
+                    "requests": len(results),
+                    "errors": len(results) - len(ok),
+                    "elapsed_s": round(elapsed, 3),
+                    "throughput_rps": round(len(ok) / elapsed, 2),
+                    "latency": percentiles([ms for _, ms, _ in ok]) if ok else None,
+                    "first_token": percentiles(first_tokens) if first_tokens else None,
+                    "stages": stages,
+                    **sampler.summary(since, sampler.elapsed()),
+                }
+                levels.append(level)
+                print(f"{key} {value}: {level['throughput_rps']} requests/s, "
+                      f"p95 {level['latency']['p95_ms'] if ok else None} ms, {level['errors']} errors, "
+                      f"CPU {level['cpu_percent_mean']}%, RSS {level['rss_mb_max']} MB")
+        finally:
+            sampler.stop()
+            chatbot.close()
+
+    saturated = find_saturation(levels, key, args.saturation_gain)
+    report = {
+        "benchmark": "load",
+        "queries": len(queries),
+        "query_source": args.query_file or "synthetic",
+        "stream": not args.plain,
+        "duration_s": args.duration,
+        "llm_latency_s": args.llm_latency,
+        "tokens_per_second": args.tokens_per_second,
+        "llm_max_in_flight": chatbot.llm_scheduler.max_in_flight,
+        "caches": args.with_caches,
+        "levels": levels,
+        "saturation": {key: levels[saturated][key], "throughput_rps": levels[saturated]["throughput_rps"]}
+                      if saturated is not None else None,
+        "resources": sampler.samples,
+    }
+
+    print(f"{key:<12} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'CPU %':>7} {'RSS MB':>8}")
+    for level in levels:
+        latency = level["latency"] or {"p50_ms": float("nan"), "p95_ms": float("nan"), "p99_ms": float("nan")}
+        print(f"{level[key]:<12} {level['throughput_rps']:>8.2f} {latency['p50_ms']:>9.1f} {latency['p95_ms']:>9.1f} "
+              f"{latency['p99_ms']:>9.1f} {level['errors']:>7} {level['cpu_percent_mean'] or 0:>7.1f} {level['rss_mb_max']:>8.1f}")
+    if saturated is None:
+        print("No saturation: throughput still grew at the highest level, try higher ones.")
+    else:
+        print(f"Saturation at {key} {levels[saturated][key]} ({levels[saturated]['throughput_rps']} requests/s)")
+    return report
+
+
+def _measure_backend(config, texts, queries, batch_size):
+    """
+    Loads one backend and times it. Runs in a fresh process, so that the
+    peak RSS it reports belongs to that backend alone.
+    """
+    started = time.perf_counter()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(model_name=config["model_name"], **embedding_kwargs(config))
+    embeddings.embed_documents(queries[:1])
+    load_s = time.perf_counter() - started
+
+    query_vectors, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    corpus_vectors = []
+    for start in range(0, len(texts), batch_size):
+        corpus_vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    elapsed = time.perf_counter() - started
+
+    stats = {
+        "load_s": round(load_s, 4),
+        "query": percentiles(latencies),
+        "docs_per_s": round(len(texts) / elapsed, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    return stats, np.asarray(query_vectors, dtype=np.float32), np.asarray(corpus_vectors, dtype=np.float32)
+
+
+def retrieval_agreement(reference_corpus, reference_queries, corpus, queries, k):
+    """
+    How closely a backend reproduces the reference: the mean overlap of each
+    query's exact top k over the corpus, and the mean cosine similarity
+    between the two embeddings of the same text.
+    """
+    _, expected = faiss.knn(reference_queries, reference_corpus, k)
+    _, found = faiss.knn(queries, corpus, k)
+    both = np.vstack([reference_corpus, reference_queries]), np.vstack([corpus, queries])
+    unit = [v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12) for v in both]
+    return {
+        f"top{k}_overlap": recall_at_k(found.tolist(), expected.tolist(), k),
+        "mean_cosine": round(float(np.mean(np.sum(unit[0] * unit[1], axis=1))), 6),
+    }
+
+
+def bench_embeddings(args):
+    """
+    Compares embedding backends on a sample of the indexed documents and on
+    the queries of --query-file plus known-item queries. The first backend
+    is the reference the others are compared against.
+    """
+    load_dotenv()
+    from RAG import LoadedIndex
+    index_path = args.index_path or os.environ.get("FAISS_INDEX_PATH", "faiss_index")
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    # Only the documents are needed, not the vectors
+    store = LoadedIndex(index_path, None, types.SimpleNamespace(docstore=docstore, index_to_docstore_id=index_to_docstore_id))
+    rng = np.random.default_rng(args.seed)
+    docstore_ids = list(index_to_docstore_id.values())
+    picked = rng.choice(len(docstore_ids), size=min(args.documents, len(docstore_ids)), replace=False)
+    texts = [docstore.search(docstore_ids[i]).page_content for i in picked]
+    queries = [query for query, _ in load_labelled_queries(types.SimpleNamespace(query_file=None, queries=args.queries, seed=args.seed), store)]
+    if args.query_file:
+        queries += [query for query, _ in load_labelled_queries(args, store)]
+    print(f"Comparing {', '.join(args.backends)} on {len(texts)} documents and {len(queries)} queries")
+
+    results, reference = [], None
+    context = multiprocessing.get_context("spawn")
+    for backend in args.backends:
+        config = embedding_config(backend=backend, quantization=args.quantization)
+        with context.Pool(1) as pool:
+            stats, query_vectors, corpus_vectors = pool.apply(_measure_backend, (config, texts, queries, args.batch_size))
+        if reference is None:
+            reference = corpus_vectors, query_vectors
+        stats.update(retrieval_agreement(reference[0], reference[1], corpus_vectors, query_vectors, args.k))
+        results.append({"embedding": config, **stats})
+        print(f"{describe(config)}: loaded in {stats['load_s']:.1f}s, query p50 {stats['query']['p50_ms']:.2f} ms, "
+              f"{stats['docs_per_s']} docs/s, peak RSS {stats['peak_rss_mb']} MB, "
+              f"top-{args.k} overlap {stats[f'top{args.k}_overlap']:.3f}, cosine {stats['mean_cosine']:.4f}")
+
+    return {
+        "benchmark": "embeddings",
+        "documents": len(texts),
+        "queries": len(queries),
+        "k": args.k,
+        "reference": results[0]["embedding"],
+        "results": results,
+    }
+
+
+def _measure_store(index_path, store_format, query_ids, k):
+    """Loads one store format in a fresh process and times loading, searching and fetching k rows per query."""
+    from langchain_community.vectorstores import FAISS
+    from compact_store import load_compact
+    started = time.perf_counter()
+    if store_format == "compact":
+        store = load_compact(index_path, None)
+    else:
+        store = FAISS.load_local(index_path, None, allow_dangerous_deserialization=True)
+    load_s = time.perf_counter() - started
+
+    queries = np.vstack([store.index.reconstruct(int(i)) for i in query_ids]).astype(np.float32)
+    found, search_ms, fetch_ms = [], [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, labels = store.index.search(query[None, :], k)
+        search_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        for label in labels[0]:
+            store.docstore.search(store.index_to_docstore_id[int(label)])
+        fetch_ms.append((time.perf_counter() - started) * 1000)
+        found.append(labels[0].tolist())
+    return {
+        "load_s": round(load_s, 4),
+        "search": percentiles(search_ms),
+        "fetch_k_rows": percentiles(fetch_ms),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }, found
+
+
+def bench_store(args):
+    """
+    Compares the pickled store with the compact one written by
+    `build_index.py --compact`. Queries are stored vectors; recall is the
+    overlap of the compact top k with the pickled top k.
+    """
+    load_dotenv()
+    index_path = args.index_path or os.environ.get("FAISS_INDEX_PATH", "faiss_index")
+    manifest = load_manifest(index_path) or {}
+    if not manifest.get("compact"):
+        sys.exit("This index has no compact store, build it with `build_index.py --compact` first.")
+    files = {
+        "pickle": ["index.faiss", "index.pkl"],
+        "compact": ["compact.faiss", "docstore.arrow"],
+    }
+    ids = np.array([row["faiss_id"] for row in manifest["rows"].values()], dtype=np.int64)
+    rng = np.random.default_rng(args.seed)
+    query_ids = rng.choice(ids, size=min(args.queries, len(ids)), replace=False).tolist()
+
+    results, found = {}, {}
+    context = multiprocessing.get_context("spawn")
+    for store_format in ("pickle", "compact"):
+        with context.Pool(1) as pool:
+            stats, found[store_format] = pool.apply(_measure_store, (index_path, store_format, query_ids, args.k))
+        stats["disk_mb"] = round(sum(os.path.getsize(os.path.join(index_path, name)) for name in files[store_format]) / 2**20, 2)
+        results[store_format] = stats
+    results["compact"]["codec"] = manifest["compact"]["codec"]
+    results["compact"][f"recall@{args.k}"] = recall_at_k(found["compact"], found["pickle"], args.k)
+
+    print(f"{'store':<8} {'load s':>8} {'RSS MB':>8} {'disk MB':>8} {'search p50':>11} {'fetch p50':>10}")
+    for store_format, stats in results.items():
+        print(f"{store_format:<8} {stats['load_s']:>8.3f} {stats['peak_rss_mb']:>8.1f} {stats['disk_mb']:>8.2f} "
+              f"{stats['search']['p50_ms']:>11.3f} {stats['fetch_k_rows']['p50_ms']:>10.3f}")
+    print(f"compact recall@{args.k} against the pickled index: {results['compact'][f'recall@{args.k}']:.3f}")
+    return {"benchmark": "store", "queries": len(query_ids), "k": args.k, **results}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks.")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="compare FAISS index types against the exact flat index")
+    index.add_argument("--index-path", help="built index to take vectors from (default FAISS_INDEX_PATH)")
+    index.add_argument("--configs", help="JSON list of configs, e.g. '[{\"type\": \"hnsw\", \"M\": 16}]'")
+    index.add_argument("--queries", type=int, default=200, help="number of noisy corpus vectors used as queries")
+    index.add_argument("--query-file", help="JSONL file with a \"query\" field per line, embedded with the index model")
+    index.add_argument("--k", type=int, default=5)
+    index.add_argument("--seed", type=int, default=0)
+    index.set_defaults(run=bench_index)
+
+    retrieval = commands.add_parser("retrieval", help="compare vector, lexical and hybrid retrieval through the ChatBot")
+    retrieval.add_argument("--index-path", help="built index to search (default FAISS_INDEX_PATH)")
+    retrieval.add_argument("--modes", nargs="+", default=["vector", "lexical", "hybrid"], choices=["vector", "lexical", "hybrid"])
+    retrieval.add_argument("--queries", type=int, default=200, help="number of known-item queries made from the corpus")
+    retrieval.add_argument("--query-file", help="JSONL file with \"query\" and \"relevant\" (row keys) per line")
+    retrieval.add_argument("--k", type=int, default=5)
+    retrieval.add_argument("--seed", type=int, default=0)
+    retrieval.set_defaults(run=bench_retrieval)
+
+    rag = commands.add_parser("rag", help="end-to-end RAG latency, prompt size and recall against a local Groq stub")
+    rag.add_argument("--index-path", help="built index to search (default FAISS_INDEX_PATH)")
+    rag.add_argument("--query-file", help="JSONL file with \"query\" and optional \"expected\" row keys per line")
+    rag.add_argument("--queries", type=int, default=100, help="number of known-item queries made from the corpus")
+    rag.add_argument("--k", type=int, default=5)
+    rag.add_argument("--seed", type=int, default=0)
+    rag.add_argument("--llm-latency", type=float, default=0.0, help="seconds the stub waits before answering")
+    rag.add_argument("--tokens-per-second", type=float, help="pace of the stub's answer (default: instant)")
+    rag.add_argument("--baseline", help="earlier rag JSON report; exit with status 1 on regressions")
+    rag.add_argument("--tolerance", type=float, default=0.2, help="allowed relative growth of latencies and prompt size")
+    rag.add_argument("--recall-tolerance", type=float, default=0.02, help="allowed absolute drop of recall")
+    rag.set_defaults(run=bench_rag)
+
+    api = commands.add_parser("api", help="concurrent load test of the HTTP API against a local Groq stub")
+    api.add_argument("--url", help="API to load instead of starting api.py, e.g. http://127.0.0.1:8000")
+    api.add_argument("--index-path", help="built index served by the started API (default FAISS_INDEX_PATH)")
+    api.add_argument("--query-file", default="benchmark_queries.jsonl", help="JSONL file with a \"query\" field per line")
+    api.add_argument("--endpoint", choices=["query", "stream", "retrieve"], default="query",
+                     help="/query, /query with streaming, or /retrieve")
+    api.add_argument("--requests", type=int, default=200)
+    api.add_argument("--concurrency", type=int, default=16, help="parallel clients")
+    api.add_argument("--workers", type=int, default=2, help="worker processes of the started API")
+    api.add_argument("--max-concurrent", type=int, default=8, help="concurrency limit of each started worker")
+    api.add_argument("--k", type=int, default=5)
+    api.add_argument("--timeout", type=float, default=60.0, help="seconds before a request counts as an error")
+    api.add_argument("--llm-latency", type=float, default=0.3, help="seconds the stub waits before answering")
+    api.add_argument("--tokens-per-second", type=float, default=150, help="pace of the stub's answer")
+    api.set_defaults(run=bench_api)
+
+    embeddings = commands.add_parser("embeddings", help="compare the torch, onnx and onnx_int8 embedding backends")
+    embeddings.add_argument("--index-path", help="built index to take documents from (default FAISS_INDEX_PATH)")
+    embeddings.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS),
+                            help="backends to compare, the first one is the reference")
+    embeddings.add_argument("--quantization", choices=QUANTIZATIONS, help="instruction set of onnx_int8 (EMBEDDING_QUANTIZATION)")
+    embeddings.add_argument("--documents", type=int, default=2000, help="indexed documents embedded by every backend")
+    embeddings.add_argument("--queries", type=int, default=200, help="number of known-item queries made from the corpus")
+    embeddings.add_argument("--query-file", help="JSONL file with more queries in a \"query\" field")
+    embeddings.add_argument("--batch-size", type=int, default=64)
+    embeddings.add_argument("--k", type=int, default=10)
+    embeddings.add_argument("--seed", type=int, default=0)
+    embeddings.set_defaults(run=bench_embeddings)
+
+    store = commands.add_parser("store", help="compare the pickled and the compact (memory-mapped, Arrow) stores")
+    store.add_argument("--index-path", help="built index with a compact store (default FAISS_INDEX_PATH)")
+    store.add_argument("--queries", type=int, default=200, help="stored vectors used as queries")
+    store.add_argument("--k", type=int, default=5)
+    store.add_argument("--seed", type=int, default=0)
+    store.set_defaults(run=bench_store)
+
+    startup = commands.add_parser("startup", help="import time per module and model/index load time of a cold start")
+    startup.add_argument("--index-path", help="built index to load (default FAISS_INDEX_PATH)")
+    startup.add_argument("--import-only", action="store_true", help="only time `import RAG`, without loading the model")
+    startup.add_argument("--runs", type=int, default=3, help="fresh interpreters started, the times are medians")
+    startup.add_argument("--top", type=int, default=15, help="packages and modules listed")
+    startup.add_argument("--baseline", help="earlier startup JSON report; exit with status 1 on regressions")
+    startup.add_argument("--tolerance", type=float, default=0.2, help="allowed relative growth of the startup times")
+    startup.set_defaults(run=bench_startup)
+
+    load = commands.add_parser("load", help="replay queries against the ChatBot at rising load, with a local Groq stub")
+    load.add_argument("--index-path", help="built index to search (default FAISS_INDEX_PATH)")
+    load.add_argument("--query-file", help="JSONL file with a \"query\" field per line, e.g. benchmark_queries.jsonl")
+    load.add_argument("--data-path", help="CSV sources sampled for synthetic queries without --query-file (default DATA_PATH)")
+    load.add_argument("--synthetic", type=int, default=500, help="synthetic queries sampled from the CSV descriptions")
+    levels = load.add_mutually_exclusive_group()
+    levels.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200], help="closed-loop concurrent users per level")
+    levels.add_argument("--rate", type=float, nargs="+", help="open-loop arrival rates per level, in requests per second")
+    load.add_argument("--duration", type=float, default=30.0, help="seconds each level lasts")
+    load.add_argument("--max-clients", type=int, default=512, help="threads sending open-loop arrivals")
+    load.add_argument("--plain", action="store_true", help="ask for whole answers instead of streams")
+    load.add_argument("--with-caches", action="store_true", help="keep the query cache and request coalescing on")
+    load.add_argument("--llm-latency", type=float, default=0.3, help="seconds the stub waits before answering")
+    load.add_argument("--tokens-per-second", type=float, default=150, help="pace of the stub's answer")
+    load.add_argument("--reply-tokens", type=int, help="length of the stub's answer in tokens (default: its short reply)")
+    load.add_argument("--sample-interval", type=float, default=0.5, help="seconds between CPU and RSS samples")
+    load.add_argument("--saturation-gain", type=float, default=0.1,
+                      help="throughput gain (or shortfall to the offered rate) below which a level counts as saturated")
+    load.add_argument("--seed", type=int, default=0)
+    load.set_defaults(run=bench_load)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = args.run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    if report.get("regressions"):
+        sys.exit(1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
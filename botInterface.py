@@ -1,68 +1,41 @@
 import streamlit as st
 import random
 import time
-import json
 import os
 import sys
 import logging
-import datetime
 from functools import wraps
 from RAG import ChatBot
+from telemetry import new_request_id
+from log_shipping import setup_logging, shipping_stats
 from dotenv import load_dotenv
 
-# Configure logging
-def setup_logging():
-    """Set up structured logging to stdout for ELK stack integration"""
-    class JsonFormatter(logging.Formatter):
-        def format(self, record):
-            log_record = {
-                "timestamp": datetime.datetime.now().isoformat(),
-                "level": record.levelname,
-                "message": record.getMessage(),
-                "logger": record.name
-            }
-            
-            # Add exception info if available
-            if record.exc_info:
-                log_record["exception"] = self.formatException(record.exc_info)
-                
-            # Add extra fields if available
-            if hasattr(record, "props"):
-                log_record.update(record.props)
-                
-            return json.dumps(log_record)
-    
-    logger = logging.getLogger("chatbot")
-    logger.setLevel(logging.INFO)
-    
-    # Clear existing handlers if any
-    if logger.handlers:
-        logger.handlers = []
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(JsonFormatter())
-    logger.addHandler(console_handler)
-    
-    return logger
+# Load environment variables from .env file, LOGSTASH_HOST included
+load_dotenv()
 
 # Setup logger
 logger = setup_logging()
-
-# Load environment variables from .env file
-load_dotenv()
 logger.info("Environment variables loaded")
 
-# Health status tracking
-health_status = {
-    "status": "healthy",
-    "components": {
-        "faiss_index": "unknown",
-        "groq_api": "unknown"
-    },
-    "startup_time": time.time(),
-    "uptime_seconds": 0
-}
+# Health status tracking. Streamlit re-executes this script on every
+# interaction, so the status lives in a cached resource that is created once
+# per server process and shared by all sessions.
+@st.cache_resource
+def get_health_status():
+    return {
+        "status": "healthy",
+        "components": {
+            "faiss_index": "unknown",
+            "groq_api": "unknown"
+        },
+        "startup_time": time.time(),
+        "uptime_seconds": 0,
+        "ready": False,
+        "model_load_seconds": None,
+        "warmup_seconds": None
+    }
+
+health_status = get_health_status()
 
 def update_uptime():
     """Update the uptime in the health status"""
@@ -88,14 +61,31 @@ def handle_errors(func):
             return f"I apologize, but I've encountered an error. Please try again later."
     return wrapper
 
-# Initialize the ChatBot
-try:
+# Initialize the ChatBot once per server process. Every rerun and every
+# session gets the same instance, so the model and the FAISS index are
+# loaded and warmed up a single time. Loading happens on a background
+# thread: the health check answers meanwhile and the UI waits for it.
+@st.cache_resource
+def get_chatbot():
     logger.info("Initializing ChatBot")
-chat = ChatBot()
-    health_status["components"]["faiss_index"] = "healthy" if chat.faiss_index else "unhealthy"
-    logger.info("ChatBot initialized successfully", extra={
-        "props": {"faiss_index_status": health_status["components"]["faiss_index"]}
-    })
+    chat = ChatBot(load=False)
+    chat.load_in_background()
+    return chat
+
+def update_startup_status(chat):
+    """Copy the readiness and load times of the ChatBot into the health status"""
+    startup = chat.startup_stats()
+    health_status["ready"] = startup["ready"]
+    health_status["startup"] = startup
+    health_status["model_load_seconds"] = startup["model_load_seconds"]
+    health_status["warmup_seconds"] = startup["warmup_seconds"]
+    if not startup["ready"]:
+        health_status["components"]["faiss_index"] = "loading"
+    else:
+        health_status["components"]["faiss_index"] = "healthy" if startup["index_loaded"] else "unhealthy"
+
+try:
+    chat = get_chatbot()
 except Exception as e:
     error_msg = f"ERROR initializing ChatBot: {str(e)}"
     logger.error(error_msg, extra={
@@ -108,7 +98,7 @@ except Exception as e:
     chat = None
 
 @handle_errors
-def response_generator(userInput, botContext):
+def response_generator(userInput, botContext, request_id=None, session_id=None):
     # First verify the GROQ API is configured
     if not os.environ.get("GROQ_API_KEY"):
         health_status["components"]["groq_api"] = "unconfigured"
@@ -120,6 +110,7 @@ def response_generator(userInput, botContext):
     # Log the query (being careful not to log sensitive information)
     logger.info("Processing query", extra={
         "props": {
+            "request_id": request_id,
             "query_length": len(userInput) if userInput else 0,
             "has_context": bool(botContext)
         }
@@ -128,18 +119,20 @@ def response_generator(userInput, botContext):
     # Update the health status for Groq API
     try:
         logger.info("Calling Groq API")
-    response = chat.llamaResponse(userInput)
+        response_length = 0
+        # Tokens are shown as soon as Groq produces them
+        for token in chat.llamaResponseStream(userInput, request_id=request_id, session=session_id):
+            response_length += len(token)
+            yield token
         health_status["components"]["groq_api"] = "healthy"
         logger.info("Received response from Groq API", extra={
-            "props": {"response_length": len(response) if response else 0}
+            "props": {"request_id": request_id, "response_length": response_length}
         })
-    for word in response.split():
-        yield word + " "
-        time.sleep(0.05)
     except Exception as e:
         health_status["components"]["groq_api"] = "unhealthy"
         logger.error(f"Error calling Groq API: {str(e)}", extra={
             "props": {
+                "request_id": request_id,
                 "error_type": type(e).__name__,
                 "component": "groq_api"
             }
@@ -147,13 +140,34 @@ def response_generator(userInput, botContext):
         raise e
 
 # Add health check endpoint using Streamlit's URL parameters
-if "health-check" in st.experimental_get_query_params():
+if "health-check" in st.query_params:
     # Update uptime
     update_uptime()
+    if chat:
+        # Answered right away, also while the model and the index are loading
+        update_startup_status(chat)
+        health_status["query_cache"] = chat.query_cache.stats()
+        health_status["answer_cache"] = chat.answer_cache.stats() if chat.answer_cache else None
+        health_status["single_flight"] = chat.single_flight.stats()
+        health_status["llm_scheduler"] = chat.llm_scheduler.stats()
+        health_status["latency"] = chat.latency.snapshot()
+        # The version changes when a new index is reloaded without a restart
+        health_status["index"] = {
+            "version": chat.index_version,
+            "path": chat.faiss_index_path,
+            "reloads": chat.reloads,
+            "reload_failures": chat.reload_failures,
+            "last_reload_error": chat.last_reload_error
+        }
+    health_status["log_shipping"] = shipping_stats(logger)
     
     # If any component is unhealthy, set overall status to degraded
     if "unhealthy" in health_status["components"].values() or "unconfigured" in health_status["components"].values():
         health_status["status"] = "degraded"
+    elif health_status["components"]["faiss_index"] == "loading":
+        health_status["status"] = "starting"
+    elif health_status["status"] == "starting":
+        health_status["status"] = "healthy"
     
     # Log health check
     logger.info("Health check requested", extra={
@@ -172,6 +186,12 @@ if "health-check" in st.experimental_get_query_params():
 logger.info("Rendering main UI")
 st.title("Chat DeNexus")
 
+if chat:
+    if not chat.ready.is_set():
+        with st.spinner("Loading the model and the FAISS index..."):
+            chat.ready.wait()
+    update_startup_status(chat)
+
 # Check if the FAISS index was loaded successfully
 if health_status["components"]["faiss_index"] == "unhealthy":
     error_msg = "Unable to load the FAISS index. Please check the server logs."
@@ -185,6 +205,12 @@ if health_status["components"]["faiss_index"] == "unhealthy":
 if "messages" not in st.session_state:
     st.session_state.messages = []
     logger.info("Initialized empty message history")
+# Groq calls are queued fairly across sessions (see llm_scheduler.py)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = new_request_id()
+    logger.info("Started a new session", extra={
+        "props": {"session_id": st.session_state.session_id}
+    })
 
 # Display message history
 for message in st.session_state.messages:
@@ -193,9 +219,11 @@ for message in st.session_state.messages:
 
 # Handle new user input
 if prompt := st.chat_input("What do you want to ask?", key=2):
+    # One id per message, shared by every log line written while answering it
+    request_id = new_request_id()
     # Log that we received a new message (without logging the content)
     logger.info("Received new user message", extra={
-        "props": {"message_length": len(prompt)}
+        "props": {"request_id": request_id, "message_length": len(prompt)}
     })
     
     # Add user message to session state
@@ -207,9 +235,9 @@ if prompt := st.chat_input("What do you want to ask?", key=2):
 
     # Generate and display assistant response
     with st.chat_message("assistant"):
-        response = st.write_stream(response_generator(prompt, ""))
+        response = st.write_stream(response_generator(prompt, "", request_id, st.session_state.session_id))
         logger.info("Response generated and displayed", extra={
-            "props": {"response_length": len(response) if response else 0}
+            "props": {"request_id": request_id, "response_length": len(response) if response else 0}
         })
     
     # Add assistant response to session state
@@ -1,76 +1,658 @@
 import os
-import pandas as pd
+import json
+import shutil
+import hashlib
+import time
+import argparse
+import itertools
+import faiss
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from dotenv import load_dotenv
-from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_huggingface import HuggingFaceEmbeddings
+from attribute_index import AttributeIndex, ATTRIBUTES_FILE
+from lexical_index import BM25Index, LEXICAL_FILE
+from sources import SOURCES, iter_documents, print_report
+from compact_store import CODECS, COMPACT_INDEX_FILE, DOCSTORE_FILE, save_compact
+from embedding_backends import EMBEDDING_BACKENDS, embedding_config, embedding_kwargs, manifest_embedding, vector_space, describe
+from dedup import minhash_signatures, candidate_pairs, confirm_pairs, cluster_pairs, merge_cluster
+from faiss_utils import (
+    INDEX_TYPES, VERSIONS_DIR, SHARDS_DIR, SHARDS_FILE, load_manifest, load_shards, save_shards, save_manifest, index_config, build_params, make_index,
+    training_size, supports_removal, rebuild_without, apply_search_params,
+    new_version, current_version, resolve_index_path, publish_version
+)
 
-def build_faiss_index():
+def row_key(source, row_id):
+    """Returns the docstore id used for a CSV row, e.g. 'TISAFE:42'."""
+    return f"{source}:{row_id}"
+
+
+def row_hash(source, row_id, text):
+    """Returns the content hash of a row, used to detect new or changed rows."""
+    payload = f"{source}\x1f{row_id}\x1f{text}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def metadata_hash(metadata):
+    """Returns a short hash of a document's metadata, used to refresh it without re-embedding."""
+    payload = json.dumps(metadata, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+# Embeddings model of the current worker process when embedding with a process pool
+_worker_embeddings = None
+
+
+def _init_embedding_worker(embedding, threads):
+    """Loads the model once per worker process and splits the cores between workers."""
+    global _worker_embeddings
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=embedding["model_name"], **embedding_kwargs(embedding))
+
+
+def _embed_in_worker(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+
+def embed_in_batches(embeddings, documents, batch_size=256, workers=1, executor="process", embedding=None):
+    """
+    Embeds documents in batches and yields (batch, vectors) for each batch as
+    soon as it is ready, so callers can add vectors to the index while the
+    rest of the corpus is still being encoded. documents may be any
+    iterable, e.g. a generator over the chunks of the sources; it is read one
+    batch at a time. Batches may complete out of order when workers > 1. At
+    most two batches per worker are in flight, which bounds the memory held
+    by pending documents and vectors.
+    """
+    documents = iter(documents)
+    batches = iter(lambda: list(itertools.islice(documents, batch_size)), [])
+
+    def texts_of(batch):
+        return [d.page_content for d in batch]
+
+    if workers <= 1:
+        for batch in batches:
+            yield batch, embeddings.embed_documents(texts_of(batch))
+        return
+
+    if executor == "process":
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_embedding_worker,
+            initargs=(embedding, threads)
+        )
+        task = _embed_in_worker
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+        task = embeddings.embed_documents
+
+    with pool:
+        pending = {}
+        for batch in batches:
+            if len(pending) >= 2 * workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield pending.pop(future), future.result()
+            pending[pool.submit(task, texts_of(batch))] = batch
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
+
+def nonempty(chunks):
+    """chunks of Documents without the empty ones, or None when there are no documents at all."""
+    chunks = (chunk for chunk in chunks if chunk)
+    first = next(chunks, None)
+    return None if first is None else itertools.chain([first], chunks)
+
+
+def load_existing_index(faiss_index_path, embeddings, embedding, config):
     """
-    Loads documents from CSV files specified in the CSVS_CONFIG,
-    generates FAISS index using HuggingFace embeddings, and saves it locally.
+    Returns (vector_store, manifest) for the index already on disk, or
+    (None, None) when there is nothing reusable and a full build is needed.
+    """
+    manifest = load_manifest(faiss_index_path)
+    if manifest is None:
+        return None, None
+    previous_embedding = manifest_embedding(manifest)
+    if vector_space(previous_embedding) != vector_space(embedding):
+        print(f"Index was built with {describe(previous_embedding)}, not {describe(embedding)}. Rebuilding from scratch.")
+        return None, None
+    previous = manifest.get("index", index_config("flat"))
+    if previous["type"] != config["type"] or build_params(previous) != build_params(config):
+        print(f"Index type changed from {previous} to {config}. Rebuilding from scratch.")
+        return None, None
+    try:
+        vector_store = FAISS.load_local(faiss_index_path, embeddings, allow_dangerous_deserialization=True)
+    except Exception as e:
+        print(f"Could not load existing FAISS index ({e}). Rebuilding from scratch.")
+        return None, None
+    if not isinstance(vector_store.index, faiss.IndexIDMap2):
+        print("Existing FAISS index has no id mapping. Rebuilding from scratch.")
+        return None, None
+    apply_search_params(vector_store.index, config)
+    return vector_store, manifest
+
+
+def add_documents(vector_store, faiss_ids, documents, vectors):
+    """Adds embedded documents under explicit FAISS ids."""
+    vector_store.index.add_with_ids(
+        np.asarray(vectors, dtype=np.float32),
+        np.asarray(faiss_ids, dtype=np.int64)
+    )
+    vector_store.docstore.add({row_key(d.metadata["source"], d.metadata["id"]): d for d in documents})
+    for faiss_id, document in zip(faiss_ids, documents):
+        vector_store.index_to_docstore_id[int(faiss_id)] = row_key(document.metadata["source"], document.metadata["id"])
+
+
+def remove_documents(vector_store, faiss_ids, config):
+    """
+    Removes vectors and their documents by FAISS id. Index types that cannot
+    delete in place (HNSW) are rebuilt from their stored vectors instead.
+    """
+    if not faiss_ids:
+        return
+    if supports_removal(vector_store.index):
+        vector_store.index.remove_ids(np.asarray(faiss_ids, dtype=np.int64))
+    else:
+        vector_store.index = rebuild_without(vector_store.index, config, faiss_ids)
+    keys = [vector_store.index_to_docstore_id.pop(int(faiss_id)) for faiss_id in faiss_ids]
+    vector_store.docstore.delete(keys)
+
+
+def refresh_documents(vector_store, documents):
+    """Replaces stored documents whose metadata changed, keeping their vectors."""
+    if not documents:
+        return
+    keys = [row_key(d.metadata["source"], d.metadata["id"]) for d in documents]
+    vector_store.docstore.delete(keys)
+    vector_store.docstore.add(dict(zip(keys, documents)))
+
+
+def deduplicate_documents(documents, embeddings, vector_store, manifest, config):
+    """
+    Merges reports of the same incident from different sources into one
+    document (see dedup.merge_cluster). Candidate pairs come from MinHash/LSH
+    over word shingles and are confirmed by the cosine similarity of their
+    embeddings. Decisions are kept in the manifest under "dedup_pairs" and
+    reused while both rows are unchanged, so incremental builds embed
+    nothing for pairs they have already checked. Documents embedded for the
+    check are returned keyed by row key, so the build does not embed them
+    a second time.
+
+    Returns (documents, precomputed vectors).
+    """
+    started = time.perf_counter()
+    keys = [row_key(d.metadata["source"], d.metadata["id"]) for d in documents]
+    hashes = [row_hash(d.metadata["source"], d.metadata["id"], d.page_content) for d in documents]
+    old_rows, old_pairs = manifest["rows"], manifest.get("dedup_pairs", {})
+    # IVF indexes need a direct map to return stored vectors, which then blocks removals
+    reusable = vector_store is not None and not config["type"].startswith("ivf")
+    precomputed = {}
+
+    def vectors_for(indexes):
+        vectors, missing = {}, []
+        for i in indexes:
+            previous = old_rows.get(keys[i])
+            if reusable and previous is not None and previous["hash"] == hashes[i]:
+                vectors[i] = vector_store.index.reconstruct(int(previous["faiss_id"]))
+            else:
+                missing.append(i)
+        if missing:
+            embedded = embeddings.embed_documents([documents[i].page_content for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = precomputed[keys[i]] = vector
+        return [vectors[i] for i in indexes]
+
+    signatures = minhash_signatures([d.page_content for d in documents])
+    pairs = candidate_pairs(signatures, [d.metadata["source"] for d in documents])
+
+    decisions, unchecked = {}, []
+    for i, j in pairs:
+        pair_key = f"{keys[i]}|{keys[j]}"
+        previous = old_pairs.get(pair_key)
+        if previous is not None and previous["hashes"] == [hashes[i], hashes[j]]:
+            decisions[(i, j)] = previous["duplicate"]
+        else:
+            unchecked.append((i, j))
+    decisions.update(zip(unchecked, confirm_pairs(unchecked, vectors_for)))
+    manifest["dedup_pairs"] = {
+        f"{keys[i]}|{keys[j]}": {"hashes": [hashes[i], hashes[j]], "duplicate": duplicate}
+        for (i, j), duplicate in decisions.items()
+    }
+    clusters = cluster_pairs([pair for pair, duplicate in decisions.items() if duplicate])
+
+    merged = set(i for cluster in clusters for i in cluster)
+    deduplicated = [d for i, d in enumerate(documents) if i not in merged]
+    deduplicated.extend(merge_cluster([documents[i] for i in cluster]) for cluster in clusters)
+
+    removed = len(documents) - len(deduplicated)
+    dim = len(next(iter(precomputed.values()))) if precomputed else vector_store.index.d if vector_store is not None else 0
+    print(f"Deduplication: {len(pairs)} candidate pairs ({len(unchecked)} checked with embeddings), "
+          f"{len(clusters)} clusters covering {len(merged)} documents, {len(documents)} -> {len(deduplicated)} vectors "
+          f"({100 * removed / len(documents):.1f}% fewer, {removed * dim * 4 / 2**20:.2f} MB less vector data) "
+          f"in {time.perf_counter() - started:.1f}s")
+    return deduplicated, precomputed
+
+
+def update_index(faiss_index_path, chunks, embeddings, embedding, config, version, ingestion=None,
+                 full_rebuild=False, batch_size=256, workers=1, executor="process", dedup=False,
+                 compact=False, compact_codec="fp16"):
+    """
+    Brings the index in faiss_index_path in line with the documents in
+    chunks (lists of Documents, e.g. from sources.iter_documents), embedding
+    only new or changed rows (see build_faiss_index for the options), and
+    records version in its manifest. Returns the added, updated, removed
+    and reused counts, or None when the index was already up to date.
+
+    Chunks are hashed, compared with the manifest and their new rows
+    embedded as they arrive. Besides the store being built, only the
+    manifest rows, the batches in flight and the documents of changed rows
+    are held: a changed row keeps its FAISS id, so it is embedded once the
+    old vectors are removed at the end. Deduplication compares rows across
+    the whole corpus and reads every chunk into one list first.
+    """
+    model_name = embedding["model_name"]
+    vector_store, manifest = (None, None) if full_rebuild else load_existing_index(faiss_index_path, embeddings, embedding, config)
+    if manifest is None:
+        manifest = {"model_name": model_name, "next_id": 0, "rows": {}}
+    # Checked by the ChatBot, which refuses to embed queries with an incompatible backend
+    manifest["embedding"] = embedding
+    search_params_changed = manifest.get("index") != config
+    manifest["index"] = config
+    if ingestion is not None:
+        manifest["ingestion"] = ingestion
+    old_rows = manifest["rows"]
+
+    precomputed, old_pairs = {}, manifest.get("dedup_pairs")
+    if dedup:
+        documents, precomputed = deduplicate_documents(
+            [document for chunk in chunks for document in chunk], embeddings, vector_store, manifest, config
+        )
+        chunks = [documents]
+    else:
+        manifest.pop("dedup_pairs", None)
+
+    rows = {}
+    counts = {"added": 0, "updated": 0, "reused": 0, "refreshed": 0}
+    updated_documents, replaced_ids = [], []
+    # IVF indexes need a training sample, so batches are held back until there is one
+    untrained = []
+    started = time.perf_counter()
+
+    def store(batch, vectors):
+        """Adds embedded documents under the FAISS ids of their rows."""
+        faiss_ids = [rows[row_key(d.metadata["source"], d.metadata["id"])]["faiss_id"] for d in batch]
+        add_documents(vector_store, faiss_ids, batch, vectors)
+
+    def train():
+        nonlocal untrained
+        print(f"Training {config['type']} index on {sum(len(v) for _, v in untrained)} vectors")
+        vector_store.index.train(np.vstack([np.asarray(v, dtype=np.float32) for _, v in untrained]))
+        held, untrained = untrained, []
+        for batch, vectors in held:
+            store(batch, vectors)
+
+    def add(batch, vectors):
+        nonlocal vector_store
+        if vector_store is None:
+            vector_store = FAISS(
+                embedding_function=embeddings,
+                index=make_index(config, len(vectors[0])),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
+        if vector_store.index.is_trained:
+            store(batch, vectors)
+            return
+        untrained.append((batch, vectors))
+        if sum(len(v) for _, v in untrained) >= training_size(config):
+            train()
+
+    def take_precomputed(documents):
+        """Adds the documents whose vectors the dedup check computed and returns the others."""
+        keys = [row_key(d.metadata["source"], d.metadata["id"]) for d in documents]
+        ready = [i for i, key in enumerate(keys) if key in precomputed]
+        if ready:
+            add([documents[i] for i in ready], [precomputed[keys[i]] for i in ready])
+        return [d for d, key in zip(documents, keys) if key not in precomputed]
+
+    def embed(documents):
+        embedded = 0
+        for batch, vectors in embed_in_batches(embeddings, documents, batch_size, workers, executor, embedding):
+            if not embedded:
+                print(f"Embedding documents in batches of {batch_size} on {workers} {executor} worker(s)")
+            add(batch, vectors)
+            embedded += len(vectors)
+            rate = embedded / max(time.perf_counter() - started, 1e-9)
+            print(f"Embedded {embedded} documents ({rate:.1f} docs/sec)")
+
+    def new_documents():
+        """Documents of rows not indexed before, read chunk by chunk; the other rows are settled on the way."""
+        for chunk in chunks:
+            refreshed, fresh = [], []
+            for document in chunk:
+                source, row_id = document.metadata["source"], document.metadata["id"]
+                key = row_key(source, row_id)
+                if key in rows:
+                    # A row key repeated in the sources is indexed once
+                    continue
+                content_hash = row_hash(source, row_id, document.page_content)
+                previous = old_rows.get(key)
+                meta = metadata_hash(document.metadata)
+                if previous is not None and previous["hash"] == content_hash:
+                    counts["reused"] += 1
+                    if previous.get("meta") != meta:
+                        # Same text, new metadata: the stored vector stays valid
+                        refreshed.append(document)
+                    rows[key] = dict(previous, meta=meta)
+                    continue
+                if previous is None:
+                    counts["added"] += 1
+                    rows[key] = {"hash": content_hash, "faiss_id": manifest["next_id"], "meta": meta}
+                    manifest["next_id"] += 1
+                    fresh.append(document)
+                else:
+                    counts["updated"] += 1
+                    rows[key] = {"hash": content_hash, "faiss_id": previous["faiss_id"], "meta": meta}
+                    replaced_ids.append(previous["faiss_id"])
+                    updated_documents.append(document)
+            if refreshed:
+                counts["refreshed"] += len(refreshed)
+                refresh_documents(vector_store, refreshed)
+            yield from take_precomputed(fresh)
+
+    embed(new_documents())
+    stale_ids = [row["faiss_id"] for key, row in old_rows.items() if key not in rows]
+    removed = len(stale_ids)
+    added, updated, reused = counts["added"], counts["updated"], counts["reused"]
+
+    sidecars = (ATTRIBUTES_FILE, LEXICAL_FILE) + ((COMPACT_INDEX_FILE, DOCSTORE_FILE) if compact else ())
+    sidecars_missing = not all(os.path.exists(os.path.join(faiss_index_path, name)) for name in sidecars)
+    compact_changed = (manifest.get("compact") or {}).get("codec") != (compact_codec if compact else None)
+    pairs_changed = manifest.get("dedup_pairs") != old_pairs
+    changed = added or updated or removed or counts["refreshed"] or search_params_changed or sidecars_missing or pairs_changed or compact_changed
+    if vector_store is not None and not changed:
+        print(f"Index is up to date: added 0, updated 0, removed 0, reused {reused}")
+        return None
+
+    if vector_store is not None:
+        remove_documents(vector_store, stale_ids + replaced_ids, config)
+    embed(take_precomputed(updated_documents))
+    if untrained:
+        # Fewer vectors than the training sample asks for: train on all of them
+        train()
+    if vector_store is None:
+        print("No documents to index.")
+        return None
+
+    manifest["rows"] = rows
+    vector_store.save_local(faiss_index_path)
+    current_ids = [row["faiss_id"] for row in rows.values()]
+    # Read back from the docstore rather than kept aside while the chunks went by
+    current_documents = [vector_store.docstore.search(key) for key in rows]
+    AttributeIndex.from_documents(current_ids, current_documents).save(faiss_index_path)
+    BM25Index.from_documents(current_ids, current_documents).save(faiss_index_path)
+    if compact:
+        manifest["compact"] = save_compact(faiss_index_path, vector_store, config, compact_codec)
+        print(f"Compact store written: {manifest['compact']['index_bytes'] / 2**20:.2f} MB of {compact_codec} vectors, "
+              f"{manifest['compact']['docstore_bytes'] / 2**20:.2f} MB of documents")
+    else:
+        # Without this entry the ChatBot ignores compact files left by an earlier build
+        manifest.pop("compact", None)
+    manifest["version"] = version
+    save_manifest(faiss_index_path, manifest)
+    print(f"FAISS index successfully built and saved to: {faiss_index_path}")
+    print(f"Index update summary: added {added}, updated {updated}, removed {removed}, reused {reused}")
+    return {"added": added, "updated": updated, "removed": removed, "reused": reused, "documents": len(rows)}
+
+
+def update_shards(faiss_index_path, chunks_by_source, embeddings, embedding, config, version, ingestion=None, only=None, **options):
+    """
+    Sharded layout: one complete index per source in shards/<source>, each
+    updated incrementally by update_index, and shards.json listing them.
+    chunks_by_source maps each source to its chunks of Documents, which are
+    read when the turn of its shard comes. only restricts the update to those
+    shards and leaves the others as they are. Returns whether anything changed.
+    """
+    manifest = load_shards(faiss_index_path) or {"shards": {}}
+    names = sorted(only or set(chunks_by_source) | set(manifest["shards"]))
+    changed = not os.path.exists(os.path.join(faiss_index_path, SHARDS_FILE))
+
+    def noting_sources(chunks, sources):
+        # Rows merged from several reports are reached by a filter on any of their sources
+        for chunk in chunks:
+            sources.update(*(d.metadata.get("sources") or [] for d in chunk))
+            yield chunk
+
+    for name in names:
+        shard_path = os.path.join(faiss_index_path, SHARDS_DIR, name)
+        chunks = nonempty(chunks_by_source.get(name, []))
+        if chunks is None:
+            if name in manifest["shards"]:
+                # The source is gone, and so are its rows
+                print(f"Removing shard {name}: the source has no documents")
+                shutil.rmtree(shard_path, ignore_errors=True)
+                del manifest["shards"][name]
+                changed = True
+            continue
+        print(f"Updating shard {name}")
+        os.makedirs(shard_path, exist_ok=True)
+        source_report = {name: ingestion[name]} if ingestion and name in ingestion else None
+        sources = {name}
+        summary = update_index(shard_path, noting_sources(chunks, sources), embeddings, embedding, config, version,
+                               source_report, **options)
+        shard_manifest = load_manifest(shard_path)
+        manifest["shards"][name] = {
+            "path": f"{SHARDS_DIR}/{name}",
+            "sources": sorted(sources),
+            "documents": len(shard_manifest["rows"]),
+            "version": shard_manifest["version"]
+        }
+        changed = changed or summary is not None
+    if changed:
+        manifest.update(version=version, embedding=embedding, index=config)
+        save_shards(faiss_index_path, manifest)
+        shard_list = ", ".join(f"{name} ({shard['documents']})" for name, shard in manifest["shards"].items())
+        print(f"Shard manifest written: {shard_list}")
+    return changed
+
+
+def remove_shards(faiss_index_path):
+    """Deletes the shards of an earlier sharded build in the same directory, returns whether there were any."""
+    if not os.path.exists(os.path.join(faiss_index_path, SHARDS_FILE)):
+        return False
+    os.remove(os.path.join(faiss_index_path, SHARDS_FILE))
+    shutil.rmtree(os.path.join(faiss_index_path, SHARDS_DIR), ignore_errors=True)
+    return True
+
+
+def build_faiss_index(full_rebuild=False, batch_size=None, workers=None, executor=None,
+                      index_type=None, index_params=None, dedup=None, embedding_backend=None,
+                      compact=None, compact_codec=None, chunk_size=None, ingest_workers=None,
+                      versioned=None, keep_versions=None, sharded=None, shards=None):
+    """
+    Loads documents from the CSV files registered in sources.py, generates
+    FAISS index using HuggingFace embeddings, and saves it locally.
     Environment variables DATA_PATH and FAISS_INDEX_PATH specify the locations.
+    Files are parsed chunk_size (INGEST_CHUNK_SIZE) rows at a time, on
+    ingest_workers (INGEST_WORKERS) threads, and the per-source row counts,
+    bytes read and times are printed and kept in the manifest.
+
+    The chunks are hashed and embedded as they are read, so apart from the
+    index itself (vectors and docstore) the build holds a chunk, the batches
+    being embedded and the documents of changed rows. dedup is the exception:
+    it compares rows across sources and needs the whole corpus in memory.
+
+    Documents are embedded in batches of EMBED_BATCH_SIZE on EMBED_WORKERS
+    workers (EMBED_EXECUTOR is 'process' or 'thread') and each batch is added
+    to the index as soon as it is encoded.
+
+    index_type (INDEX_TYPE) selects a flat, hnsw, ivf_flat or ivf_pq index;
+    index_params overrides its defaults (nlist, M, efSearch, nprobe, ...).
+    The chosen type and parameters are stored in the manifest so that the
+    ChatBot applies the same search settings when it loads the index.
+
+    embedding_backend (EMBEDDING_BACKEND) runs the model in torch, onnx or
+    onnx_int8, see embedding_backends.py. It is recorded in the manifest;
+    switching to a backend with incompatible vectors rebuilds the index.
+
+    compact (COMPACT_STORE=1) also writes the compact format the ChatBot
+    prefers: vectors encoded with compact_codec (COMPACT_CODEC, fp16 or int8)
+    in a memory-mapped index and documents in an Arrow file, see
+    compact_store.py. The pickled store is still written for incremental builds.
+
+    dedup (DEDUP=1) merges reports of the same incident from different
+    sources into one vector before embedding, see deduplicate_documents.
+
+    A manifest next to the index records a content hash per row. When it
+    matches the current model, only new or changed rows are embedded and
+    rows that disappeared from the CSVs are removed by their FAISS id.
+    Pass full_rebuild=True to ignore the existing index.
+
+    versioned (INDEX_VERSIONED=1) never writes to the index being served:
+    the build updates a copy in FAISS_INDEX_PATH/versions/<version>, then
+    points FAISS_INDEX_PATH/CURRENT at it and keeps the newest keep_versions
+    (INDEX_KEEP_VERSIONS, 2). Running ChatBots reload it without a restart.
+
+    sharded (INDEX_SHARDED=1) builds one index per source under
+    FAISS_INDEX_PATH/shards, listed in shards.json, which the ChatBot searches
+    in parallel. shards limits the build to those sources and leaves the
+    other shards untouched, so one source is re-indexed without the rest.
     """
     load_dotenv()
 
     data_path = os.environ.get("DATA_PATH", "data")
     faiss_index_path = os.environ.get("FAISS_INDEX_PATH", "faiss_index")
-    model_name = 'sentence-transformers/all-mpnet-base-v2' # This could also be an env var
-
-    # Configuration for CSV files and relevant columns
-    # Matches the one in RAG.py, consider centralizing if it grows more complex
-    csvs_config = {
-        'CISSM': ['event_description'],
-        'HACKMAGEDDON': ['Description'],
-        'ICSSTRIVE': ['description'],
-        'KONBRIEFING': ['description'],
-        'TISAFE': ['attack_details', 'id'],
-        'WATERFALL': ['incident_summary', 'id']
-    }
+    embedding = embedding_config(backend=embedding_backend)
+    model_name = embedding["model_name"]
+    batch_size = batch_size or int(os.environ.get("EMBED_BATCH_SIZE", "256"))
+    workers = workers or int(os.environ.get("EMBED_WORKERS", "1"))
+    executor = executor or os.environ.get("EMBED_EXECUTOR", "process")
+    if dedup is None:
+        dedup = os.environ.get("DEDUP", "0").lower() in ("1", "true", "yes")
+    if compact is None:
+        compact = os.environ.get("COMPACT_STORE", "0").lower() in ("1", "true", "yes")
+    compact_codec = compact_codec or os.environ.get("COMPACT_CODEC", "fp16")
+    if compact_codec not in CODECS:
+        raise ValueError(f"Unknown compact codec '{compact_codec}'. Choose one of: {', '.join(CODECS)}")
+    config = index_config(index_type or os.environ.get("INDEX_TYPE", "flat"), **(index_params or {}))
+    if versioned is None:
+        versioned = os.environ.get("INDEX_VERSIONED", "0").lower() in ("1", "true", "yes")
+    keep_versions = keep_versions or int(os.environ.get("INDEX_KEEP_VERSIONS", "2"))
+    if sharded is None:
+        sharded = bool(shards) or os.environ.get("INDEX_SHARDED", "0").lower() in ("1", "true", "yes")
+    unknown = [name for name in shards or [] if name not in SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown source '{unknown[0]}'. Choose one of: {', '.join(SOURCES)}")
+    if shards and not sharded:
+        raise ValueError("Rebuilding single shards requires a sharded index")
+    if sharded and dedup:
+        # Duplicates are merged across sources, which a per-source shard never sees
+        raise ValueError("Deduplication cannot be combined with a sharded index")
 
-    documents = []
-    print(f"Loading documents from: {data_path}")
-    for titulo_documento, columns in csvs_config.items():
-        file_path = f'{data_path}/{titulo_documento}_cleaned.csv'
-        try:
-            df = pd.read_csv(file_path)
-            df = df[columns]
-            if 'id' not in columns:
-                df['id'] = df.index
-
-            for i, r in df.iterrows():
-                documents.append(
-                    Document(
-                        page_content=r.iloc[0],
-                        metadata={
-                            "source": titulo_documento,
-                            "id": r['id']
-                        }
-                    )
-                )
-            print(f"Loaded {len(df)} documents from {file_path}")
-        except FileNotFoundError:
-            print(f"ERROR: File not found {file_path}. Skipping.")
-            continue
-        except KeyError as e:
-            print(f"ERROR: Column {e} not found in {file_path}. Skipping.")
-            continue
-    
-    if not documents:
+    # Sources and their columns are declared in sources.py. They are read a
+    # chunk at a time while the index is updated, see update_index
+    sources = {name: SOURCES[name] for name in shards} if shards else SOURCES
+    ingestion = {}
+    if sharded:
+        # Each shard reads its own source when its turn comes
+        streams = {
+            name: nonempty(iter_documents(data_path, {name: spec}, chunk_size, ingest_workers, ingestion))
+            for name, spec in sources.items()
+        }
+        streams = {name: chunks for name, chunks in streams.items() if chunks is not None}
+        loaded = bool(streams)
+    else:
+        streams = nonempty(iter_documents(data_path, sources, chunk_size, ingest_workers, ingestion))
+        loaded = streams is not None
+    if not loaded:
+        print_report(ingestion)
         print("No documents loaded. FAISS index will not be built.")
         return
 
-    print(f"Generating FAISS index with model: {model_name}")
-    embeddings = HuggingFaceEmbeddings(model_name=model_name)
-    
+    # Recorded in the manifest and reported by the health checks of the services
+    version = new_version()
+    index_root = faiss_index_path
+    if versioned:
+        faiss_index_path = os.path.join(index_root, VERSIONS_DIR, version)
+        previous = resolve_index_path(index_root) if current_version(index_root) else None
+        if previous and os.path.isdir(previous) and not full_rebuild:
+            # The incremental update runs on a copy, the served version stays untouched
+            shutil.copytree(previous, faiss_index_path)
+        else:
+            os.makedirs(faiss_index_path)
+        print(f"Building index version {version} in {faiss_index_path}")
+
+    print(f"Generating FAISS index with model: {describe(embedding)}")
+    embeddings = HuggingFaceEmbeddings(model_name=model_name, **embedding_kwargs(embedding))
+
+    options = dict(full_rebuild=full_rebuild, batch_size=batch_size, workers=workers, executor=executor,
+                   dedup=dedup, compact=compact, compact_codec=compact_codec)
     try:
-        vector_store = FAISS.from_documents(documents, embedding=embeddings)
-        vector_store.save_local(faiss_index_path)
-        print(f"FAISS index successfully built and saved to: {faiss_index_path}")
+        if sharded:
+            changed = update_shards(faiss_index_path, streams, embeddings, embedding, config, version, ingestion,
+                                    only=shards, **options)
+        else:
+            changed = update_index(faiss_index_path, streams, embeddings, embedding, config, version, ingestion,
+                                   **options) is not None
+            # A single index replaces the shards of an earlier sharded build
+            changed = remove_shards(faiss_index_path) or changed
+        print_report(ingestion)
     except Exception as e:
         print(f"Error building or saving FAISS index: {e}")
+        if versioned:
+            # A failed build is never published
+            shutil.rmtree(faiss_index_path, ignore_errors=True)
+        return
+    if versioned:
+        if changed:
+            publish_version(index_root, version, keep_versions)
+            print(f"Published index version {version}")
+        else:
+            shutil.rmtree(faiss_index_path, ignore_errors=True)
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or incrementally update the FAISS index.")
+    parser.add_argument("--full", action="store_true", help="ignore the existing index and re-embed every row")
+    parser.add_argument("--batch-size", type=int, help="documents per embedding batch (EMBED_BATCH_SIZE, default 256)")
+    parser.add_argument("--workers", type=int, help="parallel embedding workers (EMBED_WORKERS, default 1)")
+    parser.add_argument("--executor", choices=["process", "thread"], help="worker pool type (EMBED_EXECUTOR, default process)")
+    parser.add_argument("--index-type", choices=list(INDEX_TYPES), help="FAISS index type (INDEX_TYPE, default flat)")
+    parser.add_argument("--nlist", type=int, help="IVF: number of inverted lists")
+    parser.add_argument("--nprobe", type=int, help="IVF: lists visited per query")
+    parser.add_argument("--M", type=int, dest="M", help="HNSW: neighbours per node")
+    parser.add_argument("--ef-construction", type=int, dest="efConstruction", help="HNSW: build-time beam width")
+    parser.add_argument("--ef-search", type=int, dest="efSearch", help="HNSW: query-time beam width")
+    parser.add_argument("--pq-m", type=int, dest="pq_m", help="IVF-PQ: sub-quantizers per vector")
+    parser.add_argument("--pq-bits", type=int, dest="pq_bits", help="IVF-PQ: bits per sub-quantizer code")
+    parser.add_argument("--dedup", action="store_true", default=None, help="merge duplicate incidents across sources (DEDUP)")
+    parser.add_argument("--compact", action="store_true", default=None,
+                        help="also write the memory-mapped vector store and Arrow docstore (COMPACT_STORE)")
+    parser.add_argument("--compact-codec", choices=list(CODECS), help="encoding of the compact vectors (COMPACT_CODEC, default fp16)")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, help="model runtime (EMBEDDING_BACKEND, default torch)")
+    parser.add_argument("--chunk-size", type=int, help="CSV rows parsed at a time (INGEST_CHUNK_SIZE, default 5000)")
+    parser.add_argument("--ingest-workers", type=int, help="sources parsed in parallel (INGEST_WORKERS, default 1)")
+    parser.add_argument("--versioned", action="store_true", default=None,
+                        help="build into a new version directory and publish it when complete (INDEX_VERSIONED)")
+    parser.add_argument("--keep-versions", type=int, help="versions kept on disk (INDEX_KEEP_VERSIONS, default 2)")
+    parser.add_argument("--sharded", action="store_true", default=None, help="build one index per source (INDEX_SHARDED)")
+    parser.add_argument("--shard", nargs="+", choices=list(SOURCES), dest="shards", metavar="SOURCE",
+                        help="rebuild only the shards of these sources, implies --sharded")
+    args = parser.parse_args()
+    index_params = {name: getattr(args, name) for name in ("nlist", "nprobe", "M", "efConstruction", "efSearch", "pq_m", "pq_bits")}
     print("Starting FAISS index build process...")
-    build_faiss_index()
-    print("FAISS index build process finished.") 
\ No newline at end of file
+    build_faiss_index(full_rebuild=args.full, batch_size=args.batch_size, workers=args.workers, executor=args.executor,
+                      index_type=args.index_type, index_params=index_params, dedup=args.dedup,
+                      embedding_backend=args.embedding_backend, compact=args.compact, compact_codec=args.compact_codec,
+                      chunk_size=args.chunk_size, ingest_workers=args.ingest_workers,
+                      versioned=args.versioned, keep_versions=args.keep_versions,
+                      sharded=args.sharded, shards=args.shards)
+    print("FAISS index build process finished.")
@@ -0,0 +1,134 @@
+import os
+import json
+import faiss
+import numpy as np
+import pyarrow as pa
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from faiss_utils import apply_search_params, read_mapped_index
+
+# Files written next to the pickled index by `build_index.py --compact`
+COMPACT_INDEX_FILE = "compact.faiss"
+DOCSTORE_FILE = "docstore.arrow"
+
+# Encodings of the stored vectors: half precision halves them with no measurable
+# loss in retrieval, 8-bit scalar quantization takes a quarter of float32
+CODECS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def make_compact_index(config, dim, codec="fp16"):
+    """
+    Empty id-mapped index of the same type and parameters as make_index,
+    storing scalar-quantized codes instead of float32 vectors. Flat and HNSW
+    codes can be memory-mapped when the index is read back; IVF inverted
+    lists are still read into memory.
+    """
+    qtype = CODECS[codec]
+    params = config["params"]
+    if config["type"] == "hnsw":
+        inner = faiss.IndexHNSWSQ(dim, qtype, params["M"])
+        inner.hnsw.efConstruction = params["efConstruction"]
+    elif config["type"].startswith("ivf"):
+        inner = faiss.IndexIVFScalarQuantizer(faiss.IndexFlatL2(dim), dim, params["nlist"], qtype)
+    else:
+        inner = faiss.IndexScalarQuantizer(dim, qtype)
+    index = faiss.IndexIDMap2(inner)
+    apply_search_params(index, config)
+    return index
+
+
+def stored_vectors(index):
+    """FAISS ids and vectors of an id-mapped index, ordered by id."""
+    ids = faiss.vector_to_array(index.id_map)
+    inner = faiss.downcast_index(index.index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.make_direct_map()
+    vectors = inner.reconstruct_n(0, inner.ntotal) if len(ids) else np.empty((0, index.d), dtype=np.float32)
+    if ivf is not None:
+        # The direct map would block later removals on this index
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    order = np.argsort(ids, kind="stable")
+    return ids[order], vectors[order]
+
+
+def save_compact(faiss_index_path, vector_store, config, codec="fp16"):
+    """
+    Writes the compact copy of a vector store: its vectors re-encoded with
+    codec in compact.faiss, and its documents in docstore.arrow, one row per
+    FAISS id with the text and the metadata as JSON. Returns the summary
+    stored in the manifest.
+    """
+    ids, vectors = stored_vectors(vector_store.index)
+    index = make_compact_index(config, vector_store.index.d, codec)
+    if len(ids):
+        if not index.is_trained:
+            index.train(vectors)
+        index.add_with_ids(vectors, ids)
+    index_path = os.path.join(faiss_index_path, COMPACT_INDEX_FILE)
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+    docstore_ids = [vector_store.index_to_docstore_id[int(i)] for i in ids]
+    documents = [vector_store.docstore.search(docstore_id) for docstore_id in docstore_ids]
+    table = pa.table({
+        "faiss_id": pa.array(ids, type=pa.int64()),
+        "docstore_id": pa.array(docstore_ids, type=pa.string()),
+        "page_content": pa.array([d.page_content for d in documents], type=pa.large_string()),
+        "metadata": pa.array([json.dumps(d.metadata, default=str) for d in documents], type=pa.large_string()),
+    })
+    docstore_path = os.path.join(faiss_index_path, DOCSTORE_FILE)
+    # Uncompressed IPC file, so that it can be memory-mapped and read without copies
+    with pa.OSFile(docstore_path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table.combine_chunks())
+    os.replace(docstore_path + ".tmp", docstore_path)
+    return {
+        "codec": codec,
+        "documents": len(ids),
+        "index_bytes": os.path.getsize(index_path),
+        "docstore_bytes": os.path.getsize(docstore_path)
+    }
+
+
+class ArrowDocstore(Docstore):
+    """
+    Read-only docstore over a memory-mapped docstore.arrow. Only the ids are
+    loaded up front; search builds the Document of one row when it is asked
+    for, so a query touches the pages of the k rows it returns.
+    """
+
+    def __init__(self, path):
+        self._table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        self._content = self._table.column("page_content")
+        self._metadata = self._table.column("metadata")
+        docstore_ids = self._table.column("docstore_id").to_pylist()
+        self._rows = {docstore_id: row for row, docstore_id in enumerate(docstore_ids)}
+        self.index_to_docstore_id = dict(zip(self._table.column("faiss_id").to_pylist(), docstore_ids))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def search(self, search):
+        row = self._rows.get(search)
+        if row is None:
+            # Same answer as InMemoryDocstore
+            return f"ID {search} not found."
+        return Document(
+            page_content=self._content[row].as_py(),
+            metadata=json.loads(self._metadata[row].as_py())
+        )
+
+
+def load_compact(faiss_index_path, embeddings):
+    """
+    A FAISS vector store over the compact files: the index codes are
+    memory-mapped and documents are read from the Arrow file on demand, so
+    nothing is unpickled and processes serving the same index share its pages.
+    """
+    index = read_mapped_index(faiss_index_path, COMPACT_INDEX_FILE)
+    docstore = ArrowDocstore(os.path.join(faiss_index_path, DOCSTORE_FILE))
+    return FAISS(embeddings, index, docstore, docstore.index_to_docstore_id)
@@ -0,0 +1,77 @@
+import math
+import numpy as np
+
+# Llama 3 averages about four characters of English text per token
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    """
+    Approximate number of LLM tokens in a text. Computed at build time for
+    every document and stored in its metadata under "tokens".
+    """
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def truncate(text, max_tokens):
+    """The text cut to about max_tokens tokens."""
+    limit = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+def passage_tag(document):
+    """Source, id and year of a passage, e.g. [TISAFE:9, 2022]."""
+    metadata = document.metadata
+    tag = f"{metadata.get('source')}:{metadata.get('id')}"
+    if metadata.get("year"):
+        tag += f", {metadata['year']}"
+    return f"[{tag}]"
+
+
+def format_passage(document):
+    """One prompt line per passage, tagged with its source."""
+    return f"{passage_tag(document)} {' '.join(document.page_content.split())}"
+
+
+def passage_tokens(document):
+    """Tokens a passage takes in the prompt, from the count stored at build time plus its tag."""
+    tokens = document.metadata.get("tokens") or count_tokens(document.page_content)
+    return tokens + count_tokens(passage_tag(document) + " \n")
+
+
+def select_passages(vectors, tokens, budget, query_vector=None, mmr_lambda=0.7, duplicate_threshold=0.92):
+    """
+    Picks passages with maximal marginal relevance until the token budget is
+    spent. Candidates are given best first; relevance is their cosine
+    similarity to the query vector, or their rank when there is none. A
+    candidate whose similarity to an already picked passage reaches
+    duplicate_threshold is dropped as a near-duplicate, and one that does not
+    fit in the remaining budget is skipped in favour of shorter ones.
+
+    Returns the indexes of the picked passages in prompt order and the number
+    of near-duplicates dropped.
+    """
+    n = len(tokens)
+    if n == 0:
+        return [], 0
+    vectors = np.asarray(vectors, dtype=np.float32)
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if query_vector is not None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = unit @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    else:
+        relevance = np.linspace(1.0, 0.0, n, dtype=np.float32)
+    similarity = unit @ unit.T
+
+    selected, duplicates, used = [], 0, 0
+    remaining = list(range(n))
+    while remaining:
+        redundancy = similarity[np.ix_(remaining, selected)].max(axis=1) if selected else np.zeros(len(remaining))
+        position = int(np.argmax(mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy))
+        best = remaining.pop(position)
+        if redundancy[position] >= duplicate_threshold:
+            duplicates += 1
+        elif used + tokens[best] <= budget:
+            selected.append(best)
+            used += tokens[best]
+    return selected, duplicates
@@ -0,0 +1,139 @@
+import re
+import zlib
+import numpy as np
+from langchain_core.documents import Document
+
+# Word n-grams compared between documents. Reports of the same incident are
+# short paraphrases of each other, so bigrams match far better than longer n-grams.
+SHINGLE_SIZE = 2
+
+# MinHash signature length, split into LSH bands of NUM_PERM // LSH_BANDS rows.
+# 32 bands of 2 rows make pairs with a Jaccard similarity above ~0.18 likely candidates.
+NUM_PERM = 64
+LSH_BANDS = 32
+
+# Candidate pairs must reach this estimated Jaccard similarity, and then this
+# cosine similarity of their embeddings, to be merged
+MIN_JACCARD = 0.15
+MIN_COSINE = 0.9
+
+# Buckets holding more documents than this are boilerplate, not duplicates
+MAX_BUCKET_SIZE = 50
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# Bound of the hash coefficients a and b, see minhash_signatures
+_COEFFICIENT_LIMIT = 1 << 32
+_WORD_PATTERN = re.compile(r"[^\W_]+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """crc32 hashes of the lowercased word n-grams of a text."""
+    words = _WORD_PATTERN.findall(str(text).lower())
+    grams = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+    return np.array(sorted(zlib.crc32(gram.encode("utf-8")) for gram in grams if gram), dtype=np.uint64)
+
+
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+    """
+    (len(texts), num_perm) MinHash signatures. The permutations are the
+    universal hashes (a * x + b) mod 2^61 - 1, applied to all shingles of
+    the corpus at once in chunks and reduced per document.
+    """
+    rng = np.random.default_rng(seed)
+    # Shingles are 32-bit crc32 values, so with 32-bit a and b the product
+    # stays below (2^32 - 1)^2 + 2^32 < 2^64: the uint64 arithmetic never
+    # wraps and the modulus is taken of the exact value
+    a = rng.integers(1, _COEFFICIENT_LIMIT, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _COEFFICIENT_LIMIT, size=num_perm, dtype=np.uint64)
+    hashed = [shingles(text, shingle_size) for text in texts]
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint32).max, dtype=np.uint64)
+    lengths = np.array([len(h) for h in hashed])
+    chunk_docs = max(1, 200_000 // max(int(lengths.mean()) if len(lengths) else 1, 1))
+    for first in range(0, len(texts), chunk_docs):
+        block = hashed[first:first + chunk_docs]
+        sizes = np.array([len(h) for h in block])
+        if not sizes.sum():
+            continue
+        values = np.concatenate(block)
+        permuted = ((values[:, None] * a + b) % _MERSENNE_PRIME) & np.uint64(0xFFFFFFFF)
+        nonempty = np.flatnonzero(sizes)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])[nonempty]
+        signatures[first + nonempty] = np.minimum.reduceat(permuted, starts, axis=0)
+    return signatures
+
+
+def candidate_pairs(signatures, groups, bands=LSH_BANDS, min_jaccard=MIN_JACCARD):
+    """
+    Pairs (i, j) that share an LSH band, belong to different groups (the
+    source datasets) and whose signatures agree on at least min_jaccard of
+    their positions.
+    """
+    rows = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i, key in enumerate(map(bytes, keys)):
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            if len(members) < 2 or len(members) > MAX_BUCKET_SIZE:
+                continue
+            for x, i in enumerate(members):
+                for j in members[x + 1:]:
+                    if groups[i] != groups[j]:
+                        pairs.add((i, j))
+    return [
+        (i, j) for i, j in sorted(pairs)
+        if np.mean(signatures[i] == signatures[j]) >= min_jaccard
+    ]
+
+
+def confirm_pairs(pairs, vectors_for, min_cosine=MIN_COSINE):
+    """
+    Embedding check of candidate pairs. vectors_for(indexes) returns the
+    embeddings of those documents; a pair is confirmed when their cosine
+    similarity reaches min_cosine. Returns one boolean per pair.
+    """
+    involved = sorted({i for pair in pairs for i in pair})
+    if not involved:
+        return []
+    vectors = np.asarray(vectors_for(involved), dtype=np.float32)
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    position = {i: p for p, i in enumerate(involved)}
+    return [bool(unit[position[i]] @ unit[position[j]] >= min_cosine) for i, j in pairs]
+
+
+def cluster_pairs(pairs):
+    """Connected components of the confirmed duplicate pairs, as sorted lists of two or more indexes."""
+    parent = {}
+
+    def find(i):
+        parent.setdefault(i, i)
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        parent[find(i)] = find(j)
+    clusters = {}
+    for i in list(parent):
+        clusters.setdefault(find(i), []).append(i)
+    return sorted(sorted(members) for members in clusters.values() if len(members) > 1)
+
+
+def merge_cluster(documents):
+    """
+    One document for a duplicate cluster: the longest description is kept as
+    the text, regions and identifier keywords are combined, and "duplicates"
+    lists the row keys of the other members.
+    """
+    representative = max(documents, key=lambda d: len(d.page_content))
+    metadata = dict(representative.metadata)
+    others = [d for d in documents if d is not representative]
+    metadata["duplicates"] = [f"{d.metadata['source']}:{d.metadata['id']}" for d in others]
+    metadata["sources"] = sorted({d.metadata["source"] for d in documents})
+    metadata["regions"] = sorted({region for d in documents for region in d.metadata.get("regions") or []})
+    keywords = [d.metadata.get("keywords") for d in documents if d.metadata.get("keywords")]
+    metadata["keywords"] = " ".join(dict.fromkeys(keywords)) or None
+    return Document(page_content=representative.page_content, metadata=metadata)
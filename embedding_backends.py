@@ -0,0 +1,120 @@
+"""
+Embedding backends of the sentence-transformers model used for the corpus
+and the queries. The backend an index was built with is recorded in its
+manifest, and queries must be embedded in the same vector space.
+
+    torch      full-precision PyTorch (the default)
+    onnx       the model exported to ONNX and run by ONNX Runtime
+    onnx_int8  the ONNX model with weights dynamically quantized to int8
+
+The ONNX backends need `pip install optimum[onnxruntime]`. sentence-transformers
+models on the hub ship the ONNX and int8 files; for other models export them once:
+
+    python embedding_backends.py export --backend onnx_int8 --out models/mpnet-int8
+    EMBEDDING_MODEL=models/mpnet-int8 EMBEDDING_BACKEND=onnx_int8 python build_index.py
+"""
+import os
+import argparse
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx_int8")
+
+DEFAULT_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+# Instruction sets the int8 model can be quantized for. avx2 runs on any x86-64
+# server of the last decade; avx512_vnni is faster where it is available.
+QUANTIZATIONS = ("avx2", "avx512", "avx512_vnni", "arm64")
+
+
+def embedding_config(model_name=None, backend=None, quantization=None):
+    """
+    The {"model_name", "backend"[, "quantization"]} description stored in the
+    manifest, from the arguments or EMBEDDING_MODEL, EMBEDDING_BACKEND and
+    EMBEDDING_QUANTIZATION.
+    """
+    backend = backend or os.environ.get("EMBEDDING_BACKEND", "torch")
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of: {', '.join(EMBEDDING_BACKENDS)}")
+    config = {"model_name": model_name or os.environ.get("EMBEDDING_MODEL", DEFAULT_MODEL), "backend": backend}
+    if backend == "onnx_int8":
+        quantization = quantization or os.environ.get("EMBEDDING_QUANTIZATION", "avx2")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}'. Choose one of: {', '.join(QUANTIZATIONS)}")
+        config["quantization"] = quantization
+    return config
+
+
+def manifest_embedding(manifest):
+    """
+    Embedding config an index was built with. Indexes from before the
+    backends were configurable used torch, and the default model before it
+    was recorded.
+    """
+    return manifest.get("embedding") or {"model_name": manifest.get("model_name", DEFAULT_MODEL), "backend": "torch"}
+
+
+def vector_space(config):
+    """
+    Configs with the same vector space produce interchangeable vectors. The
+    ONNX export computes the same function as torch up to float rounding,
+    while int8 weights move the vectors enough that the corpus and the
+    queries must go through the same quantized model.
+    """
+    if config["backend"] == "onnx_int8":
+        return (config["model_name"], f"int8-{config['quantization']}")
+    return (config["model_name"], "float32")
+
+
+def describe(config):
+    """e.g. sentence-transformers/all-mpnet-base-v2 (onnx_int8, avx2)"""
+    details = ", ".join(filter(None, [config["backend"], config.get("quantization")]))
+    return f"{config['model_name']} ({details})"
+
+
+def check_compatible(index_config, query_config):
+    """Raises ValueError when vectors from query_config cannot be searched in an index built with index_config."""
+    if vector_space(index_config) != vector_space(query_config):
+        raise ValueError(
+            f"The index was built with {describe(index_config)}, but queries would be embedded with "
+            f"{describe(query_config)} and their vectors are not comparable. Set EMBEDDING_MODEL, "
+            "EMBEDDING_BACKEND and EMBEDDING_QUANTIZATION to match the index, or rebuild it."
+        )
+
+
+def quantized_file_name(config):
+    """File of the int8 model inside the model directory, as written by sentence-transformers."""
+    return f"onnx/model_qint8_{config['quantization']}.onnx"
+
+
+def embedding_kwargs(config):
+    """Keyword arguments of HuggingFaceEmbeddings, next to model_name, that select the backend."""
+    if config["backend"] == "torch":
+        return {}
+    model_kwargs = {"backend": "onnx"}
+    if config["backend"] == "onnx_int8":
+        model_kwargs["model_kwargs"] = {"file_name": quantized_file_name(config)}
+    return {"model_kwargs": model_kwargs}
+
+
+def export_model(config, output_dir):
+    """
+    Saves the model with its ONNX export to output_dir and, for onnx_int8, its
+    dynamically quantized variant next to it.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    model = SentenceTransformer(config["model_name"], backend="onnx")
+    model.save_pretrained(output_dir)
+    if config["backend"] == "onnx_int8":
+        export_dynamic_quantized_onnx_model(model, config["quantization"], output_dir)
+    print(f"Exported {describe(config)} to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding backends of the index and query model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export the model to ONNX, optionally quantized to int8")
+    export.add_argument("--model", help=f"model to export (default EMBEDDING_MODEL or {DEFAULT_MODEL})")
+    export.add_argument("--backend", choices=["onnx", "onnx_int8"], default="onnx_int8")
+    export.add_argument("--quantization", choices=QUANTIZATIONS)
+    export.add_argument("--out", required=True, help="directory to write the model to")
+    args = parser.parse_args()
+    export_model(embedding_config(args.model, args.backend, args.quantization), args.out)
@@ -0,0 +1,253 @@
+import os
+import json
+import shutil
+import datetime
+import faiss
+import numpy as np
+
+# Name of the file written next to the FAISS index that records which rows it holds
+MANIFEST_FILE = "manifest.json"
+
+# Versioned layout (build_index.py --versioned): every build is a complete index in
+# FAISS_INDEX_PATH/versions/<version>, and FAISS_INDEX_PATH/CURRENT names the one to serve
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+
+# Sharded layout (build_index.py --sharded): one complete index per source in
+# shards/<source>, listed with their sources and sizes in shards.json
+SHARDS_DIR = "shards"
+SHARDS_FILE = "shards.json"
+
+# Supported index types and the parameters each one uses. Values are the defaults.
+INDEX_TYPES = {
+    "flat": {},
+    "hnsw": {"M": 32, "efConstruction": 40, "efSearch": 64},
+    "ivf_flat": {"nlist": 128, "nprobe": 16},
+    "ivf_pq": {"nlist": 128, "nprobe": 16, "pq_m": 48, "pq_bits": 8},
+}
+
+# Parameters that only affect search and can be changed on a loaded index
+SEARCH_PARAMS = ("efSearch", "nprobe")
+
+
+def load_manifest(faiss_index_path):
+    """Loads the manifest saved next to the index, or None if there is none."""
+    manifest_path = os.path.join(faiss_index_path, MANIFEST_FILE)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Could not read manifest {manifest_path}: {e}")
+        return None
+
+
+def save_manifest(faiss_index_path, manifest):
+    """Writes the manifest atomically so a crash never leaves a partial file."""
+    manifest_path = os.path.join(faiss_index_path, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_shards(faiss_index_path):
+    """The shards.json of a sharded index, or None for a single index."""
+    try:
+        with open(os.path.join(faiss_index_path, SHARDS_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_shards(faiss_index_path, shards):
+    """Writes shards.json atomically, after every shard it lists is complete."""
+    shards_path = os.path.join(faiss_index_path, SHARDS_FILE)
+    with open(shards_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(shards, f, indent=2)
+    os.replace(shards_path + ".tmp", shards_path)
+
+
+def new_version():
+    """Version name of a build, sortable by build time, e.g. 20261018T093012123456Z."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def current_version(faiss_index_path):
+    """Version named in CURRENT, or None when the index is not versioned."""
+    try:
+        with open(os.path.join(faiss_index_path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_path(faiss_index_path):
+    """Directory of the index to serve: the CURRENT version of a versioned layout, or the path itself."""
+    version = current_version(faiss_index_path)
+    return os.path.join(faiss_index_path, VERSIONS_DIR, version) if version else faiss_index_path
+
+
+def version_marker(faiss_index_path):
+    """
+    Cheap fingerprint of the published index, polled to detect a new one:
+    the CURRENT version, or the size and modification time of shards.json
+    or of the manifest, which builds write last.
+    """
+    version = current_version(faiss_index_path)
+    if version:
+        return version
+    for name in (SHARDS_FILE, MANIFEST_FILE):
+        try:
+            stat = os.stat(os.path.join(faiss_index_path, name))
+        except FileNotFoundError:
+            continue
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+    return None
+
+
+def publish_version(faiss_index_path, version, keep=2):
+    """
+    Points CURRENT at a complete version, atomically, and deletes all but
+    the newest keep versions. Processes still serving a deleted version
+    keep its open and mapped files until they switch.
+    """
+    current_path = os.path.join(faiss_index_path, CURRENT_FILE)
+    with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(current_path + ".tmp", current_path)
+    versions = sorted(os.listdir(os.path.join(faiss_index_path, VERSIONS_DIR)))
+    for old in versions[:-keep] if keep > 0 else []:
+        if old != version:
+            shutil.rmtree(os.path.join(faiss_index_path, VERSIONS_DIR, old), ignore_errors=True)
+
+
+def read_mapped_index(faiss_index_path, file_name="index.faiss"):
+    """
+    Reads an index with its stored vectors memory-mapped read-only instead
+    of copied to the heap, so processes serving the same index share one copy
+    through the page cache. IVF inverted lists are still read into memory.
+    """
+    path = os.path.join(faiss_index_path, file_name)
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+
+
+def index_config(index_type="flat", **params):
+    """
+    Returns the {"type", "params"} description stored in the manifest,
+    filling in defaults for parameters that were not given.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose one of: {', '.join(INDEX_TYPES)}")
+    merged = dict(INDEX_TYPES[index_type])
+    merged.update({name: value for name, value in params.items() if name in merged and value is not None})
+    return {"type": index_type, "params": merged}
+
+
+def build_params(config):
+    """The parameters that are fixed once the index is built."""
+    return {name: value for name, value in config["params"].items() if name not in SEARCH_PARAMS}
+
+
+def make_index(config, dim):
+    """
+    Creates an empty id-mapped L2 index for the given config. IVF indexes
+    must be trained (see training_size) before vectors are added.
+    """
+    params = config["params"]
+    if config["type"] == "flat":
+        inner = faiss.IndexFlatL2(dim)
+    elif config["type"] == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, params["M"])
+        inner.hnsw.efConstruction = params["efConstruction"]
+    elif config["type"] == "ivf_flat":
+        inner = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, params["nlist"])
+    elif config["type"] == "ivf_pq":
+        if dim % params["pq_m"]:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the vector dimension {dim}")
+        inner = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, params["nlist"], params["pq_m"], params["pq_bits"])
+    else:
+        raise ValueError(f"Unknown index type '{config['type']}'")
+    index = faiss.IndexIDMap2(inner)
+    apply_search_params(index, config)
+    return index
+
+
+def training_size(config):
+    """Number of vectors to collect before training, 0 for indexes that need none."""
+    if config["type"].startswith("ivf"):
+        # faiss warns below 39 points per centroid
+        return 39 * config["params"]["nlist"]
+    return 0
+
+
+def supports_removal(index):
+    """
+    Only flat indexes delete in place. HNSW graphs cannot delete nodes, and
+    removing from an IVF index inside IndexIDMap2 shifts the inner positions
+    while id_map keeps the old ones, so ids would point at other vectors.
+    """
+    return isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+
+
+def rebuild_without(index, config, faiss_ids):
+    """
+    Returns a copy of an id-mapped index without the given ids, rebuilt from
+    the stored vectors. Used for index types that cannot remove ids in place.
+    IVF copies keep the trained quantizer of the original.
+    """
+    drop = set(int(i) for i in faiss_ids)
+    ids = faiss.vector_to_array(index.id_map)
+    keep = np.array([i for i in ids if int(i) not in drop], dtype=np.int64)
+    if config["type"].startswith("ivf"):
+        # Stored vectors are read back through the direct map
+        enable_reconstruct(index, config)
+        inner = faiss.clone_index(faiss.downcast_index(index.index))
+        inner.reset()
+        rebuilt = faiss.IndexIDMap2(inner)
+        apply_search_params(rebuilt, config)
+    else:
+        rebuilt = make_index(config, index.d)
+    if len(keep):
+        vectors = np.vstack([index.reconstruct(int(i)) for i in keep]).astype(np.float32)
+        rebuilt.add_with_ids(vectors, keep)
+    return rebuilt
+
+
+def apply_search_params(index, config):
+    """Sets efSearch / nprobe from the config on a loaded index."""
+    if not config:
+        return
+    space = faiss.ParameterSpace()
+    for name in SEARCH_PARAMS:
+        if name in config.get("params", {}):
+            space.set_index_parameter(index, name, config["params"][name])
+
+
+def enable_reconstruct(index, config):
+    """IVF indexes can only return stored vectors by id once they have a direct map."""
+    if config and config["type"].startswith("ivf"):
+        faiss.extract_index_ivf(index).make_direct_map()
+
+
+def search_parameters(config, selector):
+    """SearchParameters restricting a search to selector, keeping the index's own settings."""
+    params = (config or {}).get("params", {})
+    if config and config["type"] == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=params["efSearch"])
+    if config and config["type"].startswith("ivf"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=params["nprobe"])
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_subset(index, queries, faiss_ids, k):
+    """
+    Exact search restricted to a small set of ids, computed on their stored
+    vectors. Graph and IVF searches can miss results when a filter keeps only
+    a few documents; this cannot.
+    """
+    vectors = np.vstack([index.reconstruct(int(i)) for i in faiss_ids]).astype(np.float32)
+    distances, positions = faiss.knn(np.ascontiguousarray(queries, dtype=np.float32), vectors, min(k, len(faiss_ids)))
+    labels = np.where(positions >= 0, np.asarray(faiss_ids, dtype=np.int64)[positions], -1)
+    return distances, labels
@@ -0,0 +1,257 @@
+"""
+A local stand-in for the Groq chat-completions API, used by tests and
+benchmarks so they never reach the real service.
+
+It serves POST /openai/v1/chat/completions in the OpenAI wire format, both
+as a single JSON body and as a server-sent event stream when the request
+asks for "stream": true. Answers are deterministic, and the latency before
+the first byte and the pace of streamed tokens can be configured.
+
+Rate limits can be enforced or injected: the stub answers 429 with a
+retry-after header beyond requests_per_minute or tokens_per_minute, and to
+the first rate_limit_first requests. Every answer carries the
+x-ratelimit-* headers of the real API.
+
+    python groq_stub.py --port 8787 --latency 0.3 --tokens-per-second 150
+    python groq_stub.py --port 8787 --requests-per-minute 30 --rate-limit-first 5
+    GROQ_BASE_URL=http://127.0.0.1:8787 GROQ_API_KEY=stub streamlit run botInterface.py
+"""
+import json
+import time
+import socket
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+
+DEFAULT_REPLY = (
+    "Based on the context provided, the incident was a ransomware attack that "
+    "disrupted operational technology at a water utility."
+)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, like the real API
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle's algorithm
+        # holds the body back for a delayed ACK and adds ~40 ms to every answer
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stub._count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?")[0] != COMPLETIONS_PATH:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(body or b"{}")
+        stub._count("requests")
+        stub.last_request = request
+        retry_after, headers = stub.admit(request)
+        if retry_after is not None:
+            stub._count("rate_limited")
+            headers["retry-after"] = f"{retry_after:.3f}"
+            self._send_json(429, {"error": {
+                "message": f"Rate limit reached. Please try again in {retry_after:.3f}s.",
+                "type": "requests",
+                "code": "rate_limit_exceeded"
+            }}, headers)
+            return
+
+        if stub.latency:
+            time.sleep(stub.latency)
+        words = stub.reply_for(request).split(" ")
+        tokens = [word if i == 0 else " " + word for i, word in enumerate(words)]
+        if request.get("stream"):
+            self._stream(request, tokens, headers)
+        else:
+            time.sleep(stub.token_delay() * len(tokens))
+            self._send_json(200, stub.completion(request, "".join(tokens), len(tokens)), headers)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, request, tokens, headers):
+        stub = self.server.stub
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for token in tokens:
+            event = stub.chunk(request, {"content": token}, None)
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            time.sleep(stub.token_delay())
+        event = stub.chunk(request, {}, "stop")
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class GroqStubServer():
+    """
+    Runs the stub on a background thread. Use it as a context manager:
+
+        with GroqStubServer(latency=0.05) as stub:
+            os.environ["GROQ_BASE_URL"] = stub.base_url
+
+    `requests` and `connections` count what the server has seen, which lets
+    tests check that clients reuse their connections. `rate_limited` counts
+    the requests answered with 429.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, reply=DEFAULT_REPLY, latency=0.0, tokens_per_second=None,
+                 requests_per_minute=None, tokens_per_minute=None, rate_limit_first=0, retry_after=1.0):
+        self.reply = reply
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.requests = 0
+        self.connections = 0
+        self.rate_limited = 0
+        self.last_request = None
+        self._lock = threading.Lock()
+        # (time, prompt tokens) of the requests admitted in the last minute
+        self._window = []
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_for(self, request):
+        return self.reply(request) if callable(self.reply) else self.reply
+
+    def token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def admit(self, request):
+        """
+        Applies the rate limits to a request. Returns the retry-after in
+        seconds when it is rejected, else None, with the x-ratelimit-*
+        headers of the answer.
+        """
+        tokens = self.prompt_tokens(request)
+        with self._lock:
+            now = time.monotonic()
+            self._window = [(t, n) for t, n in self._window if t > now - 60]
+            retry_after = None
+            if self.rate_limit_first > 0:
+                self.rate_limit_first -= 1
+                retry_after = self.retry_after
+            elif self.requests_per_minute and len(self._window) >= self.requests_per_minute:
+                retry_after = self._window[0][0] + 60 - now
+            elif self.tokens_per_minute and sum(n for _, n in self._window) + tokens > self.tokens_per_minute:
+                retry_after = self._window[0][0] + 60 - now if self._window else self.retry_after
+            if retry_after is None:
+                self._window.append((now, tokens))
+            headers = {}
+            reset = f"{self._window[0][0] + 60 - now:.2f}s" if self._window else "0s"
+            if self.requests_per_minute:
+                headers["x-ratelimit-limit-requests"] = str(self.requests_per_minute)
+                headers["x-ratelimit-remaining-requests"] = str(max(self.requests_per_minute - len(self._window), 0))
+                headers["x-ratelimit-reset-requests"] = reset
+            if self.tokens_per_minute:
+                used = sum(n for _, n in self._window)
+                headers["x-ratelimit-limit-tokens"] = str(self.tokens_per_minute)
+                headers["x-ratelimit-remaining-tokens"] = str(max(self.tokens_per_minute - used, 0))
+                headers["x-ratelimit-reset-tokens"] = reset
+        return (max(retry_after, 0.001) if retry_after is not None else None), headers
+
+    @staticmethod
+    def prompt_tokens(request):
+        return sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def completion(self, request, content, completion_tokens):
+        prompt_tokens = self.prompt_tokens(request)
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    def chunk(self, request, delta, finish_reason):
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="groq-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the Groq chat-completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte of every answer")
+    parser.add_argument("--tokens-per-second", type=float, help="pace of the generated tokens (default: instant)")
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--requests-per-minute", type=int, help="answer 429 beyond this many requests a minute")
+    parser.add_argument("--tokens-per-minute", type=int, help="answer 429 beyond this many prompt tokens a minute")
+    parser.add_argument("--rate-limit-first", type=int, default=0, help="answer 429 to the first N requests")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after of the injected 429s, in seconds")
+    args = parser.parse_args()
+    stub = GroqStubServer(args.host, args.port, args.reply, args.latency, args.tokens_per_second,
+                          args.requests_per_minute, args.tokens_per_minute, args.rate_limit_first, args.retry_after)
+    print(f"Groq stub listening on {stub.base_url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
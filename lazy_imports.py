@@ -0,0 +1,70 @@
+"""
+Deferred imports of the heavy dependencies. Importing langchain_huggingface
+pulls in torch and transformers, and groq and langchain_community take
+about a second each, so RAG.py binds them to LazyImport placeholders
+instead: the module is imported the first time the name is called or one
+of its attributes is read. Health checks, the API master process and tests
+that mock these names never pay for them.
+
+    FAISS = LazyImport("langchain_community.vectorstores", "FAISS")
+    FAISS.load_local(...)    # imports langchain_community.vectorstores here
+
+The time each deferred import took is kept in deferred_imports() for the
+startup profile (benchmark.py startup) and the health checks.
+"""
+import time
+import importlib
+import threading
+
+_lock = threading.Lock()
+# module -> seconds its deferred import took, in import order
+_import_seconds = {}
+
+
+class LazyImport():
+    """
+    Stands for attribute name of module (or the module itself without a
+    name) until it is first used, then forwards calls and attribute reads
+    to it.
+    """
+
+    def __init__(self, module, name=None):
+        self._module = module
+        self._name = name
+        self._target = None
+
+    def load(self):
+        """Imports the module if needed and returns the object this stands for."""
+        target = self._target
+        if target is None:
+            with _lock:
+                if self._target is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._module)
+                    _import_seconds.setdefault(self._module, time.perf_counter() - started)
+                    self._target = getattr(module, self._name) if self._name else module
+                target = self._target
+        return target
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def __getattr__(self, attr):
+        # Dunder lookups (copy, pickle, mock introspection) must not trigger the import
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        name = f"{self._module}.{self._name}" if self._name else self._module
+        return f"<LazyImport {name}{'' if self.loaded else ' (not imported)'}>"
+
+
+def deferred_imports():
+    """Seconds each deferred import took so far, by module."""
+    with _lock:
+        return {module: round(seconds, 4) for module, seconds in _import_seconds.items()}
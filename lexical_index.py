@@ -0,0 +1,171 @@
+import os
+import re
+from collections import Counter
+import numpy as np
+
+# Name of the file written next to the FAISS index with the BM25 inverted index
+LEXICAL_FILE = "lexical.npz"
+
+# Words, plus compound identifiers such as CVE-2021-44228, APT-C-23 or log4j.core
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_.][^\W_]+)*")
+SPLIT_PATTERN = re.compile(r"[-_.]")
+
+# Frequent English words left out of the postings, they only slow lookups down
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the "
+    "their this to was were which with".split()
+)
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Constant of reciprocal rank fusion, from Cormack et al.
+RRF_K = 60
+
+
+def tokenize(text):
+    """
+    Lowercased tokens of a text. Compound identifiers are kept whole and
+    also split into their parts, so "CVE-2021-44228" matches both the full
+    identifier and a query for "44228".
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(str(text).lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in SPLIT_PATTERN.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+def document_text(document):
+    """Text indexed for a document: its content and its identifier keywords."""
+    return f"{document.page_content} {document.metadata.get('keywords') or ''}"
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses several ranked lists of keys into one. Every key scores
+    sum(1 / (k + rank)) over the lists it appears in, so documents ranked
+    well by both retrievers come first without comparing raw scores.
+    Returns (key, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index():
+    """
+    BM25 inverted index over the indexed documents, aligned on FAISS ids.
+
+    Postings are stored in CSR form: the documents of term t are
+    doc_positions[offsets[t]:offsets[t + 1]] with their term frequencies
+    next to them. The per-posting BM25 weights are computed once on load,
+    so a query is a dictionary lookup per term plus a sum over the postings
+    of those terms.
+    """
+
+    def __init__(self, terms, offsets, doc_positions, term_freqs, doc_lengths, faiss_ids):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_positions = doc_positions
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.faiss_ids = faiss_ids
+        self._lookup = {term: i for i, term in enumerate(terms)}
+
+        n = len(faiss_ids)
+        document_freqs = np.diff(offsets)
+        idf = np.log1p((n - document_freqs + 0.5) / (document_freqs + 0.5))
+        avg_length = float(doc_lengths.mean()) if n else 0.0
+        lengths = doc_lengths[doc_positions].astype(np.float32)
+        tf = term_freqs.astype(np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(avg_length, 1e-9))
+        self.weights = (np.repeat(idf, document_freqs) * tf * (BM25_K1 + 1) / (tf + norm)).astype(np.float32)
+
+    @classmethod
+    def from_documents(cls, faiss_ids, documents):
+        """Tokenizes the documents and builds the postings, ordered by FAISS id."""
+        order = np.argsort(np.asarray(faiss_ids, dtype=np.int64), kind="stable")
+        faiss_ids = np.asarray(faiss_ids, dtype=np.int64)[order]
+
+        postings = {}
+        doc_lengths = np.zeros(len(order), dtype=np.uint32)
+        for position, i in enumerate(order):
+            counts = Counter(tokenize(document_text(documents[i])))
+            doc_lengths[position] = sum(counts.values())
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((position, count))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_positions = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.uint16)
+        for t, term in enumerate(terms):
+            entries = np.asarray(postings[term], dtype=np.int64)
+            doc_positions[offsets[t]:offsets[t + 1]] = entries[:, 0]
+            term_freqs[offsets[t]:offsets[t + 1]] = np.minimum(entries[:, 1], np.iinfo(np.uint16).max)
+        return cls(terms, offsets, doc_positions, term_freqs, doc_lengths, faiss_ids)
+
+    def save(self, faiss_index_path):
+        path = os.path.join(faiss_index_path, LEXICAL_FILE)
+        tmp_path = path + ".tmp.npz"
+        # Terms never contain a newline, so the vocabulary is stored as one utf-8 blob
+        vocabulary = np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype=np.uint8)
+        np.savez_compressed(
+            tmp_path,
+            vocabulary=vocabulary,
+            offsets=self.offsets,
+            doc_positions=self.doc_positions,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+            faiss_ids=self.faiss_ids
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, faiss_index_path):
+        """Loads the lexical index saved next to an index, or None if there is none."""
+        path = os.path.join(faiss_index_path, LEXICAL_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            vocabulary = data["vocabulary"].tobytes().decode("utf-8")
+            return cls(
+                vocabulary.split("\n") if vocabulary else [],
+                data["offsets"],
+                data["doc_positions"],
+                data["term_freqs"],
+                data["doc_lengths"],
+                data["faiss_ids"]
+            )
+
+    def search(self, query, k, allowed_ids=None):
+        """
+        FAISS ids and BM25 scores of the k best matching documents, best first.
+        allowed_ids restricts the results to those ids.
+        """
+        term_ids = {self._lookup[token] for token in tokenize(query) if token in self._lookup}
+        if not term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        slices = [slice(self.offsets[t], self.offsets[t + 1]) for t in term_ids]
+        positions = np.concatenate([self.doc_positions[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+
+        candidates, inverse = np.unique(positions, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        ids = self.faiss_ids[candidates]
+        if allowed_ids is not None:
+            keep = np.isin(ids, allowed_ids)
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return ids[order], scores[order]
@@ -0,0 +1,377 @@
+"""
+Scheduler in front of the Groq chat-completions calls.
+
+Every call waits for a slot: at most max_in_flight requests are sent at a
+time, and token buckets keep them under the requests-per-minute and
+tokens-per-minute limits of the account. Waiting calls are queued per
+session and served round-robin, so one busy session cannot starve the
+others. The x-ratelimit-* headers of every answer correct the buckets, and
+a 429 pauses the whole queue for its retry-after. Rate-limited, timed out
+and 5xx calls are retried with jittered exponential backoff.
+
+    LLM_MAX_IN_FLIGHT        concurrent requests (8)
+    LLM_REQUESTS_PER_MINUTE  request budget of the account, 0 for none (0)
+    LLM_TOKENS_PER_MINUTE    token budget of the account, 0 for none (0)
+    LLM_MAX_RETRIES          retries of a failed request (3)
+
+Without budgets, the scheduler still pauses when the headers report that
+none is left.
+"""
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from telemetry import LatencyHistogram
+
+# Child of the "chatbot" logger configured in botInterface.py
+logger = logging.getLogger("chatbot.llm_scheduler")
+
+# Statuses worth sending again: rate limits, timeouts and server errors
+RETRYABLE_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value):
+    """Seconds in a rate-limit header: "7.66s", "2m59.56s", "120ms" or a plain number of seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _UNITS[unit] for number, unit in parts)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenBucket():
+    """
+    per_minute units refilled continuously, up to a full minute's worth.
+    A bucket with per_minute <= 0 never makes anyone wait.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.per_minute > 0:
+            self.level = min(float(self.per_minute), self.level + max(now - self._updated, 0.0) * self.per_minute / 60.0)
+        self._updated = now
+
+    def wait_time(self, n, now):
+        """Seconds until n units are available."""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        # A request larger than the whole budget waits for a full bucket
+        n = min(n, self.per_minute)
+        return 0.0 if self.level >= n else (n - self.level) * 60.0 / self.per_minute
+
+    def take(self, n, now):
+        if self.per_minute > 0:
+            self._refill(now)
+            self.level -= min(n, self.per_minute)
+
+    def observe(self, remaining, now):
+        """Lowers the level to what the server reports as remaining."""
+        if self.per_minute > 0 and remaining is not None:
+            self._refill(now)
+            self.level = min(self.level, float(remaining))
+
+
+class LLMScheduler():
+    """
+    Admission control for LLM requests. call runs send() once a slot is
+    granted and retries it on retryable errors; acall does the same for a
+    coroutine. send must return the raw response of the Groq client
+    (with_raw_response), whose headers feed the buckets.
+    """
+
+    def __init__(self, max_in_flight=8, requests_per_minute=0, tokens_per_minute=0,
+                 max_retries=3, backoff_base=0.5, backoff_max=20.0, latency=None):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Queue waits are also recorded as the llm_queue stage of the request
+        self.latency = latency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self.queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.queue_wait = LatencyHistogram()
+        # Set by a 429 or an exhausted budget: nothing is sent before it
+        self._paused_until = 0.0
+        # session -> its waiting tickets, in the order sessions are served
+        self._waiting = OrderedDict()
+        self._changed = threading.Condition()
+        # (loop, future) of the coroutines in aacquire, resolved by the next notification
+        self._async_waiters = []
+
+    def acquire(self, session=None, tokens=0, request=None):
+        """
+        Blocks until this request may be sent: it is the next in the fair
+        queue, a slot is free and the buckets hold one request and tokens.
+        Returns the seconds spent waiting, which are also recorded as the
+        llm_queue stage of request (by default the one being served).
+        """
+        started = time.monotonic()
+        with self._changed:
+            ticket = self._enqueue(session)
+            try:
+                while True:
+                    timeout = self._wait_time(ticket, tokens)
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._changed.wait(timeout)
+            except BaseException:
+                self._abandon(session, ticket)
+                raise
+            waited = self._admit(session, ticket, tokens, started)
+        if self.latency is not None:
+            self.latency.record("llm_queue", waited * 1000, request)
+        return waited
+
+    async def aacquire(self, session=None, tokens=0, request=None):
+        """
+        acquire for coroutines. The wait happens on the event loop, woken by
+        the same notifications as the threads, so a queued request holds no
+        thread and a cancelled one simply leaves the queue.
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._changed:
+            ticket = self._enqueue(session)
+        try:
+            while True:
+                with self._changed:
+                    timeout = self._wait_time(ticket, tokens)
+                    if timeout is not None and timeout <= 0:
+                        waited = self._admit(session, ticket, tokens, started)
+                        break
+                    wake = loop.create_future()
+                    self._async_waiters.append((loop, wake))
+                await asyncio.wait((wake,), timeout=timeout)
+        except BaseException:
+            with self._changed:
+                self._abandon(session, ticket)
+            raise
+        if self.latency is not None:
+            self.latency.record("llm_queue", waited * 1000, request)
+        return waited
+
+    def release(self, headers=None):
+        """Frees the slot of a finished request, learning from its response headers."""
+        with self._changed:
+            self.in_flight -= 1
+            if headers is not None:
+                self._observe(headers)
+            self._notify()
+
+    def _enqueue(self, session):
+        ticket = object()
+        self.submitted += 1
+        self.queued += 1
+        self._waiting.setdefault(session, deque()).append(ticket)
+        return ticket
+
+    def _wait_time(self, ticket, tokens):
+        """None while ticket waits for its turn or a slot, else the seconds until the buckets let it go."""
+        if self._next_ticket() is not ticket or self.in_flight >= self.max_in_flight:
+            return None
+        now = time.monotonic()
+        return max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _admit(self, session, ticket, tokens, started):
+        """Gives ticket its slot; returns the seconds it waited."""
+        now = time.monotonic()
+        self._remove(session, ticket)
+        # Round-robin: this session goes behind the others still waiting
+        if session in self._waiting:
+            self._waiting.move_to_end(session)
+        self.queued -= 1
+        self.in_flight += 1
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+        waited = now - started
+        self.queue_wait.add(waited * 1000)
+        # The next ticket may be another session's, free to go now
+        self._notify()
+        return waited
+
+    def _abandon(self, session, ticket):
+        self._remove(session, ticket)
+        self.queued -= 1
+        self._notify()
+
+    def _notify(self):
+        """Wakes the waiting threads and coroutines to check their turn again; called holding _changed."""
+        self._changed.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, wake in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, wake)
+            except RuntimeError:
+                # The loop is closed; its waiter went with it
+                pass
+
+    def _next_ticket(self):
+        for tickets in self._waiting.values():
+            return tickets[0]
+        return None
+
+    def _remove(self, session, ticket):
+        tickets = self._waiting[session]
+        tickets.remove(ticket)
+        if not tickets:
+            del self._waiting[session]
+
+    def _observe(self, headers):
+        now = time.monotonic()
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            self.remaining_requests = int(float(remaining_requests))
+            self.requests.observe(self.remaining_requests, now)
+            if self.remaining_requests <= 0:
+                self._pause(parse_duration(headers.get("x-ratelimit-reset-requests")), now)
+        if remaining_tokens is not None:
+            self.remaining_tokens = int(float(remaining_tokens))
+            self.tokens.observe(self.remaining_tokens, now)
+            if self.remaining_tokens <= 0:
+                self._pause(parse_duration(headers.get("x-ratelimit-reset-tokens")), now)
+
+    def _pause(self, seconds, now):
+        if seconds:
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before sending again, or None when the error is final."""
+        if attempt >= self.max_retries:
+            return None
+        # Imported here so that importing the scheduler does not load the Groq SDK
+        from groq import APIConnectionError, APIStatusError
+        if isinstance(error, APIStatusError):
+            if error.status_code not in RETRYABLE_STATUSES:
+                return None
+        elif not isinstance(error, APIConnectionError):
+            return None
+        # Full jitter: clients retrying together spread out instead of colliding again
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            headers = error.response.headers
+            retry_after = parse_duration(headers.get("retry-after"))
+            with self._changed:
+                self.rate_limited += 1
+                self._observe(headers)
+                # The whole queue holds off, not only this request
+                self._pause(retry_after, time.monotonic())
+            delay = max(delay, retry_after or 0.0)
+        return delay
+
+    def _failed(self, error, attempt, delay):
+        with self._changed:
+            if delay is None:
+                self.failed += 1
+            else:
+                self.retries += 1
+        status = getattr(error, "status_code", None)
+        if delay is None:
+            return
+        logger.warning(f"LLM request failed, retrying in {delay:.2f}s: {str(error)}", extra={
+            "props": {"error_type": type(error).__name__, "status_code": status, "attempt": attempt + 1}
+        })
+
+    def call(self, send, session=None, tokens=0, keep_slot=False, request=None):
+        """
+        Sends send() when admitted and returns its raw response, retrying
+        retryable errors. With keep_slot the slot stays taken after success,
+        for a stream the caller reads and then passes to release.
+        """
+        attempt = 0
+        while True:
+            self.acquire(session, tokens, request)
+            try:
+                raw = send()
+            except Exception as e:
+                self.release()
+                delay = self._retry_delay(e, attempt)
+                self._failed(e, attempt, delay)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._completed(raw, keep_slot)
+            return raw
+
+    async def acall(self, send, session=None, tokens=0, request=None):
+        """call for a coroutine function send; it waits in the queue on the event loop."""
+        attempt = 0
+        while True:
+            await self.aacquire(session, tokens, request)
+            try:
+                raw = await send()
+            except asyncio.CancelledError:
+                self.release()
+                raise
+            except Exception as e:
+                self.release()
+                delay = self._retry_delay(e, attempt)
+                self._failed(e, attempt, delay)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._completed(raw, False)
+            return raw
+
+    def _completed(self, raw, keep_slot):
+        with self._changed:
+            self.completed += 1
+            if keep_slot:
+                self._observe(raw.headers)
+        if not keep_slot:
+            self.release(raw.headers)
+
+    def stats(self):
+        with self._changed:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "sessions_waiting": len(self._waiting),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "requests_per_minute": self.requests.per_minute,
+                "tokens_per_minute": self.tokens.per_minute,
+                "remaining_requests": self.remaining_requests,
+                "remaining_tokens": self.remaining_tokens,
+                "paused_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+                "queue_wait": self.queue_wait.snapshot()
+            }
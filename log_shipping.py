@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import atexit
+import time
+import queue
+import socket
+import logging
+import datetime
+import threading
+from telemetry import current_request_id
+
+# Logstash TCP input of the ELK stack (see logging/logstash/pipeline/logstash.conf)
+DEFAULT_PORT = 5000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the "props" passed in extra flattened into it."""
+
+    def format(self, record):
+        log_record = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name
+        }
+
+        # Correlates every line logged while serving a request
+        request_id = getattr(record, "request_id", None) or current_request_id()
+        if request_id:
+            log_record["request_id"] = request_id
+
+        # Add exception info if available
+        if record.exc_info:
+            log_record["exception"] = self.formatException(record.exc_info)
+
+        # Add extra fields if available
+        if hasattr(record, "props"):
+            log_record.update(record.props)
+
+        return json.dumps(log_record, default=str)
+
+
+class LogstashHandler(logging.Handler):
+    """
+    Ships records to the Logstash TCP input without blocking the caller.
+
+    emit only puts the record on a bounded queue; a background thread
+    serializes queued records and sends them newline-delimited, up to
+    batch_size per write. When the queue is full the record is dropped and
+    counted. When Logstash cannot be reached the batch is written to the
+    fallback stream (stdout, still collected by Filebeat) and the connection
+    is retried after retry_interval seconds.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, capacity=10000, batch_size=500,
+                 flush_interval=0.5, retry_interval=5.0, connect_timeout=1.0, fallback=None):
+        super().__init__()
+        self.address = (host, port)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.connect_timeout = connect_timeout
+        self.fallback = fallback or sys.stdout
+        self.sent = 0
+        self.dropped = 0
+        self.fallback_records = 0
+        self.batches = 0
+        self.connection_errors = 0
+        self._queue = queue.Queue(maxsize=capacity)
+        self._socket = None
+        self._retry_at = 0.0
+        self._stopping = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="logstash-shipper", daemon=True)
+        self._worker.start()
+
+    def emit(self, record):
+        # The request id lives in a context variable the worker thread cannot see
+        if not hasattr(record, "request_id"):
+            record.request_id = current_request_id()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "fallback": self.fallback_records,
+            "batches": self.batches,
+            "connection_errors": self.connection_errors,
+            "queued": self._queue.qsize(),
+            "connected": self._socket is not None
+        }
+
+    def flush(self, timeout=5.0):
+        """Waits until every queued record has been sent or written to the fallback."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def close(self):
+        if not self._stopping.is_set():
+            self._stopping.set()
+            self._worker.join(timeout=self.flush_interval + 5.0)
+            self._disconnect()
+        super().close()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._ship(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _ship(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        if self._send(payload):
+            self.sent += len(lines)
+            self.batches += 1
+            return
+        try:
+            self.fallback.write(payload.decode("utf-8"))
+            self.fallback.flush()
+            self.fallback_records += len(lines)
+        except (OSError, ValueError):
+            self.dropped += len(lines)
+
+    def _send(self, payload):
+        if self._socket is None:
+            if time.monotonic() < self._retry_at:
+                return False
+            try:
+                self._socket = socket.create_connection(self.address, timeout=self.connect_timeout)
+                self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                self._connection_failed()
+                return False
+        try:
+            self._socket.sendall(payload)
+            return True
+        except OSError:
+            # Part of the batch may have reached Logstash; it is written to the fallback anyway
+            self._connection_failed()
+            return False
+
+    def _connection_failed(self):
+        self.connection_errors += 1
+        self._retry_at = time.monotonic() + self.retry_interval
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+
+def setup_logging(name="chatbot"):
+    """
+    Set up structured logging for ELK stack integration. With LOGSTASH_HOST set,
+    records are queued and shipped in batches to the Logstash TCP input by a
+    background thread; otherwise they are written to stdout for Filebeat.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+
+    # Streamlit re-executes its script on every interaction: keep the
+    # shipping handler, and its worker thread, of the previous run
+    for handler in logger.handlers:
+        if isinstance(handler, LogstashHandler):
+            return logger
+
+    # Clear existing handlers if any
+    if logger.handlers:
+        logger.handlers = []
+
+    host = os.environ.get("LOGSTASH_HOST")
+    if host:
+        handler = LogstashHandler(
+            host,
+            int(os.environ.get("LOGSTASH_PORT", str(DEFAULT_PORT))),
+            capacity=int(os.environ.get("LOG_QUEUE_SIZE", "10000")),
+            batch_size=int(os.environ.get("LOG_BATCH_SIZE", "500")),
+            flush_interval=float(os.environ.get("LOG_FLUSH_INTERVAL", "0.5"))
+        )
+        atexit.register(handler.close)
+    else:
+        # Console handler
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+
+    return logger
+
+
+def shipping_stats(logger):
+    """Counters of the logger's Logstash handler, or None when it logs to stdout."""
+    for handler in logger.handlers:
+        if isinstance(handler, LogstashHandler):
+            return handler.stats()
+    return None
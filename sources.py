@@ -0,0 +1,296 @@
+"""
+Registry of the incident datasets indexed by build_index.py, and the
+streaming reader that turns them into Documents.
+
+Every source is one `<name>_cleaned.csv` file in DATA_PATH, described by:
+
+    text      columns holding the passage, joined by a blank line
+    id        column with a stable row id, or None to use the row number
+    metadata  year, attack_class and industry columns kept for filtered search
+    keywords  columns with exact identifiers (malware, threat actors, ...)
+              joined into the "keywords" field searched by BM25
+    dtypes    pandas dtypes of the columns above; low-cardinality strings are
+              read as categories
+
+Only these columns and the region flags are read. Files are parsed in
+chunks of INGEST_CHUNK_SIZE rows, so a source never has to fit in memory as
+a DataFrame, and INGEST_WORKERS sources are parsed in parallel.
+
+    python sources.py               # read every source and print the ingestion report
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from attribute_index import REGIONS
+from context_packer import count_tokens
+
+SOURCES = {
+    'HACKMAGEDDON': {
+        'text': ['Description'],
+        'id': None,
+        'metadata': {'year': 'Year', 'attack_class': 'Attack Class'},
+        'keywords': ['Author', 'Attack'],
+        'dtypes': {'Attack Class': 'category'}
+    },
+    'ICSSTRIVE': {
+        'text': ['description'],
+        'id': None,
+        'metadata': {'year': 'year', 'industry': 'industries_grouped'},
+        'keywords': ['malware_title', 'threat_source_title', 'victims_title'],
+        'dtypes': {'industries_grouped': 'category'}
+    },
+    'KONBRIEFING': {
+        'text': ['description'],
+        'id': None,
+        'metadata': {'year': 'year'},
+        'keywords': ['title', 'attack_type'],
+        'dtypes': {'attack_type': 'category'}
+    },
+    'TISAFE': {
+        'text': ['attack_details'],
+        'id': 'id',
+        'metadata': {'year': 'year', 'industry': 'industry_type_group'},
+        'keywords': [],
+        'dtypes': {'id': 'int64', 'industry_type_group': 'category'}
+    },
+    'WATERFALL': {
+        'text': ['incident_summary'],
+        'id': 'id',
+        'metadata': {'year': 'year', 'industry': 'industry_group'},
+        'keywords': ['victim', 'threat_actor'],
+        'dtypes': {'id': 'int64', 'industry_group': 'category'}
+    }
+}
+
+# Region flags are 0/1 columns, present in most sources
+REGION_DTYPES = {region: 'float32' for region in REGIONS}
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def source_path(data_path, name):
+    return os.path.join(data_path, f'{name}_cleaned.csv')
+
+
+def source_columns(spec):
+    """Every column the reader may use; the ones a file lacks are skipped."""
+    columns = list(spec['text'])
+    if spec['id']:
+        columns.append(spec['id'])
+    return set(columns) | set(spec['metadata'].values()) | set(spec['keywords']) | set(REGIONS)
+
+
+def _optional_int(value):
+    return int(value) if pd.notna(value) else None
+
+
+def _optional_str(value):
+    return str(value) if pd.notna(value) and str(value).strip() else None
+
+
+class _CountingFile():
+    """Binary file wrapper counting the bytes the CSV parser reads through it."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self._file:
+            self.bytes_read += len(line)
+            yield line
+
+    def close(self):
+        self._file.close()
+
+
+def documents_from_frame(name, spec, df):
+    """
+    Builds one Document per row of a chunk, from whole columns rather than
+    row by row. The docstore id of every document is its row key, so the same
+    row maps to the same entry across builds.
+    """
+    texts = df[spec['text'][0]].tolist() if len(spec['text']) == 1 else [
+        "\n\n".join(str(v) for v in row if _optional_str(v))
+        for row in df[spec['text']].itertuples(index=False, name=None)
+    ]
+    ids = df[spec['id']].tolist() if spec['id'] else df.index.tolist()
+    n = len(df)
+    # Metadata columns are optional, a missing one leaves the attribute empty
+    fields = {field: column for field, column in spec['metadata'].items() if column in df.columns}
+    years = [_optional_int(v) for v in pd.to_numeric(df[fields['year']], errors='coerce')] if 'year' in fields else [None] * n
+    attack_classes = [_optional_str(v) for v in df[fields['attack_class']]] if 'attack_class' in fields else [None] * n
+    industries = [_optional_str(v) for v in df[fields['industry']]] if 'industry' in fields else [None] * n
+    region_columns = [region for region in REGIONS if region in df.columns]
+    flags = df[region_columns].fillna(0).to_numpy(dtype=bool) if region_columns else np.zeros((n, 0), dtype=bool)
+    regions = [[region_columns[j] for j in np.flatnonzero(row)] for row in flags]
+    keyword_columns = [column for column in spec['keywords'] if column in df.columns]
+    keywords = [
+        " ".join(str(v) for v in row if _optional_str(v)) or None
+        for row in df[keyword_columns].itertuples(index=False, name=None)
+    ] if keyword_columns else [None] * n
+    return [
+        Document(
+            page_content=text,
+            metadata={
+                "source": name,
+                "id": row_id,
+                "year": year,
+                "regions": row_regions,
+                "attack_class": attack_class,
+                "industry": industry,
+                "keywords": row_keywords,
+                # Precomputed so the context packer never counts tokens per request
+                "tokens": count_tokens(str(text))
+            }
+        )
+        for text, row_id, year, row_regions, attack_class, industry, row_keywords
+        in zip(texts, ids, years, regions, attack_classes, industries, keywords)
+    ]
+
+
+def read_source(data_path, name, spec, chunk_size=DEFAULT_CHUNK_SIZE, report=None):
+    """
+    Yields the Documents of one source a chunk at a time. report, if given,
+    receives its row count, bytes read, seconds and status. A missing file or
+    text column is reported and skips the source.
+    """
+    file_path = source_path(data_path, name)
+    report = report if report is not None else {}
+    report.update({"rows": 0, "bytes": 0, "seconds": 0.0, "status": "ok"})
+    wanted = source_columns(spec)
+    try:
+        source = _CountingFile(file_path)
+    except FileNotFoundError:
+        print(f"ERROR: File not found {file_path}. Skipping.")
+        report["status"] = "missing"
+        return
+    # Time spent parsing and building documents, not waiting for the consumer
+    busy, started = 0.0, time.perf_counter()
+    try:
+        chunks = pd.read_csv(
+            source,
+            usecols=lambda column: column in wanted,
+            dtype={**REGION_DTYPES, **spec['dtypes']},
+            chunksize=chunk_size
+        )
+        for df in chunks:
+            missing = [column for column in spec['text'] + [spec['id']] if column and column not in df.columns]
+            if missing:
+                print(f"ERROR: Column {', '.join(missing)} not found in {file_path}. Skipping.")
+                report["status"] = "invalid"
+                return
+            documents = documents_from_frame(name, spec, df)
+            busy += time.perf_counter() - started
+            report["rows"] += len(documents)
+            report["bytes"] = source.bytes_read
+            report["seconds"] = round(busy, 3)
+            yield documents
+            started = time.perf_counter()
+    finally:
+        source.close()
+        report["bytes"] = source.bytes_read
+    print(f"Loaded {report['rows']} documents from {file_path}")
+
+
+def iter_documents(data_path, sources=None, chunk_size=None, workers=None, report=None):
+    """
+    Yields lists of Documents from every registered source. With workers > 1
+    the sources are parsed on that many threads, which hand their chunks over
+    through a small bounded queue, so at most a few chunks wait in memory.
+    Sources come out interleaved; each source's own rows stay in order.
+    """
+    sources = SOURCES if sources is None else sources
+    chunk_size = chunk_size or int(os.environ.get("INGEST_CHUNK_SIZE", str(DEFAULT_CHUNK_SIZE)))
+    workers = workers or int(os.environ.get("INGEST_WORKERS", "1"))
+    report = report if report is not None else {}
+    for name in sources:
+        report[name] = {}
+    print(f"Loading documents from: {data_path}")
+    if workers <= 1 or len(sources) <= 1:
+        for name, spec in sources.items():
+            yield from read_source(data_path, name, spec, chunk_size, report[name])
+        return
+
+    chunks = queue.Queue(maxsize=2 * workers)
+    pending = queue.Queue()
+    for name in sources:
+        pending.put(name)
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                name = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                for documents in read_source(data_path, name, sources[name], chunk_size, report[name]):
+                    while not stop.is_set():
+                        try:
+                            chunks.put(documents, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+            except Exception as e:
+                report[name]["status"] = "error"
+                chunks.put(e)
+        chunks.put(None)
+
+    threads = [threading.Thread(target=reader, name=f"ingest-{i}", daemon=True) for i in range(min(workers, len(sources)))]
+    for thread in threads:
+        thread.start()
+    try:
+        finished = 0
+        while finished < len(threads):
+            item = chunks.get()
+            if item is None:
+                finished += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # Lets the readers exit when the consumer stops early
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=1.0)
+
+
+def load_documents(data_path, sources=None, chunk_size=None, workers=None):
+    """All Documents of the registered sources, with the ingestion report."""
+    report = {}
+    documents = [document for chunk in iter_documents(data_path, sources, chunk_size, workers, report) for document in chunk]
+    return documents, report
+
+
+def print_report(report):
+    print(f"{'source':<14} {'status':<8} {'rows':>8} {'MB read':>8} {'seconds':>8} {'rows/s':>9}")
+    for name, stats in report.items():
+        rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"{name:<14} {stats['status']:<8} {stats['rows']:>8} {stats['bytes'] / 2**20:>8.2f} "
+              f"{stats['seconds']:>8.3f} {rate:>9.0f}")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Read every registered source and print the ingestion report.")
+    parser.add_argument("--data-path", default=os.environ.get("DATA_PATH", "data"))
+    parser.add_argument("--chunk-size", type=int, help=f"rows parsed at a time (INGEST_CHUNK_SIZE, default {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--workers", type=int, help="sources parsed in parallel (INGEST_WORKERS, default 1)")
+    args = parser.parse_args()
+    ingestion = {}
+    for _ in iter_documents(args.data_path, chunk_size=args.chunk_size, workers=args.workers, report=ingestion):
+        pass
+    print_report(ingestion)
@@ -0,0 +1,123 @@
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+# Stages timed inside ChatBot. Each one is logged as a numeric <stage>_ms field.
+# prompt_build covers the whole prompt assembly, retrieval (embed, search) included.
+# llm_queue is the wait for the LLM scheduler, inside llm_total.
+STAGES = ("embed", "search", "prompt_build", "llm_queue", "llm_first_token", "llm_total")
+
+# Upper bounds of the histogram buckets shown in the health check, in milliseconds
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Request being served by the current thread or task, see LatencyRecorder.request
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id():
+    """Id of the request being served, or None outside of one."""
+    request = _current_request.get()
+    return request["request_id"] if request else None
+
+
+class LatencyHistogram():
+    """Rolling window of the last `window` latencies of one stage."""
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self._samples = deque(maxlen=window)
+
+    def add(self, ms):
+        self.count += 1
+        self._samples.append(ms)
+
+    def snapshot(self):
+        samples = np.fromiter(self._samples, dtype=np.float64)
+        if not len(samples):
+            return {"count": self.count, "window": 0}
+        counts = np.histogram(samples, bins=(0,) + HISTOGRAM_BUCKETS_MS + (np.inf,))[0]
+        labels = [f"<={bound}" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "window": len(samples),
+            "mean_ms": round(float(samples.mean()), 3),
+            "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3),
+            "p99_ms": round(float(np.percentile(samples, 99)), 3),
+            "buckets_ms": {label: int(n) for label, n in zip(labels, counts) if n}
+        }
+
+
+class LatencyRecorder():
+    """
+    Per-stage latency histograms of one process, plus the timings of the
+    request in progress. Spans add to both: the histograms feed the health
+    check and the request timings are logged as one structured line per
+    request, under a shared request id.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, ms, request=None):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram(self.window)
+            histogram.add(ms)
+        request = request or _current_request.get()
+        if request is not None:
+            field = f"{stage}_ms"
+            request["timings"][field] = round(request["timings"].get(field, 0.0) + ms, 3)
+
+    def attribute(self, timings):
+        """
+        Adds timings measured on behalf of the current request elsewhere, e.g.
+        by a micro-batch it was part of, without counting them twice in the
+        histograms.
+        """
+        request = _current_request.get()
+        if request is None:
+            return
+        for field, ms in timings.items():
+            request["timings"][field] = round(request["timings"].get(field, 0.0) + ms, 3)
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - started) * 1000)
+
+    @contextmanager
+    def request(self, request_id=None):
+        """
+        Scope of one request. Yields {"request_id", "timings"}; spans opened
+        in this thread or task, or in threads started with its context, add
+        their timings to it.
+        """
+        request = {"request_id": request_id or new_request_id(), "timings": {}}
+        token = _current_request.set(request)
+        try:
+            yield request
+        finally:
+            _current_request.reset(token)
+
+    def clear(self):
+        with self._lock:
+            self._histograms = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: histogram.snapshot() for stage, histogram in self._histograms.items()}
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from answer_cache import AnswerCache, SingleFlight, answer_key
+
+
+class TestAnswerCache(unittest.TestCase):
+    """Test suite for the SQLite answer cache"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'answers.sqlite3')
+
+    def cache(self, **kwargs):
+        cache = AnswerCache(self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_persists_across_processes(self):
+        """Test that an answer written by one cache is found by another on the same file"""
+        key = answer_key('ransomware on water utilities', 'context', 'llama', 'v1')
+        self.cache().put(key, 'An answer', 'llama', 'v1')
+
+        cache = self.cache()
+        self.assertEqual(cache.get(key), 'An answer')
+        self.assertIsNone(cache.get(answer_key('ransomware on water utilities', 'context', 'llama', 'v2')))
+        self.assertIsNone(cache.get(answer_key('ransomware on water utilities', 'other context', 'llama', 'v1')))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 2, 1))
+        self.assertEqual(stats['hit_rate'], 0.3333)
+
+    def test_ttl_and_size_eviction(self):
+        """Test that expired entries are dropped and the least recently used go beyond max_entries"""
+        cache = self.cache(ttl=60, max_entries=2)
+        now = time.time()
+        with patch('answer_cache.time.time', return_value=now):
+            cache.put('a', 'A')
+            cache.put('b', 'B')
+        with patch('answer_cache.time.time', return_value=now + 1):
+            self.assertEqual(cache.get('a'), 'A')
+            cache.put('c', 'C')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        with patch('answer_cache.time.time', return_value=now + 120):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expired'], 1)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test suite for coalescing identical in-flight calls"""
+
+    def test_followers_share_the_leader_result(self):
+        """Test that callers joining a flight get the leader's answer and its stream"""
+        flights = SingleFlight()
+        flight, leader = flights.join('key')
+        follower, following = flights.join('key')
+        self.assertTrue(leader)
+        self.assertFalse(following)
+        self.assertIs(follower, flight)
+
+        streamed = []
+        reader = threading.Thread(target=lambda: streamed.extend(follower))
+        reader.start()
+        flight.add('Hello')
+        flight.add(' world')
+        flights.finish('key', flight)
+        reader.join(timeout=5)
+
+        self.assertEqual(streamed, ['Hello', ' world'])
+        self.assertEqual(follower.result(timeout=1), 'Hello world')
+        self.assertEqual(flights.stats(), {'enabled': True, 'leaders': 1, 'coalesced': 1, 'in_flight': 0})
+        # A finished flight is not joined again
+        self.assertTrue(flights.join('key')[1])
+
+    def test_errors_reach_followers(self):
+        """Test that a failed call raises in every caller of the flight"""
+        flights = SingleFlight()
+        flight, _ = flights.join('key')
+        follower, _ = flights.join('key')
+        flights.finish('key', flight, ValueError('rate limited'))
+        with self.assertRaises(ValueError):
+            follower.result(timeout=1)
+        with self.assertRaises(ValueError):
+            list(follower)
+
+    def test_disabled(self):
+        """Test that a disabled registry gives every caller its own flight"""
+        flights = SingleFlight(enabled=False)
+        self.assertTrue(flights.join('key')[1])
+        self.assertTrue(flights.join('key')[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import signal
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+# Add parent directory to path so we can import api
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import benchmark
+from api import ApiServer, serve
+from RAG import ChatBot
+from groq_stub import GroqStubServer
+
+TEXTS = ['Ransomware on a water utility', 'Wiper on a grid operator', 'Phishing campaign against a bank']
+
+class TestApi(unittest.TestCase):
+    """Test suite for the HTTP API in api.py"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        embeddings = DeterministicFakeEmbedding(size=8)
+        FAISS.from_texts(TEXTS, embeddings, metadatas=[{'source': 'TEST', 'id': i} for i in range(3)],
+                         ids=[f'TEST:{i}' for i in range(3)]).save_local(tmp.name)
+        self.stub = GroqStubServer(reply="Water utilities were hit").start()
+        self.addCleanup(self.stub.stop)
+        env = {'FAISS_INDEX_PATH': tmp.name, 'FAISS_MMAP': '1', 'GROQ_API_KEY': 'stub',
+               'GROQ_BASE_URL': self.stub.base_url}
+        environ = patch.dict(os.environ, env)
+        environ.start()
+        self.addCleanup(environ.stop)
+        with patch('RAG.HuggingFaceEmbeddings', return_value=embeddings), patch('builtins.print'):
+            self.chatbot = ChatBot()
+        self.addCleanup(self.chatbot.close)
+        self.embeddings = embeddings
+
+    def serve(self, **kwargs):
+        api = ApiServer(self.chatbot, **kwargs).start()
+        self.addCleanup(api.stop)
+        return api
+
+    def test_health_and_retrieve(self):
+        """Test that /retrieve searches the memory-mapped index and /health reports it"""
+        api = self.serve()
+
+        response = httpx.post(api.base_url + '/retrieve', json={'query': 'Wiper on a grid operator', 'k': 2})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['docstore_id'], 'TEST:1')
+        self.assertEqual(results[0]['content'], 'Wiper on a grid operator')
+
+        response = httpx.post(api.base_url + '/retrieve', json={'queries': TEXTS, 'k': 1})
+        self.assertEqual([hits[0]['docstore_id'] for hits in response.json()['results']], ['TEST:0', 'TEST:1', 'TEST:2'])
+
+        health = httpx.get(api.base_url + '/health').json()
+        self.assertEqual(health['status'], 'healthy')
+        self.assertEqual(health['index'], {
+            'loaded': True, 'type': 'flat', 'documents': 3, 'format': 'pickle', 'memory_mapped': True,
+            'version': None, 'reloads': 0, 'reload_failures': 0, 'shards': None
+        })
+        self.assertEqual(health['requests']['served'], 2)
+        self.assertIn('search', health['latency'])
+
+    def test_health_answered_while_loading(self):
+        """Test that a worker answers /health before its index is loaded and /ready once it is"""
+        with patch('builtins.print'):
+            chatbot = ChatBot(load=False)
+        self.addCleanup(chatbot.close)
+        api = ApiServer(chatbot).start()
+        self.addCleanup(api.stop)
+
+        health = httpx.get(api.base_url + '/health').json()
+        self.assertEqual(health['status'], 'starting')
+        self.assertFalse(health['startup']['ready'])
+        self.assertEqual(httpx.get(api.base_url + '/ready').status_code, 503)
+        response = httpx.post(api.base_url + '/query', json={'query': 'water utility'})
+        self.assertEqual((response.status_code, response.headers['retry-after']), (503, '1'))
+
+        with patch('RAG.HuggingFaceEmbeddings', return_value=self.embeddings), patch('builtins.print'):
+            chatbot.load_in_background().join(timeout=30)
+        response = httpx.get(api.base_url + '/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()['warmup_seconds'])
+        self.assertEqual(httpx.get(api.base_url + '/health').json()['status'], 'healthy')
+
+    def test_reload(self):
+        """Test that /reload swaps in the index FAISS_INDEX_PATH points to now"""
+        api = self.serve()
+        FAISS.from_texts(TEXTS + ['Spyware on a port authority'], self.embeddings,
+                         metadatas=[{'source': 'TEST', 'id': i} for i in range(4)],
+                         ids=[f'TEST:{i}' for i in range(4)]).save_local(os.environ['FAISS_INDEX_PATH'])
+
+        with patch('builtins.print'):
+            response = httpx.post(api.base_url + '/reload')
+        self.assertEqual(response.status_code, 200)
+        health = httpx.get(api.base_url + '/health').json()
+        self.assertEqual((health['index']['documents'], health['index']['reloads']), (4, 1))
+        response = httpx.post(api.base_url + '/retrieve', json={'query': 'Spyware on a port authority', 'k': 1})
+        self.assertEqual(response.json()['results'][0]['docstore_id'], 'TEST:3')
+
+        os.remove(os.path.join(os.environ['FAISS_INDEX_PATH'], 'index.faiss'))
+        with patch('builtins.print'), patch('RAG.logger'):
+            response = httpx.post(api.base_url + '/reload')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(httpx.get(api.base_url + '/health').json()['index']['documents'], 4)
+
+    def test_query_plain_and_streamed(self):
+        """Test that /query answers as JSON, or as server-sent events when asked to stream"""
+        api = self.serve()
+
+        response = httpx.post(api.base_url + '/query', json={'query': 'water utility'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['answer'], 'Water utilities were hit')
+        self.assertEqual(len(response.json()['request_id']), 16)
+
+        with httpx.stream('POST', api.base_url + '/query', json={'query': 'water utility', 'stream': True}) as response:
+            self.assertEqual(response.headers['content-type'], 'text/event-stream')
+            events = [json.loads(line[len('data: '):]) for line in response.iter_lines() if line.startswith('data: ')]
+        self.assertEqual(''.join(event.get('token', '') for event in events), 'Water utilities were hit')
+        self.assertTrue(events[-1]['done'])
+
+    def test_rejects_bad_requests(self):
+        """Test that invalid bodies and parameters are answered 400, unknown paths 404"""
+        api = self.serve()
+
+        self.assertEqual(httpx.post(api.base_url + '/query', content=b'not json').status_code, 400)
+        self.assertEqual(httpx.post(api.base_url + '/query', json={'query': ''}).status_code, 400)
+        self.assertEqual(httpx.post(api.base_url + '/retrieve', json={'query': 'x', 'k': 0}).status_code, 400)
+        self.assertEqual(httpx.post(api.base_url + '/retrieve', json={'query': 'x', 'mode': 'fuzzy'}).status_code, 400)
+        response = httpx.post(api.base_url + '/retrieve', json={'query': 'x', 'filters': {'regions': ['Europe']}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('attribute index', response.json()['error'])
+        self.assertEqual(httpx.get(api.base_url + '/nowhere').status_code, 404)
+
+    def test_concurrency_limit(self):
+        """Test that requests beyond max_concurrent wait for a slot, then get 503"""
+        self.stub.latency = 0.5
+        api = self.serve(max_concurrent=1, queue_timeout=0.05)
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            statuses = sorted(pool.map(
+                lambda _: httpx.post(api.base_url + '/query', json={'query': 'water'}, timeout=10).status_code, range(3)
+            ))
+
+        self.assertEqual(statuses, [200, 503, 503])
+        self.assertEqual(api.rejected, 2)
+
+    def test_load_test_against_stub(self):
+        """Test the api load test of benchmark.py against a running server"""
+        api = self.serve(max_concurrent=2)
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.writelines(json.dumps({'query': text}) + '\n' for text in TEXTS)
+        self.addCleanup(os.remove, f.name)
+
+        with patch('builtins.print'):
+            report = benchmark.main(['api', '--url', api.base_url, '--query-file', f.name, '--endpoint', 'stream',
+                                     '--requests', '12', '--concurrency', '2'])
+
+        self.assertEqual(report['status_codes'], {'200': 12})
+        self.assertGreater(report['throughput_rps'], 0)
+        self.assertLessEqual(report['first_byte']['p50_ms'], report['latency']['p50_ms'])
+
+    def test_workers_share_the_listening_socket(self):
+        """Test that serve() forks workers that all answer on one port with the index mapped"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        with patch('RAG.HuggingFaceEmbeddings', return_value=self.embeddings):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    with open(os.devnull, 'w') as devnull:
+                        sys.stdout = devnull
+                        serve('127.0.0.1', port, 2, 4, 1.0)
+                finally:
+                    os._exit(0)
+        try:
+            url = f'http://127.0.0.1:{port}'
+            benchmark.wait_until_ready(url, 2, timeout=60)
+            pids, mapped = set(), set()
+            for _ in range(20):
+                health = httpx.get(url + '/health', headers={'Connection': 'close'}).json()
+                pids.add(health['pid'])
+                mapped.add(health['index']['memory_mapped'])
+            self.assertEqual(len(pids), 2)
+            self.assertEqual(mapped, {True})
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+if __name__ == '__main__':
+    unittest.main()
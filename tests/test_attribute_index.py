@@ -0,0 +1,110 @@
+import os
+import sys
+import unittest
+import tempfile
+import numpy as np
+from langchain_core.documents import Document
+
+# Add parent directory to path so we can import attribute_index
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import faiss_utils
+from attribute_index import AttributeIndex
+
+def make_documents(count):
+    """Documents cycling through sources, years and regions"""
+    sources = ['HACKMAGEDDON', 'TISAFE']
+    regions = [['Europe'], ['Asia', 'Africa'], []]
+    return [
+        Document(page_content=f'incident {i}', metadata={
+            'source': sources[i % 2],
+            'id': i,
+            'year': 2018 + i % 6,
+            'regions': regions[i % 3],
+            'attack_class': 'Ransomware' if i % 4 == 0 else None,
+            'industry': 'Water' if i % 5 == 0 else 'Energy'
+        })
+        for i in range(count)
+    ]
+
+class TestAttributeIndex(unittest.TestCase):
+    """Test suite for the filter columns in attribute_index.py"""
+
+    def setUp(self):
+        self.documents = make_documents(600)
+        self.faiss_ids = np.arange(600, dtype=np.int64) * 3
+        self.attributes = AttributeIndex.from_documents(self.faiss_ids, self.documents)
+
+    def _expected(self, predicate):
+        return [int(self.faiss_ids[i]) for i, d in enumerate(self.documents) if predicate(d.metadata)]
+
+    def test_mask_combines_filters(self):
+        """Test that every filter must match and list values match any of their entries"""
+        found = self.attributes.matching_ids({'regions': ['europe'], 'year_from': 2021, 'sources': ['TISAFE']})
+        expected = self._expected(lambda m: 'Europe' in m['regions'] and m['year'] >= 2021 and m['source'] == 'TISAFE')
+        self.assertEqual(found.tolist(), expected)
+
+        found = self.attributes.matching_ids({'attack_classes': ['Ransomware'], 'industries': ['Water', 'Unknown']})
+        self.assertEqual(found.tolist(), self._expected(lambda m: m['attack_class'] == 'Ransomware' and m['industry'] == 'Water'))
+
+    def test_sources_filter_matches_merged_reports(self):
+        """Test that an incident merged from several sources is found by a filter on a secondary source"""
+        documents = self.documents[:3] + [Document(page_content='merged', metadata={
+            'source': 'ICSSTRIVE', 'id': 9, 'sources': ['HACKMAGEDDON', 'ICSSTRIVE', 'KONBRIEFING']
+        })]
+        attributes = AttributeIndex.from_documents([0, 1, 2, 3], documents)
+        self.assertEqual(attributes.matching_ids({'sources': ['KONBRIEFING']}).tolist(), [3])
+        self.assertEqual(attributes.matching_ids({'sources': ['hackmageddon']}).tolist(), [0, 2, 3])
+        self.assertEqual(attributes.matching_ids({'sources': ['TISAFE']}).tolist(), [1])
+
+        with tempfile.TemporaryDirectory() as index_path:
+            attributes.save(index_path)
+            loaded = AttributeIndex.load(index_path)
+        self.assertEqual(loaded.matching_ids({'sources': ['KONBRIEFING']}).tolist(), [3])
+
+        # Columns saved before the bitmask still filter on each row's own source
+        legacy = AttributeIndex(attributes.faiss_ids, attributes.year, attributes.regions, attributes.codes, attributes.vocabularies)
+        self.assertEqual(legacy.matching_ids({'sources': ['ICSSTRIVE']}).tolist(), [3])
+        self.assertEqual(legacy.matching_ids({'sources': ['KONBRIEFING']}).tolist(), [])
+
+    def test_unknown_filters_rejected(self):
+        """Test that misspelt filter keys and regions raise instead of matching nothing"""
+        with self.assertRaises(ValueError):
+            self.attributes.mask({'region': ['Europe']})
+        with self.assertRaises(ValueError):
+            self.attributes.mask({'regions': ['Atlantis']})
+
+    def test_save_and_load(self):
+        """Test that the columns survive a round trip through attributes.npz"""
+        with tempfile.TemporaryDirectory() as index_path:
+            self.assertIsNone(AttributeIndex.load(index_path))
+            self.attributes.save(index_path)
+            loaded = AttributeIndex.load(index_path)
+        filters = {'year_to': 2019, 'regions': ['Asia']}
+        self.assertEqual(loaded.matching_ids(filters).tolist(), self.attributes.matching_ids(filters).tolist())
+        self.assertEqual(loaded.vocabularies['source'], ['HACKMAGEDDON', 'TISAFE'])
+
+    def test_filtered_search_per_index_type(self):
+        """Test that selector and exact subset searches only return matching ids on every index type"""
+        rng = np.random.default_rng(0)
+        vectors = rng.random((600, 16), dtype=np.float32)
+        allowed = set(self.attributes.matching_ids({'regions': ['Europe']}).tolist())
+        for index_type, params in [('flat', {}), ('hnsw', {'M': 8}), ('ivf_flat', {'nlist': 4}), ('ivf_pq', {'nlist': 4, 'pq_m': 4})]:
+            config = faiss_utils.index_config(index_type, **params)
+            index = faiss_utils.make_index(config, 16)
+            if faiss_utils.training_size(config):
+                index.train(vectors)
+            index.add_with_ids(vectors, self.faiss_ids)
+            faiss_utils.enable_reconstruct(index, config)
+
+            matching = self.attributes.matching_ids({'regions': ['Europe']})
+            selector = AttributeIndex.selector(matching)
+            _, labels = index.search(vectors[:3], 5, params=faiss_utils.search_parameters(config, selector))
+            self.assertTrue(set(labels.ravel().tolist()) <= allowed, index_type)
+
+            _, labels = faiss_utils.search_subset(index, vectors[:3], matching, 5)
+            self.assertTrue(set(labels.ravel().tolist()) <= allowed, index_type)
+            self.assertEqual(labels.shape, (3, 5))
+
+if __name__ == '__main__':
+    unittest.main()
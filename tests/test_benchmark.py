@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import unittest
+import tempfile
+import multiprocessing.dummy
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from unittest.mock import patch
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+# Add parent directory to path so we can import benchmark
+import build_index
+from RAG import ChatBot
+from api import ApiServer
+from groq_stub import GroqStubServer
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import benchmark
+
+class TestBenchmark(unittest.TestCase):
+    """Test suite for the rag benchmark in benchmark.py"""
+
+    def test_find_regressions(self):
+        """Test that slower stages and lower recall are reported, noise is not"""
+        baseline = {'cold_start_s': 2.0, 'search': {'p95_ms': 0.3}, 'end_to_end': {'p95_ms': 100.0, 'p99_ms': 120.0}, 'recall': 0.8}
+        report = {'cold_start_s': 2.1, 'search': {'p95_ms': 0.9}, 'end_to_end': {'p95_ms': 150.0, 'p99_ms': 125.0}, 'recall': 0.7}
+
+        regressions = benchmark.find_regressions(report, baseline, tolerance=0.2, recall_tolerance=0.02)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('end_to_end.p95_ms grew from 100.0 to 150.0'))
+        self.assertTrue(regressions[1].startswith('recall dropped from 0.8 to 0.7'))
+
+    def test_parse_importtime(self):
+        """Test that the import log is split at the probe marker and summed per package"""
+        stderr = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:      2000 |       2000 |     numpy.core',
+            'import time:      1000 |       3000 |   numpy',
+            'startup-probe: imported',
+            'import time:    500000 |     500000 |   torch',
+            'Loading FAISS index from: faiss_index',
+        ])
+        eager, deferred = benchmark.parse_importtime(stderr)
+        self.assertEqual(eager, {'numpy.core': (2.0, 2.0), 'numpy': (1.0, 3.0)})
+        self.assertEqual(benchmark.by_package(eager), {'numpy': 3.0})
+        self.assertEqual(benchmark.by_package(deferred), {'torch': 500.0})
+
+    def test_startup_profile_import_only(self):
+        """Test the startup profile of `import RAG` in a fresh interpreter and its regression check"""
+        with tempfile.TemporaryDirectory() as tmp, patch('builtins.print'):
+            out = os.path.join(tmp, 'startup.json')
+            report = benchmark.main(['--out', out, 'startup', '--import-only', '--runs', '1'])
+            self.assertGreater(report['import_s'], 0)
+            self.assertIn('numpy', report['import_packages'])
+            # The heavy dependencies are imported on first use, not by `import RAG`
+            self.assertFalse({'torch', 'transformers', 'groq', 'pandas'} & set(report['import_packages']))
+
+            with open(out, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            baseline.update(import_s=report['import_s'] / 100)
+            with open(out, 'w', encoding='utf-8') as f:
+                json.dump(baseline, f)
+            with self.assertRaises(SystemExit):
+                benchmark.main(['startup', '--import-only', '--runs', '1', '--baseline', out])
+
+    def test_find_saturation(self):
+        """Test that the saturation point is the last level that still paid off"""
+        levels = [{'concurrency': 10, 'throughput_rps': 20.0}, {'concurrency': 50, 'throughput_rps': 60.0},
+                  {'concurrency': 200, 'throughput_rps': 62.0}]
+        self.assertEqual(benchmark.find_saturation(levels, 'concurrency'), 1)
+        self.assertIsNone(benchmark.find_saturation(levels[:2], 'concurrency'))
+
+        rates = [{'rate_rps': 5, 'throughput_rps': 5.1}, {'rate_rps': 10, 'throughput_rps': 9.8},
+                 {'rate_rps': 20, 'throughput_rps': 12.0}]
+        self.assertEqual(benchmark.find_saturation(rates, 'rate_rps'), 1)
+        self.assertEqual(benchmark.find_saturation(rates[2:], 'rate_rps'), 0)
+
+    def test_load_generator_against_stub(self):
+        """Test the load generator end to end at two concurrency levels and one arrival rate"""
+        texts = ['Ransomware on a water utility', 'Wiper on a grid operator', 'Phishing campaign against a bank']
+        embeddings = DeterministicFakeEmbedding(size=8)
+        with tempfile.TemporaryDirectory() as tmp, patch.dict(os.environ, {}), \
+             patch('RAG.HuggingFaceEmbeddings', return_value=embeddings), patch('builtins.print'):
+            FAISS.from_texts(texts, embeddings, metadatas=[{'source': 'TEST', 'id': i} for i in range(3)],
+                             ids=[f'TEST:{i}' for i in range(3)]).save_local(tmp)
+            query_file = os.path.join(tmp, 'queries.jsonl')
+            with open(query_file, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps({'query': text}) + '\n' for text in texts)
+
+            report = benchmark.main(['load', '--index-path', tmp, '--query-file', query_file, '--concurrency', '1', '2',
+                                     '--duration', '0.5', '--llm-latency', '0.01', '--tokens-per-second', '1000',
+                                     '--sample-interval', '0.1'])
+            self.assertEqual([level['concurrency'] for level in report['levels']], [1, 2])
+            for level in report['levels']:
+                self.assertGreater(level['requests'], 0)
+                self.assertEqual(level['errors'], 0)
+                self.assertGreater(level['throughput_rps'], 0)
+                self.assertTrue({'embed', 'search', 'llm_queue', 'llm_first_token', 'llm_total'} <= set(level['stages']))
+                self.assertEqual(level['stages']['llm_total']['count'], level['requests'])
+                self.assertIsNotNone(level['first_token'])
+                self.assertGreater(level['rss_mb_max'], 0)
+            self.assertTrue(report['resources'])
+            self.assertIn('saturation', report)
+
+            report = benchmark.main(['load', '--index-path', tmp, '--query-file', query_file, '--rate', '20',
+                                     '--duration', '0.5', '--llm-latency', '0.01', '--plain'])
+            self.assertEqual(report['levels'][0]['rate_rps'], 20.0)
+            self.assertEqual(report['levels'][0]['errors'], 0)
+
+    def test_retrieval_agreement(self):
+        """Test that a backend is compared with the reference on top-k overlap and cosine similarity"""
+        rng = np.random.default_rng(0)
+        corpus = rng.normal(size=(50, 8)).astype(np.float32)
+        queries = rng.normal(size=(5, 8)).astype(np.float32)
+
+        same = benchmark.retrieval_agreement(corpus, queries, corpus * 2, queries * 2, 3)
+        self.assertEqual(same, {'top3_overlap': 1.0, 'mean_cosine': 1.0})
+
+        noisy = benchmark.retrieval_agreement(corpus, queries, corpus + rng.normal(size=corpus.shape).astype(np.float32), queries, 3)
+        self.assertLess(noisy['mean_cosine'], 0.9)
+        self.assertLess(noisy['top3_overlap'], 1.0)
+
+    def test_rag_benchmark_against_stub(self):
+        """Test the rag benchmark end to end on a small real index with the Groq stub"""
+        texts = ['Ransomware on a water utility', 'Wiper on a grid operator', 'Phishing campaign against a bank']
+        embeddings = DeterministicFakeEmbedding(size=8)
+        with tempfile.TemporaryDirectory() as tmp, patch.dict(os.environ, {}), \
+             patch('RAG.HuggingFaceEmbeddings', return_value=embeddings), patch('builtins.print'):
+            store = FAISS.from_texts(texts, embeddings, metadatas=[{'source': 'TEST', 'id': i} for i in range(3)],
+                                     ids=[f'TEST:{i}' for i in range(3)])
+            store.save_local(tmp)
+            query_file = os.path.join(tmp, 'queries.jsonl')
+            with open(query_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'query': 'Wiper on a grid operator', 'expected': ['TEST:1']}) + '\n')
+                f.write(json.dumps({'query': 'water utility'}) + '\n')
+            out = os.path.join(tmp, 'rag.json')
+
+            report = benchmark.main(['--out', out, 'rag', '--index-path', tmp, '--query-file', query_file, '--k', '1'])
+            self.assertEqual(report['queries'], 2)
+            self.assertEqual(report['recall'], 1.0)
+            self.assertEqual(report['labelled_queries'], 1)
+            self.assertLessEqual(report['model_load_s'] + report['index_load_s'], report['cold_start_s'])
+            self.assertGreater(report['prompt_tokens']['mean'], 0)
+            self.assertEqual(set(report['end_to_end']), {'p50_ms', 'p95_ms', 'p99_ms'})
+
+            # A baseline with impossible numbers makes the run fail
+            with open(out, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            baseline.update(recall=1.5)
+            with open(out, 'w', encoding='utf-8') as f:
+                json.dump(baseline, f)
+            with self.assertRaises(SystemExit):
+                benchmark.main(['rag', '--index-path', tmp, '--query-file', query_file, '--k', '1', '--baseline', out])
+
+    def test_every_subcommand_runs(self):
+        """Smoke test of every subcommand on a small compact index built with fake embeddings"""
+        embeddings = DeterministicFakeEmbedding(size=8)
+        descriptions = [f'Incident {i}: ransomware on a water utility in region {i % 3}' for i in range(12)]
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path, \
+             patch.dict(os.environ, {'DATA_PATH': data_path, 'FAISS_INDEX_PATH': index_path}), \
+             patch('build_index.load_dotenv'), patch('build_index.HuggingFaceEmbeddings', return_value=embeddings), \
+             patch('RAG.HuggingFaceEmbeddings', return_value=embeddings), \
+             patch('langchain_huggingface.HuggingFaceEmbeddings', side_effect=lambda **kwargs: embeddings), \
+             patch('benchmark.multiprocessing', SimpleNamespace(get_context=lambda method: multiprocessing.dummy)), \
+             patch('builtins.print'):
+            # The spawned backend and store measurements run in threads, so they see the fake model
+            pd.DataFrame({'Description': descriptions}).to_csv(os.path.join(data_path, 'HACKMAGEDDON_cleaned.csv'), index=False)
+            build_index.build_faiss_index(compact=True)
+            query_file = os.path.join(index_path, 'queries.jsonl')
+            with open(query_file, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps({'query': text, 'expected': [f'HACKMAGEDDON:{i}']}) + '\n' for i, text in enumerate(descriptions[:3]))
+            stub = GroqStubServer(reply="Stub answer").start()
+            self.addCleanup(stub.stop)
+            with patch.dict(os.environ, {'GROQ_API_KEY': 'stub', 'GROQ_BASE_URL': stub.base_url}):
+                chatbot = ChatBot()
+            self.addCleanup(chatbot.close)
+            api = ApiServer(chatbot).start()
+            self.addCleanup(api.stop)
+
+            commands = {
+                'index': ['--configs', '[{"type": "flat"}, {"type": "hnsw", "M": 8}]', '--queries', '4', '--k', '2'],
+                'retrieval': ['--queries', '4', '--k', '2'],
+                'rag': ['--query-file', query_file, '--k', '2'],
+                'api': ['--url', api.base_url, '--query-file', query_file, '--endpoint', 'retrieve', '--requests', '4', '--concurrency', '2'],
+                'embeddings': ['--backends', 'torch', '--documents', '6', '--queries', '3', '--k', '2'],
+                'store': ['--queries', '4', '--k', '2'],
+                'startup': ['--import-only', '--runs', '1'],
+                'load': ['--query-file', query_file, '--concurrency', '1', '--duration', '0.3', '--llm-latency', '0.01'],
+            }
+            subcommands = next(action for action in benchmark.build_parser()._actions if action.dest == 'command')
+            self.assertEqual(set(commands), set(subcommands.choices))
+            for command, args in commands.items():
+                with self.subTest(command=command):
+                    report = benchmark.main([command] + args)
+                    self.assertEqual(report['benchmark'], command)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Add parent directory to path so we can run botInterface
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from telemetry import LatencyRecorder
+
+APP_PATH = os.path.join(os.path.dirname(__file__), '..', 'botInterface.py')
+
+def startup_stats(ready=True, index_loaded=True):
+    return {'ready': ready, 'index_loaded': index_loaded, 'load_error': None, 'model_load_seconds': 1.5,
+            'index_load_seconds': 0.5, 'warmup_seconds': 0.25, 'deferred_imports': {}}
+
+class TestBotInterface(unittest.TestCase):
+    """Test suite for the Streamlit app in botInterface.py"""
+
+    def setUp(self):
+        st.cache_resource.clear()
+
+    @patch('RAG.ChatBot')
+    def test_chatbot_shared_across_reruns(self, mock_chatbot):
+        """Test that reruns and new sessions reuse one ChatBot, loaded in the background once"""
+        chat = mock_chatbot.return_value
+        chat.startup_stats.return_value = startup_stats()
+
+        first = AppTest.from_file(APP_PATH).run()
+        first.run()
+        AppTest.from_file(APP_PATH).run()
+
+        mock_chatbot.assert_called_once_with(load=False)
+        chat.load_in_background.assert_called_once()
+        self.assertFalse(first.exception)
+
+    @patch('RAG.ChatBot')
+    def test_health_check_reports_load_time(self, mock_chatbot):
+        """Test that the health check shows model load and warm-up times"""
+        chat = mock_chatbot.return_value
+        chat.startup_stats.return_value = startup_stats()
+
+        app = AppTest.from_file(APP_PATH)
+        app.query_params['health-check'] = ''
+        app.run()
+
+        status = app.json[0].value
+        self.assertIn('"model_load_seconds": 1.5', status)
+        self.assertIn('"warmup_seconds": 0.25', status)
+        self.assertIn('"faiss_index": "healthy"', status)
+        self.assertIn('"ready": true', status)
+
+    @patch('RAG.ChatBot')
+    def test_health_check_answers_while_loading(self, mock_chatbot):
+        """Test that the health check does not wait for the model and reports it is not ready"""
+        chat = mock_chatbot.return_value
+        chat.startup_stats.return_value = startup_stats(ready=False, index_loaded=False)
+        chat.ready.is_set.return_value = False
+
+        app = AppTest.from_file(APP_PATH)
+        app.query_params['health-check'] = ''
+        app.run()
+
+        status = app.json[0].value
+        self.assertIn('"status": "starting"', status)
+        self.assertIn('"faiss_index": "loading"', status)
+        self.assertIn('"ready": false', status)
+        chat.ready.wait.assert_not_called()
+
+    @patch('RAG.ChatBot')
+    def test_health_check_reports_stage_latency(self, mock_chatbot):
+        """Test that the health check shows the per-stage latency histograms"""
+        chat = mock_chatbot.return_value
+        chat.startup_stats.return_value = startup_stats()
+        chat.latency = LatencyRecorder()
+        chat.latency.record("embed", 4.0)
+        chat.latency.record("llm_total", 800.0)
+
+        app = AppTest.from_file(APP_PATH)
+        app.query_params['health-check'] = ''
+        app.run()
+
+        status = app.json[0].value
+        self.assertIn('"latency"', status)
+        self.assertIn('"embed"', status)
+        self.assertIn('"llm_total"', status)
+        self.assertIn('"<=1000": 1', status)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,28 @@
 import os
 import sys
 import unittest
+import tempfile
+import numpy as np
+import pandas as pd
 from unittest.mock import patch, MagicMock, mock_open
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
 
 # Add parent directory to path so we can import build_index
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import build_index
+import faiss_utils
+from compact_store import load_compact
+from embedding_backends import embedding_config
+
+class RecordingEmbedding(DeterministicFakeEmbedding):
+    """Fake embeddings that remember which texts were embedded"""
+
+    def embed_documents(self, texts):
+        self.__dict__.setdefault('embedded', []).extend(texts)
+        return super().embed_documents(texts)
 
 class TestBuildIndex(unittest.TestCase):
     """Test suite for the build_index.py script"""
@@ -37,69 +53,294 @@ class TestBuildIndex(unittest.TestCase):
         mock_get.assert_any_call('DATA_PATH', 'data')
         mock_get.assert_any_call('FAISS_INDEX_PATH', 'faiss_index')
 
-    @patch('build_index.pd.read_csv')
-    @patch('build_index.Document')
-    @patch('build_index.HuggingFaceEmbeddings')
-    @patch('build_index.FAISS')
-    def test_build_faiss_index(self, mock_faiss, mock_embeddings, mock_document, mock_read_csv):
-        """Test the build_faiss_index function"""
-        # Mock pandas DataFrame
-        mock_df = MagicMock()
-        mock_df.__getitem__.return_value = mock_df
-        mock_df.iterrows.return_value = [(0, MagicMock(iloc=[MagicMock()], id=1))]
-        mock_read_csv.return_value = mock_df
-        
-        # Mock HuggingFaceEmbeddings
-        mock_embeddings_instance = MagicMock()
-        mock_embeddings.return_value = mock_embeddings_instance
-        
-        # Mock Document
-        mock_document_instance = MagicMock()
-        mock_document.return_value = mock_document_instance
-        
-        # Mock FAISS
-        mock_vector_store = MagicMock()
-        mock_faiss.from_documents.return_value = mock_vector_store
-        
-        # Call the build_faiss_index function with environment variables patched
-        with patch('build_index.os.environ.get', 
+    def _write_csvs(self, data_path, hackmageddon_rows):
+        """Writes a minimal HACKMAGEDDON and TISAFE csv pair into data_path"""
+        pd.DataFrame({'Description': hackmageddon_rows}).to_csv(
+            os.path.join(data_path, 'HACKMAGEDDON_cleaned.csv'), index=False)
+        pd.DataFrame({'id': [7, 9], 'attack_details': ['Ransomware on a water utility', 'Wiper on a grid operator']}).to_csv(
+            os.path.join(data_path, 'TISAFE_cleaned.csv'), index=False)
+
+    def _build(self, data_path, index_path, embeddings, **kwargs):
+        """Runs build_faiss_index against temporary paths with fake embeddings"""
+        with patch('build_index.os.environ.get',
                   side_effect=lambda key, default: {
-                      'DATA_PATH': 'test_data',
-                      'FAISS_INDEX_PATH': 'test_faiss_index'
+                      'DATA_PATH': data_path,
+                      'FAISS_INDEX_PATH': index_path
                   }.get(key, default)), \
-             patch('build_index.load_dotenv'):
-            
-            build_index.build_faiss_index()
-        
-        # Verify that FAISS.from_documents was called (documents were created)
-        mock_faiss.from_documents.assert_called_once()
-        
-        # Verify that the vector store's save_local method was called with the expected path
-        mock_vector_store.save_local.assert_called_once_with('test_faiss_index')
-    
+             patch('build_index.load_dotenv'), \
+             patch('build_index.HuggingFaceEmbeddings', return_value=embeddings), \
+             patch('builtins.print') as mock_print:
+            build_index.build_faiss_index(**kwargs)
+        return mock_print
+
+    def test_build_faiss_index(self):
+        """Test the build_faiss_index function"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank'])
+            embeddings = RecordingEmbedding(size=8)
+
+            mock_print = self._build(data_path, index_path, embeddings)
+
+            # Every row was embedded and stored under its row key
+            self.assertEqual(len(embeddings.embedded), 4)
+            mock_print.assert_any_call("Index update summary: added 4, updated 0, removed 0, reused 0")
+
+            manifest = build_index.load_manifest(index_path)
+            self.assertEqual(set(manifest['rows']), {'HACKMAGEDDON:0', 'HACKMAGEDDON:1', 'TISAFE:7', 'TISAFE:9'})
+            store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(store.index.ntotal, 4)
+
+            # The BM25 index is written next to it and finds rows by their words
+            lexical = build_index.BM25Index.load(index_path)
+            faiss_ids, _ = lexical.search('grid operator', 1)
+            self.assertEqual(faiss_ids.tolist(), [manifest['rows']['TISAFE:9']['faiss_id']])
+
+    def test_incompatible_embedding_backend_rebuilds(self):
+        """Test that the backend is recorded and switching to int8 vectors re-embeds everything"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank'])
+            self._build(data_path, index_path, DeterministicFakeEmbedding(size=8))
+            self.assertEqual(build_index.load_manifest(index_path)['embedding']['backend'], 'torch')
+
+            # onnx computes the same vectors as torch, the index is reused
+            embeddings = RecordingEmbedding(size=8)
+            self._build(data_path, index_path, embeddings, embedding_backend='onnx')
+            self.assertFalse(hasattr(embeddings, 'embedded'))
+
+            embeddings = RecordingEmbedding(size=8)
+            mock_print = self._build(data_path, index_path, embeddings, embedding_backend='onnx_int8')
+            self.assertEqual(len(embeddings.embedded), 4)
+            mock_print.assert_any_call("Index update summary: added 4, updated 0, removed 0, reused 0")
+            self.assertEqual(build_index.load_manifest(index_path)['embedding']['backend'], 'onnx_int8')
+
+    def test_compact_store(self):
+        """Test that --compact writes a store the compact loader reads, and that turning it off unlists it"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank'])
+            embeddings = DeterministicFakeEmbedding(size=8)
+            self._build(data_path, index_path, embeddings, compact=True, compact_codec='int8')
+
+            manifest = build_index.load_manifest(index_path)
+            self.assertEqual((manifest['compact']['codec'], manifest['compact']['documents']), ('int8', 4))
+            store = load_compact(index_path, embeddings)
+            doc = store.similarity_search('Wiper on a grid operator', k=1)[0]
+            self.assertEqual((doc.metadata['source'], doc.metadata['id']), ('TISAFE', 9))
+
+            self._build(data_path, index_path, embeddings, compact=False)
+            self.assertNotIn('compact', build_index.load_manifest(index_path))
+
+    def test_versioned_build(self):
+        """Test that versioned builds update a copy, publish it and keep the served version intact"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_root:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank'])
+            self._build(data_path, index_root, DeterministicFakeEmbedding(size=8), versioned=True)
+            first = build_index.current_version(index_root)
+            first_path = build_index.resolve_index_path(index_root)
+            self.assertEqual(build_index.load_manifest(first_path)['version'], first)
+
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a regional bank'])
+            embeddings = RecordingEmbedding(size=8)
+            self._build(data_path, index_root, embeddings, versioned=True)
+            second = build_index.current_version(index_root)
+            self.assertNotEqual(second, first)
+            self.assertEqual(embeddings.embedded, ['DDoS on a regional bank'])
+            self.assertEqual(len(build_index.load_manifest(first_path)['rows']), 4)
+            old = FAISS.load_local(first_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(old.similarity_search('DDoS on a bank', k=1)[0].page_content, 'DDoS on a bank')
+
+            # Nothing changed: no new version, and only the newest two are kept
+            mock_print = self._build(data_path, index_root, RecordingEmbedding(size=8), versioned=True)
+            mock_print.assert_any_call("Index is up to date: added 0, updated 0, removed 0, reused 4")
+            self.assertEqual(build_index.current_version(index_root), second)
+            self.assertEqual(sorted(os.listdir(os.path.join(index_root, build_index.VERSIONS_DIR))), [first, second])
+            self._write_csvs(data_path, ['Phishing campaign'])
+            self._build(data_path, index_root, DeterministicFakeEmbedding(size=8), versioned=True)
+            versions = sorted(os.listdir(os.path.join(index_root, build_index.VERSIONS_DIR)))
+            self.assertEqual(versions, [second, build_index.current_version(index_root)])
+
+    def test_sharded_build(self):
+        """Test that a sharded build writes one index per source and rebuilds a single shard on its own"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank'])
+            self._build(data_path, index_path, DeterministicFakeEmbedding(size=8), sharded=True)
+            shards = build_index.load_shards(index_path)
+            self.assertEqual({name: shard['documents'] for name, shard in shards['shards'].items()},
+                             {'HACKMAGEDDON': 2, 'TISAFE': 2})
+            self.assertEqual(shards['shards']['TISAFE']['path'], 'shards/TISAFE')
+            tisafe_path = os.path.join(index_path, 'shards', 'TISAFE')
+            tisafe_version = build_index.load_manifest(tisafe_path)['version']
+
+            # Only HACKMAGEDDON is read and re-embedded, the TISAFE shard is left as it is
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a regional bank'])
+            os.remove(os.path.join(data_path, 'TISAFE_cleaned.csv'))
+            embeddings = RecordingEmbedding(size=8)
+            self._build(data_path, index_path, embeddings, shards=['HACKMAGEDDON'])
+            self.assertEqual(embeddings.embedded, ['DDoS on a regional bank'])
+            shards = build_index.load_shards(index_path)
+            self.assertEqual(shards['shards']['TISAFE']['version'], tisafe_version)
+            self.assertNotEqual(shards['shards']['HACKMAGEDDON']['version'], tisafe_version)
+            self.assertEqual(build_index.load_manifest(tisafe_path)['version'], tisafe_version)
+
+            with self.assertRaises(ValueError):
+                self._build(data_path, index_path, embeddings, shards=['UNKNOWN'])
+            with self.assertRaises(ValueError):
+                self._build(data_path, index_path, embeddings, sharded=True, dedup=True)
+
+            # Back to a single index: the shards go away
+            self._write_csvs(data_path, ['Phishing campaign'])
+            self._build(data_path, index_path, DeterministicFakeEmbedding(size=8))
+            self.assertIsNone(build_index.load_shards(index_path))
+            self.assertFalse(os.path.exists(os.path.join(index_path, 'shards')))
+
+    def test_incremental_rebuild(self):
+        """Test that a rebuild only embeds new or changed rows and drops removed ones"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank', 'Defacement'])
+            self._build(data_path, index_path, DeterministicFakeEmbedding(size=8))
+            first_ids = build_index.load_manifest(index_path)['rows']
+
+            # Row 1 changes, row 2 disappears, TISAFE rows are untouched
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a regional bank'])
+            embeddings = RecordingEmbedding(size=8)
+            mock_print = self._build(data_path, index_path, embeddings)
+
+            self.assertEqual(embeddings.embedded, ['DDoS on a regional bank'])
+            mock_print.assert_any_call("Index update summary: added 0, updated 1, removed 1, reused 3")
+
+            rows = build_index.load_manifest(index_path)['rows']
+            self.assertNotIn('HACKMAGEDDON:2', rows)
+            self.assertEqual(rows['HACKMAGEDDON:1']['faiss_id'], first_ids['HACKMAGEDDON:1']['faiss_id'])
+            store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(store.index.ntotal, 4)
+            doc = store.similarity_search('DDoS on a regional bank', k=1)[0]
+            self.assertEqual(doc.page_content, 'DDoS on a regional bank')
+
+    def test_parallel_batched_build(self):
+        """Test that batches embedded on a thread pool all end up in the index"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, [f'Incident number {i}' for i in range(9)])
+            embeddings = RecordingEmbedding(size=8)
+
+            mock_print = self._build(data_path, index_path, embeddings, batch_size=2, workers=3, executor='thread')
+
+            self.assertEqual(len(embeddings.embedded), 11)
+            mock_print.assert_any_call("Index update summary: added 11, updated 0, removed 0, reused 0")
+            store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(store.index.ntotal, 11)
+            doc = store.similarity_search('Incident number 4', k=1)[0]
+            self.assertEqual((doc.metadata['source'], doc.metadata['id']), ('HACKMAGEDDON', 4))
+
+    def test_chunks_embedded_as_they_are_read(self):
+        """Test that each chunk of the sources is embedded before the next one is read"""
+        events = []
+
+        class LoggingEmbedding(DeterministicFakeEmbedding):
+            def embed_documents(self, texts):
+                events.append(('embed', len(texts)))
+                return super().embed_documents(texts)
+
+        def chunks():
+            for i in range(3):
+                events.append(('read', i))
+                yield [Document(page_content=f'Incident {i} {j}', metadata={'source': 'TEST', 'id': 2 * i + j}) for j in range(2)]
+
+        with tempfile.TemporaryDirectory() as index_path, patch('builtins.print'):
+            summary = build_index.update_index(index_path, chunks(), LoggingEmbedding(size=8), embedding_config(),
+                                               faiss_utils.index_config('flat'), 'v1', batch_size=2)
+            self.assertEqual(summary['added'], 6)
+            self.assertEqual(events, [('read', 0), ('embed', 2), ('read', 1), ('embed', 2), ('read', 2), ('embed', 2)])
+            store = FAISS.load_local(index_path, LoggingEmbedding(size=8), allow_dangerous_deserialization=True)
+            self.assertEqual(store.similarity_search('Incident 1 1', k=1)[0].metadata['id'], 3)
+
+    def test_hnsw_incremental_removal(self):
+        """Test that rows removed from an HNSW index disappear although HNSW cannot delete in place"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'DDoS on a bank', 'Defacement'])
+            self._build(data_path, index_path, RecordingEmbedding(size=8), index_type='hnsw', index_params={'M': 8})
+
+            self._write_csvs(data_path, ['Phishing campaign'])
+            embeddings = RecordingEmbedding(size=8)
+            mock_print = self._build(data_path, index_path, embeddings, index_type='hnsw', index_params={'M': 8})
+
+            self.assertNotIn('embedded', embeddings.__dict__)
+            mock_print.assert_any_call("Index update summary: added 0, updated 0, removed 2, reused 3")
+            manifest = build_index.load_manifest(index_path)
+            self.assertEqual(manifest['index']['type'], 'hnsw')
+            store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(store.index.ntotal, 3)
+
+    def test_ivf_incremental_update(self):
+        """Test that replacing rows of an IVF index keeps every FAISS id pointing at its own vector"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            rows = [f'Incident {i} text' for i in range(200)]
+            self._write_csvs(data_path, rows)
+            self._build(data_path, index_path, DeterministicFakeEmbedding(size=8), index_type='ivf_flat', index_params={'nlist': 2})
+
+            rows[3] = 'Changed text'
+            self._write_csvs(data_path, rows[:190])
+            embeddings = RecordingEmbedding(size=8)
+            mock_print = self._build(data_path, index_path, embeddings, index_type='ivf_flat', index_params={'nlist': 2})
+
+            self.assertEqual(embeddings.embedded, ['Changed text'])
+            mock_print.assert_any_call("Index update summary: added 0, updated 1, removed 10, reused 191")
+            store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(store.index.ntotal, 192)
+            faiss_utils.enable_reconstruct(store.index, build_index.load_manifest(index_path)['index'])
+            for text in ['Incident 150 text', 'Incident 189 text', 'Changed text', 'Wiper on a grid operator']:
+                doc = store.similarity_search(text, k=1)[0]
+                self.assertEqual(doc.page_content, text)
+            # The stored vectors are read back through the same id mapping
+            for faiss_id, key in store.index_to_docstore_id.items():
+                expected = embeddings.embed_query(store.docstore.search(key).page_content)
+                self.assertTrue(np.allclose(store.index.reconstruct(int(faiss_id)), expected, atol=1e-6))
+
+    def test_dedup_merges_cross_source_duplicates(self):
+        """Test that the same incident reported by two sources is stored once and not re-checked on rebuild"""
+        with tempfile.TemporaryDirectory() as data_path, tempfile.TemporaryDirectory() as index_path:
+            self._write_csvs(data_path, ['Phishing campaign', 'Ransomware on a water utility'])
+            embeddings = RecordingEmbedding(size=8)
+
+            mock_print = self._build(data_path, index_path, embeddings, dedup=True)
+
+            # Both copies are embedded for the check, the kept one is not embedded again
+            self.assertEqual(sorted(embeddings.embedded), sorted(['Ransomware on a water utility'] * 2 + ['Phishing campaign', 'Wiper on a grid operator']))
+            mock_print.assert_any_call("Index update summary: added 3, updated 0, removed 0, reused 0")
+            store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+            self.assertEqual(store.index.ntotal, 3)
+            doc = store.similarity_search('Ransomware on a water utility', k=1)[0]
+            self.assertEqual(doc.metadata['sources'], ['HACKMAGEDDON', 'TISAFE'])
+            self.assertEqual(len(doc.metadata['duplicates']), 1)
+            # A sources filter reaches the merged row under either source
+            merged_id = next(i for i, key in store.index_to_docstore_id.items() if store.docstore.search(key).metadata.get('sources'))
+            attributes = build_index.AttributeIndex.load(index_path)
+            for source in ('HACKMAGEDDON', 'TISAFE'):
+                self.assertIn(merged_id, attributes.matching_ids({'sources': [source]}).tolist())
+
+            embeddings = RecordingEmbedding(size=8)
+            mock_print = self._build(data_path, index_path, embeddings, dedup=True)
+            self.assertNotIn('embedded', embeddings.__dict__)
+            mock_print.assert_any_call("Index is up to date: added 0, updated 0, removed 0, reused 3")
+
     @patch('build_index.os.environ.get')
-    @patch('build_index.pd.read_csv')
-    def test_file_not_found_handling(self, mock_read_csv, mock_get):
+    def test_file_not_found_handling(self, mock_get):
         """Test that the script handles file not found errors gracefully"""
         # Set up the environment variable mocks
         mock_get.side_effect = lambda key, default: {
             'DATA_PATH': 'test_data',
             'FAISS_INDEX_PATH': 'test_faiss_index'
         }.get(key, default)
-        
-        # Set up read_csv to raise FileNotFoundError
-        mock_read_csv.side_effect = FileNotFoundError("File not found")
-        
+
         # Call the build_faiss_index function with patches
         with patch('build_index.HuggingFaceEmbeddings'), \
              patch('build_index.FAISS'), \
              patch('build_index.load_dotenv'), \
              patch('builtins.print') as mock_print:
-            
+
             build_index.build_faiss_index()
-            
-            # Verify that the error was printed
-            mock_print.assert_any_call("ERROR: File not found test_data/CISSM_cleaned.csv. Skipping.")
+
+            # Verify that the error was printed and nothing was built
+            mock_print.assert_any_call("ERROR: File not found test_data/HACKMAGEDDON_cleaned.csv. Skipping.")
+            mock_print.assert_any_call("No documents loaded. FAISS index will not be built.")
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import sys
+import unittest
+import tempfile
+from unittest.mock import patch
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+import numpy as np
+
+# Add parent directory to path so we can import compact_store
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import compact_store
+from compact_store import ArrowDocstore, save_compact, load_compact
+from build_index import add_documents
+from faiss_utils import index_config, make_index
+
+TEXTS = [f"incident report {i}" for i in range(40)] + ["ransomware on a water utility"]
+
+def make_store(embeddings, config):
+    """An id-mapped store like the ones build_index writes"""
+    store = FAISS(embeddings, make_index(config, embeddings.size), InMemoryDocstore(), {})
+    vectors = np.array(embeddings.embed_documents(TEXTS), dtype=np.float32)
+    if not store.index.is_trained:
+        store.index.train(vectors)
+    documents = [Document(page_content=text, metadata={"source": "TEST", "id": i}) for i, text in enumerate(TEXTS)]
+    add_documents(store, list(range(100, 100 + len(TEXTS))), documents, vectors)
+    return store
+
+class TestCompactStore(unittest.TestCase):
+    """Test suite for the memory-mapped index and Arrow docstore"""
+
+    def test_round_trip(self):
+        """Test that every index type searches the same documents after compaction"""
+        embeddings = DeterministicFakeEmbedding(size=16)
+        for index_type in ('flat', 'hnsw', 'ivf_flat'):
+            with self.subTest(index_type=index_type), tempfile.TemporaryDirectory() as index_path:
+                config = index_config(index_type, nlist=4, nprobe=4)
+                store = make_store(embeddings, config)
+                summary = save_compact(index_path, store, config, 'fp16')
+                self.assertEqual((summary['codec'], summary['documents']), ('fp16', len(TEXTS)))
+
+                compact = load_compact(index_path, embeddings)
+                self.assertEqual(compact.index.ntotal, len(TEXTS))
+                doc = compact.similarity_search('ransomware on a water utility', k=1)[0]
+                self.assertEqual(doc.page_content, 'ransomware on a water utility')
+                self.assertEqual(doc.metadata, {"source": "TEST", "id": 40})
+
+    def test_int8_codec_is_smaller(self):
+        """Test that 8-bit codes take less space than half precision ones"""
+        embeddings = DeterministicFakeEmbedding(size=64)
+        config = index_config('flat')
+        store = make_store(embeddings, config)
+        with tempfile.TemporaryDirectory() as fp16_path, tempfile.TemporaryDirectory() as int8_path:
+            fp16 = save_compact(fp16_path, store, config, 'fp16')
+            int8 = save_compact(int8_path, store, config, 'int8')
+            self.assertLess(int8['index_bytes'], fp16['index_bytes'])
+            doc = load_compact(int8_path, embeddings).similarity_search('incident report 7', k=1)[0]
+            self.assertEqual(doc.page_content, 'incident report 7')
+
+    def test_docstore_reads_rows_lazily(self):
+        """Test that documents are only built for the rows asked for"""
+        embeddings = DeterministicFakeEmbedding(size=8)
+        config = index_config('flat')
+        with tempfile.TemporaryDirectory() as index_path:
+            save_compact(index_path, make_store(embeddings, config), config)
+            docstore = ArrowDocstore(os.path.join(index_path, compact_store.DOCSTORE_FILE))
+            self.assertEqual(len(docstore), len(TEXTS))
+            with patch('compact_store.Document', wraps=compact_store.Document) as mock_document:
+                self.assertEqual(docstore.search('TEST:3').page_content, 'incident report 3')
+                self.assertEqual(mock_document.call_count, 1)
+            self.assertEqual(docstore.search('missing'), 'ID missing not found.')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+import numpy as np
+from langchain_core.documents import Document
+
+# Add parent directory to path so we can import context_packer
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from context_packer import count_tokens, truncate, format_passage, select_passages
+
+class TestContextPacker(unittest.TestCase):
+    """Test suite for the prompt context helpers in context_packer.py"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        base = rng.normal(size=(3, 16))
+        # Passage 1 is a near copy of passage 0, as when two sources report the same incident
+        self.vectors = np.vstack([base[0], base[0] + 0.01 * rng.normal(size=16), base[1], base[2]])
+        self.query = base[0] + base[1]
+
+    def test_near_duplicates_dropped(self):
+        """Test that a passage almost identical to a picked one is left out"""
+        selected, duplicates = select_passages(self.vectors, [10, 10, 10, 10], 100, self.query)
+        self.assertEqual(duplicates, 1)
+        self.assertEqual(sorted(selected), [0, 2, 3])
+
+    def test_token_budget(self):
+        """Test that passages are skipped once they no longer fit, in favour of shorter ones"""
+        selected, _ = select_passages(self.vectors, [40, 40, 50, 20], 60, self.query)
+        self.assertEqual(selected[0], 0)
+        self.assertEqual(sorted(selected), [0, 3])
+        self.assertEqual(select_passages([], [], 60), ([], 0))
+
+    def test_formatting(self):
+        """Test the tag and whitespace of a passage and the token helpers"""
+        document = Document(page_content='Wiper  on a\ngrid operator', metadata={'source': 'TISAFE', 'id': 9, 'year': 2022})
+        self.assertEqual(format_passage(document), '[TISAFE:9, 2022] Wiper on a grid operator')
+        self.assertEqual(count_tokens('x' * 9), 3)
+        self.assertLessEqual(count_tokens(truncate('word ' * 100, 10)), 12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+import numpy as np
+from langchain_core.documents import Document
+
+# Add parent directory to path so we can import dedup
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dedup import shingles, minhash_signatures, candidate_pairs, confirm_pairs, cluster_pairs, merge_cluster
+
+TEXTS = [
+    'Home appliances giant Whirlpool suffers a ransomware attack by the Nefilim ransomware gang who stole data',
+    'Home appliances giant Whirlpool suffered a ransomware attack by the Nefilim ransomware gang who stole data before encrypting',
+    'Train services in Iran are delayed by apparent cyberattacks on the railway',
+    'Home appliances giant Whirlpool suffers a ransomware attack by the Nefilim ransomware gang who stole data',
+]
+SOURCES = ['HACKMAGEDDON', 'ICSSTRIVE', 'TISAFE', 'HACKMAGEDDON']
+
+class TestDedup(unittest.TestCase):
+    """Test suite for the duplicate detection in dedup.py"""
+
+    def test_candidate_pairs_across_sources(self):
+        """Test that paraphrases from different sources pair up and same-source copies do not"""
+        signatures = minhash_signatures(TEXTS)
+        self.assertTrue(np.array_equal(signatures[0], signatures[3]))
+        self.assertEqual(candidate_pairs(signatures, SOURCES), [(0, 1), (1, 3)])
+
+    def test_minhash_matches_exact_arithmetic(self):
+        """Test that the vectorized hashes equal (a * x + b) mod 2^61 - 1 computed on Python ints"""
+        signatures = minhash_signatures(TEXTS[:2], num_perm=8, seed=3)
+        rng = np.random.default_rng(3)
+        a = [int(v) for v in rng.integers(1, 1 << 32, size=8, dtype=np.uint64)]
+        b = [int(v) for v in rng.integers(0, 1 << 32, size=8, dtype=np.uint64)]
+        for text, signature in zip(TEXTS[:2], signatures):
+            values = [int(x) for x in shingles(text)]
+            expected = [min(((a[k] * x + b[k]) % ((1 << 61) - 1)) & 0xFFFFFFFF for x in values) for k in range(8)]
+            self.assertEqual(signature.tolist(), expected)
+
+    def test_confirm_and_cluster(self):
+        """Test that only pairs with similar embeddings are merged, transitively"""
+        vectors = {0: [1.0, 0.0], 1: [0.99, 0.05], 2: [0.0, 1.0], 3: [0.98, 0.1]}
+        confirmed = confirm_pairs([(0, 1), (1, 2), (1, 3)], lambda indexes: [vectors[i] for i in indexes])
+        self.assertEqual(confirmed, [True, False, True])
+        self.assertEqual(cluster_pairs([(0, 1), (1, 3), (5, 6)]), [[0, 1, 3], [5, 6]])
+
+    def test_merge_cluster(self):
+        """Test that a cluster keeps the longest text and lists every contributing row"""
+        documents = [
+            Document(page_content=TEXTS[0], metadata={'source': 'HACKMAGEDDON', 'id': 4, 'regions': ['Europe'], 'keywords': 'Nefilim'}),
+            Document(page_content=TEXTS[1], metadata={'source': 'ICSSTRIVE', 'id': 7, 'regions': ['North America'], 'keywords': None}),
+        ]
+        merged = merge_cluster(documents)
+        self.assertEqual(merged.page_content, TEXTS[1])
+        self.assertEqual(merged.metadata['id'], 7)
+        self.assertEqual(merged.metadata['duplicates'], ['HACKMAGEDDON:4'])
+        self.assertEqual(merged.metadata['sources'], ['HACKMAGEDDON', 'ICSSTRIVE'])
+        self.assertEqual(merged.metadata['regions'], ['Europe', 'North America'])
+        self.assertEqual(merged.metadata['keywords'], 'Nefilim')
+
+if __name__ == '__main__':
+    unittest.main()
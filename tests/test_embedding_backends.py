@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Add parent directory to path so we can import embedding_backends
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from embedding_backends import (
+    DEFAULT_MODEL, embedding_config, embedding_kwargs, manifest_embedding, check_compatible
+)
+
+class TestEmbeddingBackends(unittest.TestCase):
+    """Test suite for the embedding backend configuration"""
+
+    def test_config_and_model_kwargs(self):
+        """Test that each backend maps to the sentence-transformers arguments selecting it"""
+        with patch.dict(os.environ, {'EMBEDDING_BACKEND': 'onnx_int8', 'EMBEDDING_QUANTIZATION': 'avx512_vnni'}):
+            config = embedding_config()
+        self.assertEqual(config, {'model_name': DEFAULT_MODEL, 'backend': 'onnx_int8', 'quantization': 'avx512_vnni'})
+        self.assertEqual(embedding_kwargs(config), {
+            'model_kwargs': {'backend': 'onnx', 'model_kwargs': {'file_name': 'onnx/model_qint8_avx512_vnni.onnx'}}
+        })
+        self.assertEqual(embedding_kwargs(embedding_config(backend='onnx')), {'model_kwargs': {'backend': 'onnx'}})
+        self.assertEqual(embedding_kwargs(embedding_config(backend='torch')), {})
+        with self.assertRaises(ValueError):
+            embedding_config(backend='tensorrt')
+        with self.assertRaises(ValueError):
+            embedding_config(backend='onnx_int8', quantization='sse2')
+
+    def test_compatibility(self):
+        """Test that float32 backends mix, int8 vectors only match the same quantized model"""
+        torch = manifest_embedding({'model_name': DEFAULT_MODEL})
+        self.assertEqual(torch, {'model_name': DEFAULT_MODEL, 'backend': 'torch'})
+        check_compatible(torch, embedding_config(backend='onnx'))
+        int8 = embedding_config(backend='onnx_int8', quantization='avx2')
+        check_compatible(int8, embedding_config(backend='onnx_int8', quantization='avx2'))
+
+        with self.assertRaisesRegex(ValueError, 'not comparable'):
+            check_compatible(torch, int8)
+        with self.assertRaises(ValueError):
+            check_compatible(int8, embedding_config(backend='onnx_int8', quantization='arm64'))
+        with self.assertRaises(ValueError):
+            check_compatible(torch, embedding_config(model_name='BAAI/bge-small-en-v1.5', backend='torch'))
+
+if __name__ == '__main__':
+    unittest.main()
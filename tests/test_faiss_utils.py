@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+# Add parent directory to path so we can import faiss_utils
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import faiss
+import faiss_utils
+
+class TestFaissUtils(unittest.TestCase):
+    """Test suite for the index helpers in faiss_utils.py"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.random((400, 16), dtype=np.float32)
+        self.ids = np.arange(400, dtype=np.int64) * 10
+
+    def test_index_types_find_exact_match(self):
+        """Test that every index type returns a stored vector as its own nearest neighbour"""
+        for index_type, params in [('flat', {}), ('hnsw', {'M': 8}), ('ivf_flat', {'nlist': 4}), ('ivf_pq', {'nlist': 4, 'pq_m': 4})]:
+            config = faiss_utils.index_config(index_type, **params)
+            index = faiss_utils.make_index(config, 16)
+            if faiss_utils.training_size(config):
+                index.train(self.vectors)
+            index.add_with_ids(self.vectors, self.ids)
+
+            _, labels = index.search(self.vectors[:1], 1)
+            self.assertEqual(labels[0][0], 0, index_type)
+
+    def test_search_params_applied(self):
+        """Test that efSearch and nprobe from the config reach the wrapped index"""
+        hnsw = faiss_utils.make_index(faiss_utils.index_config('hnsw', efSearch=77), 16)
+        self.assertEqual(faiss.downcast_index(hnsw.index).hnsw.efSearch, 77)
+
+        ivf = faiss_utils.make_index(faiss_utils.index_config('ivf_flat', nlist=4), 16)
+        faiss_utils.apply_search_params(ivf, {'type': 'ivf_flat', 'params': {'nprobe': 3}})
+        self.assertEqual(faiss.extract_index_ivf(ivf).nprobe, 3)
+
+    def test_rebuild_without_for_hnsw(self):
+        """Test that HNSW, which cannot remove ids, is rebuilt without them"""
+        config = faiss_utils.index_config('hnsw', M=8)
+        index = faiss_utils.make_index(config, 16)
+        index.add_with_ids(self.vectors, self.ids)
+        self.assertFalse(faiss_utils.supports_removal(index))
+
+        rebuilt = faiss_utils.rebuild_without(index, config, [0, 10])
+
+        self.assertEqual(rebuilt.ntotal, 398)
+        _, labels = rebuilt.search(self.vectors[2:3], 1)
+        self.assertEqual(labels[0][0], 20)
+
+    def test_unknown_index_type(self):
+        """Test that an unknown index type is rejected"""
+        with self.assertRaises(ValueError):
+            faiss_utils.index_config('lsh')
+
+if __name__ == '__main__':
+    unittest.main()
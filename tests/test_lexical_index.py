@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+import tempfile
+from langchain_core.documents import Document
+
+# Add parent directory to path so we can import lexical_index
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from lexical_index import BM25Index, tokenize, reciprocal_rank_fusion
+
+DOCUMENTS = [
+    Document(page_content='Ransomware encrypted the billing systems of a water utility', metadata={'keywords': 'LockBit'}),
+    Document(page_content='Attackers exploited CVE-2021-44228 in a VPN appliance', metadata={'keywords': 'Lazarus Group'}),
+    Document(page_content='A wiper disabled substations of a grid operator', metadata={'keywords': 'Industroyer Sandworm'}),
+    Document(page_content='Phishing campaign against a water treatment plant', metadata={}),
+]
+
+class TestLexicalIndex(unittest.TestCase):
+    """Test suite for the BM25 index in lexical_index.py"""
+
+    def setUp(self):
+        self.index = BM25Index.from_documents([30, 10, 20, 40], DOCUMENTS)
+
+    def test_tokenize_keeps_identifiers(self):
+        """Test that compound identifiers are indexed whole and by their parts, without stopwords"""
+        self.assertEqual(tokenize('The CVE-2021-44228 flaw'), ['cve-2021-44228', 'cve', '2021', '44228', 'flaw'])
+
+    def test_search_ranks_exact_identifiers(self):
+        """Test that identifiers in the text or the keywords find their document"""
+        ids, scores = self.index.search('cve-2021-44228', 5)
+        self.assertEqual(ids.tolist(), [10])
+        ids, _ = self.index.search('sandworm attack on a grid', 5)
+        self.assertEqual(ids[0], 20)
+        ids, scores = self.index.search('water', 5)
+        self.assertEqual(sorted(ids.tolist()), [30, 40])
+        self.assertTrue(all(a >= b for a, b in zip(scores, scores[1:])))
+        self.assertEqual(len(self.index.search('unseen words only', 5)[0]), 0)
+
+    def test_search_allowed_ids(self):
+        """Test that results are restricted to the allowed ids"""
+        ids, _ = self.index.search('water', 5, allowed_ids=[40])
+        self.assertEqual(ids.tolist(), [40])
+
+    def test_save_and_load(self):
+        """Test that the postings survive a round trip through lexical.npz"""
+        with tempfile.TemporaryDirectory() as index_path:
+            self.assertIsNone(BM25Index.load(index_path))
+            self.index.save(index_path)
+            loaded = BM25Index.load(index_path)
+        for query in ('lockbit', 'water plant', '44228'):
+            self.assertEqual(loaded.search(query, 3)[0].tolist(), self.index.search(query, 3)[0].tolist())
+
+    def test_reciprocal_rank_fusion(self):
+        """Test that keys ranked well by both lists come first"""
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd']])
+        self.assertEqual([key for key, _ in fused], ['b', 'a', 'd', 'c'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import sys
+import time
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from RAG import ChatBot
+from groq_stub import GroqStubServer
+from llm_scheduler import LLMScheduler, TokenBucket, parse_duration
+from test_rag import make_store, CORPUS
+
+
+class TestLLMScheduler(unittest.TestCase):
+    """Test suite for the admission control in front of the LLM"""
+
+    def test_parse_duration(self):
+        """Test the reset formats of the rate-limit headers"""
+        self.assertEqual(parse_duration("7.66s"), 7.66)
+        self.assertAlmostEqual(parse_duration("2m59.56s"), 179.56)
+        self.assertEqual(parse_duration("120ms"), 0.12)
+        self.assertEqual(parse_duration("3"), 3.0)
+        self.assertIsNone(parse_duration(None))
+
+    def test_token_bucket(self):
+        """Test that a bucket refills at its rate and never waits when unlimited"""
+        bucket = TokenBucket(60)
+        bucket._updated = 100.0
+        bucket.take(60, 100.0)
+        self.assertAlmostEqual(bucket.wait_time(2, 100.0), 2.0)
+        self.assertEqual(bucket.wait_time(2, 102.0), 0.0)
+        self.assertEqual(TokenBucket(0).wait_time(10 ** 6, 0.0), 0.0)
+
+    def test_fair_queue_across_sessions(self):
+        """Test that waiting sessions are served in turn rather than in arrival order"""
+        scheduler = LLMScheduler(max_in_flight=1)
+        scheduler.acquire('busy')
+        order = []
+
+        def request(session, name):
+            scheduler.acquire(session)
+            order.append(name)
+            scheduler.release()
+
+        threads = []
+        for session, name in [('busy', 'busy-1'), ('busy', 'busy-2'), ('busy', 'busy-3'), ('quiet', 'quiet-1')]:
+            thread = threading.Thread(target=request, args=(session, name))
+            thread.start()
+            threads.append(thread)
+            while scheduler.stats()['queued'] < len(threads):
+                time.sleep(0.001)
+        scheduler.release()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(order, ['busy-1', 'quiet-1', 'busy-2', 'busy-3'])
+        stats = scheduler.stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['submitted']), (0, 0, 5))
+        self.assertEqual(stats['queue_wait']['count'], 5)
+
+    def test_cancelled_async_request_leaves_the_queue(self):
+        """Test that cancelling a queued acall frees its place and holds neither a slot nor a thread"""
+        scheduler = LLMScheduler(max_in_flight=1)
+
+        async def send():
+            return SimpleNamespace(headers={})
+
+        async def scenario():
+            scheduler.acquire()
+            threads = threading.active_count()
+            waiting = [asyncio.create_task(scheduler.acall(send)) for _ in range(5)]
+            while scheduler.stats()['queued'] < 5:
+                await asyncio.sleep(0.001)
+            self.assertEqual(threading.active_count(), threads)
+            waiting[0].cancel()
+            await asyncio.gather(waiting[0], return_exceptions=True)
+            scheduler.release()
+            return await asyncio.wait_for(asyncio.gather(*waiting[1:]), timeout=5)
+
+        self.assertEqual(len(asyncio.run(scenario())), 4)
+        stats = scheduler.stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['completed']), (0, 0, 4))
+
+    def test_pauses_when_headers_report_no_budget(self):
+        """Test that an exhausted budget in the headers holds requests until its reset"""
+        scheduler = LLMScheduler()
+        scheduler.acquire()
+        scheduler.release({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '200ms'})
+        self.assertEqual(scheduler.stats()['remaining_requests'], 0)
+        self.assertGreaterEqual(scheduler.acquire(), 0.15)
+
+
+class TestSchedulerAgainstStub(unittest.TestCase):
+    """Runs the ChatBot's Groq calls through the scheduler against a stub injecting 429s"""
+
+    def setUp(self):
+        self.stub = GroqStubServer(reply="Stub answer", rate_limit_first=2, retry_after=0.05).start()
+        self.addCleanup(self.stub.stop)
+        env = patch.dict(os.environ, {'GROQ_API_KEY': 'stub_key', 'GROQ_BASE_URL': self.stub.base_url})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def chatbot(self, **env):
+        embeddings = DeterministicFakeEmbedding(size=8)
+        with patch.dict(os.environ, env), patch('RAG.HuggingFaceEmbeddings', return_value=embeddings), \
+             patch('RAG.FAISS') as mock_faiss:
+            mock_faiss.load_local.return_value = make_store(embeddings, CORPUS)
+            chatbot = ChatBot()
+        self.addCleanup(chatbot.close)
+        return chatbot
+
+    def test_retries_rate_limited_requests(self):
+        """Test that 429s are retried after their retry-after and the answer still arrives"""
+        chatbot = self.chatbot()
+        with self.assertLogs('chatbot.rag', level='INFO') as logs:
+            self.assertEqual(chatbot.llamaResponse("test query"), "Stub answer")
+        self.assertEqual(self.stub.rate_limited, 2)
+        self.assertEqual(self.stub.requests, 3)
+        stats = chatbot.llm_scheduler.stats()
+        self.assertEqual((stats['retries'], stats['rate_limited'], stats['completed']), (2, 2, 1))
+        self.assertGreaterEqual(logs.records[-1].props['llm_total_ms'], 100)
+        self.assertIn('llm_queue_ms', logs.records[-1].props)
+
+        # The async path waits in the same queue and records it on its request
+        self.stub.rate_limit_first = 1
+        with self.assertLogs('chatbot.rag', level='INFO') as logs:
+            self.assertEqual(asyncio.run(chatbot.allamaResponse("fire")), "Stub answer")
+        self.assertIn('llm_queue_ms', logs.records[-1].props)
+        self.assertEqual(chatbot.llm_scheduler.stats()['retries'], 3)
+
+        # Streams are retried the same way before their first token
+        self.stub.rate_limit_first = 1
+        self.assertEqual("".join(chatbot.llamaResponseStream("water")), "Stub answer")
+        self.assertEqual(chatbot.llm_scheduler.stats()['in_flight'], 0)
+
+    def test_gives_up_after_max_retries(self):
+        """Test that a request still rate-limited after LLM_MAX_RETRIES fails"""
+        chatbot = self.chatbot(LLM_MAX_RETRIES='1')
+        with self.assertRaises(Exception) as raised:
+            chatbot.llamaResponse("test query")
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(chatbot.llm_scheduler.stats()['failed'], 1)
+
+    def test_reads_rate_limit_headers(self):
+        """Test that the remaining budget reported by the server is tracked"""
+        self.stub.rate_limit_first = 0
+        self.stub.requests_per_minute = 50
+        chatbot = self.chatbot()
+        chatbot.llamaResponse("test query")
+        self.assertEqual(chatbot.llm_scheduler.stats()['remaining_requests'], 49)
+
+
+if __name__ == '__main__':
+    unittest.main()
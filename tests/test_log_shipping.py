@@ -0,0 +1,111 @@
+import os
+import io
+import sys
+import json
+import socket
+import logging
+import threading
+import unittest
+from unittest.mock import patch
+
+# Add parent directory to path so we can import log_shipping
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from log_shipping import JsonFormatter, LogstashHandler
+from telemetry import LatencyRecorder
+
+class TcpListener():
+    """Local stand-in for the Logstash TCP input, collecting the lines it receives."""
+
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.lines = []
+        self.reads = 0
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        connection, _ = self.server.accept()
+        buffer = b""
+        with connection:
+            while chunk := connection.recv(65536):
+                self.reads += 1
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                self.lines.extend(json.loads(line) for line in lines)
+
+    def close(self):
+        self.server.close()
+
+def make_logger(handler, name):
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger(f"chatbot.test.{name}")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+class TestLogShipping(unittest.TestCase):
+    """Test suite for the queue-based Logstash handler"""
+
+    def test_ships_batches_to_tcp_listener(self):
+        """Test that records reach the TCP input as JSON lines with their props"""
+        listener = TcpListener()
+        self.addCleanup(listener.close)
+        handler = LogstashHandler("127.0.0.1", listener.port, batch_size=100, flush_interval=0.05)
+        logger = make_logger(handler, "tcp")
+
+        recorder = LatencyRecorder()
+        with recorder.request("req-1"):
+            for i in range(250):
+                logger.info("Processing query %d", i, extra={"props": {"embed_ms": 1.5}})
+        handler.flush()
+        handler.close()
+        listener._thread.join(timeout=5)
+
+        self.assertEqual(len(listener.lines), 250)
+        self.assertEqual(listener.lines[7]["message"], "Processing query 7")
+        self.assertEqual(listener.lines[7]["embed_ms"], 1.5)
+        self.assertEqual(listener.lines[7]["request_id"], "req-1")
+        stats = handler.stats()
+        self.assertEqual(stats["sent"], 250)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertLessEqual(stats["batches"], 250 // 100 + 2)
+
+    def test_falls_back_to_stdout_when_logstash_is_down(self):
+        """Test that records are written to the fallback stream when the connection fails"""
+        closed = socket.create_server(("127.0.0.1", 0))
+        port = closed.getsockname()[1]
+        closed.close()
+        fallback = io.StringIO()
+        handler = LogstashHandler("127.0.0.1", port, flush_interval=0.05, fallback=fallback)
+        logger = make_logger(handler, "fallback")
+
+        logger.error("Error calling Groq API", extra={"props": {"component": "groq_api"}})
+        handler.flush()
+        handler.close()
+
+        record = json.loads(fallback.getvalue().splitlines()[0])
+        self.assertEqual(record["component"], "groq_api")
+        self.assertEqual(handler.stats()["fallback"], 1)
+        self.assertGreaterEqual(handler.stats()["connection_errors"], 1)
+
+    def test_drops_records_when_queue_is_full(self):
+        """Test that the caller never blocks: records beyond the capacity are dropped and counted"""
+        release = threading.Event()
+        with patch.object(LogstashHandler, "_send", lambda self, payload: release.wait(5)):
+            handler = LogstashHandler("127.0.0.1", 1, capacity=5, batch_size=1, flush_interval=0.05)
+            logger = make_logger(handler, "drop")
+            for i in range(50):
+                logger.info("Message %d", i)
+            release.set()
+            handler.flush()
+            handler.close()
+
+        stats = handler.stats()
+        self.assertGreater(stats["dropped"], 0)
+        self.assertEqual(stats["sent"] + stats["dropped"], 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,51 @@
+import gc
 import os
 import sys
+import time
+import asyncio
+import weakref
+import tempfile
+import subprocess
 import unittest
 from unittest.mock import patch, MagicMock
 
 # Add parent directory to path so we can import RAG
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
 from RAG import ChatBot
+from attribute_index import AttributeIndex
+from lexical_index import BM25Index
+from groq_stub import GroqStubServer
+from faiss_utils import VERSIONS_DIR, save_manifest, publish_version, index_config
+from embedding_backends import embedding_config
+from build_index import update_index, update_shards
+
+CORPUS = [f"test context {i}" for i in range(10)] + ["ransomware on water utilities"]
+
+class RecordingEmbedding(DeterministicFakeEmbedding):
+    """Fake embeddings that remember which texts were embedded"""
+
+    def embed_documents(self, texts):
+        self.__dict__.setdefault('calls', []).append(list(texts))
+        self.__dict__.setdefault('embedded', []).extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def make_store(embeddings, texts):
+    """Builds a real in-memory FAISS store without recording the corpus embeddings"""
+    store = FAISS.from_embeddings(
+        [(text, DeterministicFakeEmbedding(size=embeddings.size).embed_query(text)) for text in texts],
+        embeddings,
+        metadatas=[{"source": "TEST", "id": i} for i in range(len(texts))]
+    )
+    return store
 
 class TestChatBot(unittest.TestCase):
     """Test suite for the ChatBot class in RAG.py"""
@@ -32,35 +71,215 @@ class TestChatBot(unittest.TestCase):
         # Verify the FAISS index was set
         self.assertEqual(chatbot.faiss_index, mock_index)
     
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    @patch('RAG.load_manifest')
+    def test_refuses_index_with_incompatible_embeddings(self, mock_manifest, mock_faiss, mock_embeddings):
+        """Test that queries are not embedded with a backend whose vectors do not match the index"""
+        mock_manifest.return_value = {'embedding': {
+            'model_name': 'sentence-transformers/all-mpnet-base-v2', 'backend': 'onnx_int8', 'quantization': 'avx2'
+        }}
+
+        with patch('builtins.print') as mock_print:
+            chatbot = ChatBot()
+
+        self.assertIsNone(chatbot.faiss_index)
+        self.assertIn('not comparable', str(mock_print.call_args_list))
+
+        with patch.dict(os.environ, {'EMBEDDING_BACKEND': 'onnx_int8'}):
+            chatbot = ChatBot()
+        self.assertIsNotNone(chatbot.faiss_index)
+        self.assertEqual(mock_embeddings.call_args.kwargs['model_kwargs']['backend'], 'onnx')
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    @patch('RAG.load_compact')
+    @patch('RAG.load_manifest')
+    def test_loads_compact_store(self, mock_manifest, mock_compact, mock_faiss, mock_embeddings):
+        """Test that the compact store is preferred when the manifest lists one, unless INDEX_FORMAT says otherwise"""
+        mock_manifest.return_value = {'compact': {'codec': 'fp16', 'documents': 3}}
+
+        chatbot = ChatBot()
+        self.assertEqual(chatbot.store_format, 'compact')
+        self.assertEqual(chatbot.faiss_index, mock_compact.return_value)
+        mock_faiss.load_local.assert_not_called()
+
+        with patch.dict(os.environ, {'INDEX_FORMAT': 'pickle'}):
+            chatbot = ChatBot()
+        self.assertEqual(chatbot.store_format, 'pickle')
+        self.assertEqual(chatbot.faiss_index, mock_faiss.load_local.return_value)
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    @patch('RAG.apply_search_params')
+    @patch('RAG.load_manifest')
+    def test_index_search_params_from_manifest(self, mock_manifest, mock_apply, mock_faiss, mock_embeddings):
+        """Test that the search settings stored at build time are applied on load"""
+        config = {'type': 'hnsw', 'params': {'M': 32, 'efConstruction': 40, 'efSearch': 96}}
+        mock_manifest.return_value = {'index': config}
+
+        chatbot = ChatBot()
+
+        self.assertEqual(chatbot.index_config, config)
+        mock_apply.assert_called_once_with(mock_faiss.load_local.return_value.index, config)
+
     @patch('RAG.HuggingFaceEmbeddings')
     @patch('RAG.FAISS')
     def test_busca_contexto(self, mock_faiss, mock_embeddings):
         """Test the context search functionality"""
-        # Create a mock for the similarity_search method
-        mock_index = MagicMock()
-        mock_faiss.load_local.return_value = mock_index
-        
-        # Create mock results
-        mock_doc1 = MagicMock()
-        mock_doc1.page_content = "Test context 1"
-        mock_doc2 = MagicMock()
-        mock_doc2.page_content = "Test context 2"
-        
-        # Set the return value for similarity_search
-        mock_index.similarity_search.return_value = [mock_doc1, mock_doc2]
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        mock_faiss.load_local.return_value = make_store(embeddings, CORPUS)
         
         # Create a ChatBot instance
         chatbot = ChatBot()
         
-        # Call busca_contexto
-        result = chatbot.busca_contexto("test query")
+        # Call busca_contexto with the exact text of an indexed document
+        result = chatbot.busca_contexto("test context 1")
         
-        # Verify similarity_search was called with correct parameters
-        mock_index.similarity_search.assert_called_once_with("test query", k=5)
-        
-        # Verify the correct context is returned
-        self.assertEqual(result, ["Test context 1", "Test context 2"])
+        # Verify the query was embedded once and the nearest documents returned
+        self.assertEqual(embeddings.embedded, ["test context 1"])
+        self.assertEqual(len(result), 5)
+        self.assertEqual(result[0], "test context 1")
     
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    def test_busca_contexto_cache(self, mock_faiss, mock_embeddings):
+        """Test that repeated queries skip the embedding model and the index"""
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        store = make_store(embeddings, CORPUS)
+        mock_faiss.load_local.return_value = store
+
+        chatbot = ChatBot()
+        with patch.object(store.index, 'search', wraps=store.index.search) as search:
+            first = chatbot.busca_contexto("Ransomware on  water utilities")
+            second = chatbot.busca_contexto("ransomware on water utilities ")
+
+        # Both spellings normalize to the same key, so only the first call did any work,
+        # and the model saw the query as it was asked
+        self.assertEqual(first, second)
+        self.assertEqual(embeddings.embedded, ["Ransomware on  water utilities"])
+        search.assert_called_once()
+        self.assertEqual(chatbot.query_cache.stats()["hits"], 1)
+        self.assertEqual(chatbot.query_cache.stats()["misses"], 1)
+
+        # Reloading the index invalidates the cache
+        chatbot.load_faiss_index()
+        chatbot.busca_contexto("ransomware on water utilities")
+        self.assertEqual(len(embeddings.embedded), 2)
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    def test_busca_contexto_batch(self, mock_faiss, mock_embeddings):
+        """Test that a batch is embedded in one pass and searched in one FAISS call"""
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        store = make_store(embeddings, CORPUS)
+        mock_faiss.load_local.return_value = store
+
+        chatbot = ChatBot()
+        chatbot.busca_contexto_batch(["test context 3"], k=2)
+        with patch.object(store.index, 'search', wraps=store.index.search) as search:
+            results = chatbot.busca_contexto_batch(["test context 2", "Test context 3", "Test  context 2", "test context 4"], k=2)
+
+        # Cached and repeated queries are not embedded again, whatever their spelling
+        self.assertEqual(embeddings.calls[-1], ["test context 2", "test context 4"])
+        search.assert_called_once()
+        self.assertEqual(search.call_args[0][0].shape, (2, 8))
+        self.assertEqual([r[0] for r in results], ["test context 2", "test context 3", "test context 2", "test context 4"])
+        self.assertTrue(all(len(r) == 2 for r in results))
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    @patch('RAG.AttributeIndex.load')
+    def test_busca_contexto_filters(self, mock_attributes, mock_faiss, mock_embeddings):
+        """Test that filtered searches only return documents matching the filters"""
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        store = make_store(embeddings, CORPUS)
+        mock_faiss.load_local.return_value = store
+        documents = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(len(CORPUS))]
+        for document in documents:
+            document.metadata.update(year=2015 + document.metadata["id"], regions=["Europe"] if document.metadata["id"] % 2 else [])
+        mock_attributes.return_value = AttributeIndex.from_documents(list(range(len(CORPUS))), documents)
+
+        chatbot = ChatBot()
+        unfiltered = chatbot.busca_contexto("test context 2")
+        filtered = chatbot.busca_contexto("test context 2", filters={"regions": ["Europe"], "year_from": 2020})
+
+        self.assertEqual(unfiltered[0], "test context 2")
+        self.assertEqual(set(filtered), {"test context 5", "test context 7", "test context 9"})
+        self.assertEqual(chatbot.busca_contexto("test context 2", filters={"year_from": 2100}), [])
+        with self.assertRaises(ValueError):
+            chatbot.busca_contexto("test context 2", filters={"country": "France"})
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    @patch('RAG.BM25Index.load')
+    def test_lexical_and_hybrid_modes(self, mock_lexical, mock_faiss, mock_embeddings):
+        """Test that lexical mode skips the embedding model and hybrid mode fuses both rankings"""
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        store = make_store(embeddings, CORPUS)
+        mock_faiss.load_local.return_value = store
+        documents = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(len(CORPUS))]
+        mock_lexical.return_value = BM25Index.from_documents(list(range(len(CORPUS))), documents)
+
+        chatbot = ChatBot()
+        lexical = chatbot.busca_contexto("Ransomware utilities", mode="lexical")
+        self.assertEqual(lexical, ["ransomware on water utilities"])
+        self.assertNotIn('embedded', embeddings.__dict__)
+
+        hybrid = chatbot.retrieve(["test context 3"], k=3, mode="hybrid")[0]
+        self.assertEqual(hybrid[0][1].page_content, "test context 3")
+        self.assertEqual(len(hybrid), 3)
+
+        chatbot.active_index.lexical = None
+        with self.assertRaises(ValueError):
+            chatbot.busca_contexto("ransomware", mode="hybrid")
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    def test_build_context(self, mock_faiss, mock_embeddings):
+        """Test that the prompt context skips duplicates, keeps to the token budget and logs the savings"""
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        texts = ["ransomware on water utilities"] * 3 + CORPUS[:10]
+        mock_faiss.load_local.return_value = make_store(embeddings, texts)
+
+        with patch.dict(os.environ, {'CONTEXT_TOKEN_BUDGET': '20'}):
+            chatbot = ChatBot()
+        with self.assertLogs('chatbot.rag', level='INFO') as logs:
+            context = chatbot.build_context("ransomware on water utilities")
+
+        lines = context.split("\n")
+        self.assertEqual(lines[0], "[TEST:0] ransomware on water utilities")
+        self.assertEqual(sum("ransomware" in line for line in lines), 1)
+        self.assertLessEqual(len(context), 20 * 4)
+        props = logs.records[-1].props
+        self.assertEqual(props["duplicates_dropped"], 2)
+        self.assertGreater(props["prompt_tokens_saved"], 0)
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    def test_micro_batcher(self, mock_faiss, mock_embeddings):
+        """Test that concurrent single queries are served together when micro-batching is on"""
+        embeddings = RecordingEmbedding(size=8)
+        mock_embeddings.return_value = embeddings
+        mock_faiss.load_local.return_value = make_store(embeddings, CORPUS)
+
+        with patch.dict(os.environ, {'MICRO_BATCH_WINDOW_MS': '200'}):
+            chatbot = ChatBot()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(chatbot.busca_contexto, [f"test context {i}" for i in range(4)]))
+
+        self.assertEqual([r[0] for r in results], [f"test context {i}" for i in range(4)])
+        self.assertLess(chatbot.micro_batcher.batches, 4)
+        self.assertEqual(chatbot.micro_batcher.batched_queries, 4)
+        # Each batch is embedded once, however many queries it holds
+        self.assertEqual(chatbot.latency.snapshot()['embed']['count'], chatbot.micro_batcher.batches)
+
     @patch('RAG.HuggingFaceEmbeddings')
     @patch('RAG.FAISS')
     @patch('RAG.Groq')
@@ -71,9 +290,8 @@ class TestChatBot(unittest.TestCase):
         mock_faiss.load_local.return_value = mock_index
         
         # Mock busca_contexto to return a specific context
-        mock_index.similarity_search.return_value = [
-            MagicMock(page_content="Test context")
-        ]
+        mock_embeddings.return_value = DeterministicFakeEmbedding(size=8)
+        mock_faiss.load_local.return_value = make_store(mock_embeddings.return_value, ["Test context"])
         
         # Mock the Groq client's chat.completions.create method
         mock_client = MagicMock()
@@ -82,7 +300,8 @@ class TestChatBot(unittest.TestCase):
         mock_completion = MagicMock()
         mock_completion.choices = [MagicMock()]
         mock_completion.choices[0].message.content = "Test response"
-        mock_client.chat.completions.create.return_value = mock_completion
+        mock_client.chat.completions.with_raw_response.create.return_value.parse.return_value = mock_completion
+        mock_client.chat.completions.with_raw_response.create.return_value.headers = {}
         
         # Set environment variable for test
         os.environ['GROQ_API_KEY'] = 'test_key'
@@ -93,15 +312,55 @@ class TestChatBot(unittest.TestCase):
         # Call llamaResponse
         response = chatbot.llamaResponse("test query")
         
-        # Verify Groq client was initialized with the API key
-        mock_groq.assert_called_once_with(api_key='test_key')
+        # Verify Groq client was initialized with the API key and a pooled HTTP client
+        mock_groq.assert_called_once()
+        self.assertEqual(mock_groq.call_args.kwargs['api_key'], 'test_key')
+        self.assertIsNotNone(mock_groq.call_args.kwargs['http_client'])
         
-        # Verify chat.completions.create was called
-        mock_client.chat.completions.create.assert_called_once()
+        # Verify chat.completions.create was called, through the scheduler
+        mock_client.chat.completions.with_raw_response.create.assert_called_once()
+        self.assertEqual(chatbot.llm_scheduler.stats()['completed'], 1)
         
         # Verify the correct response is returned
         self.assertEqual(response, "Test response")
+
+        # The client is created once and reused by later calls
+        chatbot.llamaResponse("another query")
+        mock_groq.assert_called_once()
     
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    @patch('RAG.Groq')
+    def test_llama_response_stream(self, mock_groq, mock_faiss, mock_embeddings):
+        """Test that streamed tokens are yielded as they arrive and timings are logged"""
+        def chunk(content):
+            return MagicMock(choices=[MagicMock(delta=MagicMock(content=content))])
+
+        mock_client = mock_groq.return_value
+        mock_client.chat.completions.with_raw_response.create.return_value.parse.return_value = iter(
+            [chunk("Water"), chunk(None), chunk(" utilities"), MagicMock(choices=[])]
+        )
+        mock_client.chat.completions.with_raw_response.create.return_value.headers = {}
+        mock_embeddings.return_value = DeterministicFakeEmbedding(size=8)
+        mock_faiss.load_local.return_value = make_store(mock_embeddings.return_value, CORPUS)
+        os.environ['GROQ_API_KEY'] = 'test_key'
+
+        chatbot = ChatBot()
+        with self.assertLogs('chatbot.rag', level='INFO') as logs:
+            tokens = list(chatbot.llamaResponseStream("test query"))
+
+        self.assertEqual(tokens, ["Water", " utilities"])
+        self.assertTrue(mock_client.chat.completions.with_raw_response.create.call_args.kwargs['stream'])
+        self.assertEqual(chatbot.llm_scheduler.in_flight, 0)
+        props = logs.records[-1].props
+        self.assertEqual(props['stream_chunks'], 2)
+        self.assertIsNotNone(props['llm_first_token_ms'])
+        self.assertIn('llm_total_ms', props)
+        self.assertIn('prompt_build_ms', props)
+        self.assertIn('embed_ms', props)
+        self.assertIn('search_ms', props)
+        self.assertEqual(len(props['request_id']), 16)
+
     def test_error_handling_no_api_key(self):
         """Test error handling when no API key is provided"""
         # Remove GROQ_API_KEY from environment
@@ -116,5 +375,265 @@ class TestChatBot(unittest.TestCase):
             with self.assertRaises(ValueError):
                 chatbot.llamaResponse("test query")
 
+class TestStartup(unittest.TestCase):
+    """Test suite for the lazy startup path"""
+
+    def test_import_defers_heavy_dependencies(self):
+        """Test that importing RAG loads neither torch, the Groq SDK nor langchain"""
+        script = "import sys, RAG; print(sorted(m for m in ('torch', 'transformers', 'groq', 'langchain_community', 'pandas') if m in sys.modules))"
+        output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    @patch('RAG.HuggingFaceEmbeddings')
+    @patch('RAG.FAISS')
+    def test_load_in_background(self, mock_faiss, mock_embeddings):
+        """Test that a ChatBot created without loading becomes ready once its background load is over"""
+        mock_faiss.load_local.return_value = make_store(DeterministicFakeEmbedding(size=8), CORPUS)
+        mock_embeddings.return_value = DeterministicFakeEmbedding(size=8)
+        with patch('builtins.print'):
+            chatbot = ChatBot(load=False)
+            self.assertFalse(chatbot.ready.is_set())
+            mock_embeddings.assert_not_called()
+            self.assertEqual(chatbot.busca_contexto("water"), [])
+            chatbot.load_in_background().join(timeout=30)
+
+        stats = chatbot.startup_stats()
+        self.assertTrue(stats['ready'] and stats['index_loaded'])
+        self.assertIsNone(stats['load_error'])
+        self.assertGreaterEqual(stats['warmup_seconds'], 0)
+        self.assertEqual(len(chatbot.busca_contexto("water")), chatbot.k)
+
+class TestChatBotAgainstStub(unittest.TestCase):
+    """Runs the Groq calls of the ChatBot against the local stub server"""
+
+    def setUp(self):
+        self.stub = GroqStubServer(reply="Stub answer from the context").start()
+        self.env = patch.dict(os.environ, {'GROQ_API_KEY': 'stub_key', 'GROQ_BASE_URL': self.stub.base_url})
+        self.env.start()
+        embeddings = DeterministicFakeEmbedding(size=8)
+        with patch('RAG.HuggingFaceEmbeddings', return_value=embeddings), patch('RAG.FAISS') as mock_faiss:
+            mock_faiss.load_local.return_value = make_store(embeddings, CORPUS)
+            self.chatbot = ChatBot()
+
+    def tearDown(self):
+        self.chatbot.close()
+        self.env.stop()
+        self.stub.stop()
+
+    def test_connection_reused(self):
+        """Test that consecutive answers share one pooled connection"""
+        for _ in range(3):
+            self.assertEqual(self.chatbot.llamaResponse("test query"), "Stub answer from the context")
+
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_stream(self):
+        """Test that streamed tokens from the server add up to the answer"""
+        tokens = list(self.chatbot.llamaResponseStream("test query"))
+
+        self.assertEqual("".join(tokens), "Stub answer from the context")
+        self.assertEqual(len(tokens), 5)
+
+    def test_async_response(self):
+        """Test concurrent answers through the async client"""
+        async def ask_all():
+            answers = await asyncio.gather(*(self.chatbot.allamaResponse(f"query {i}") for i in range(5)))
+            return answers, await self.chatbot._async_groq_client()
+
+        answers, client = asyncio.run(ask_all())
+
+        self.assertEqual(answers, ["Stub answer from the context"] * 5)
+        self.assertEqual(self.stub.requests, 5)
+        self.assertEqual(self.stub.last_request['model'], self.chatbot.llm_model)
+        # The loop's client is closed and dropped when asyncio.run shuts the loop down
+        self.assertTrue(client.is_closed())
+        self.assertEqual(self.chatbot._async_clients, {})
+
+    def test_close_closes_async_clients(self):
+        """Test that close() closes the async clients of loops that are still open"""
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertEqual(loop.run_until_complete(self.chatbot.allamaResponse("test query")), "Stub answer from the context")
+        client = loop.run_until_complete(self.chatbot._async_groq_client())
+        self.assertFalse(client.is_closed())
+
+        self.chatbot.close()
+
+        self.assertTrue(client.is_closed())
+        self.assertEqual(self.chatbot._async_clients, {})
+
+    def test_identical_questions_coalesced(self):
+        """Test that the same question asked concurrently makes one LLM call, streamed or not"""
+        self.stub.latency = 0.3
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            answers = list(pool.map(lambda _: self.chatbot.llamaResponse("test query"), range(3)))
+            streams = list(pool.map(lambda _: "".join(self.chatbot.llamaResponseStream("water")), range(3)))
+
+        self.assertEqual(answers, ["Stub answer from the context"] * 3)
+        self.assertEqual(streams, ["Stub answer from the context"] * 3)
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(self.chatbot.single_flight.stats()['coalesced'], 4)
+
+    def test_answer_cache(self):
+        """Test that answers are reused from the SQLite cache until the index version changes"""
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, 'answers.sqlite3')
+            with patch.dict(os.environ, {'ANSWER_CACHE_PATH': cache_path}), \
+                 patch('RAG.HuggingFaceEmbeddings', return_value=DeterministicFakeEmbedding(size=8)), \
+                 patch('RAG.FAISS') as mock_faiss:
+                mock_faiss.load_local.return_value = self.chatbot.faiss_index
+                chatbot = ChatBot()
+                restarted = ChatBot()
+            self.addCleanup(chatbot.close)
+            self.addCleanup(restarted.close)
+
+            self.assertEqual(chatbot.llamaResponse("test query"), "Stub answer from the context")
+            # Cached answers need neither an API key nor a Groq client
+            with patch.dict(os.environ):
+                del os.environ['GROQ_API_KEY']
+                self.assertEqual(restarted.llamaResponse("test query"), "Stub answer from the context")
+                self.assertEqual("".join(restarted.llamaResponseStream("test query")), "Stub answer from the context")
+                self.assertEqual(asyncio.run(restarted.allamaResponse("test query")), "Stub answer from the context")
+            self.assertIsNone(restarted._client)
+            self.assertEqual(self.stub.requests, 1)
+            self.assertEqual(restarted.answer_cache.stats()['hits'], 3)
+
+            restarted.active_index.version = 'v2'
+            restarted.llamaResponse("test query")
+            self.assertEqual(self.stub.requests, 2)
+
+class TestIndexReload(unittest.TestCase):
+    """Test suite for swapping index versions into a running ChatBot"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.embeddings = DeterministicFakeEmbedding(size=8)
+        self.publish('v1', CORPUS)
+        environ = patch.dict(os.environ, {'FAISS_INDEX_PATH': self.root})
+        environ.start()
+        self.addCleanup(environ.stop)
+        printing = patch('builtins.print')
+        printing.start()
+        self.addCleanup(printing.stop)
+
+    def publish(self, version, texts):
+        """Writes a complete version of the index and points CURRENT at it, like build_index.py --versioned"""
+        path = os.path.join(self.root, VERSIONS_DIR, version)
+        make_store(self.embeddings, texts).save_local(path)
+        save_manifest(path, {'version': version, 'index': {'type': 'flat', 'params': {}}})
+        publish_version(self.root, version, keep=3)
+
+    def chatbot(self, **env):
+        with patch.dict(os.environ, env), patch('RAG.HuggingFaceEmbeddings', return_value=self.embeddings):
+            chatbot = ChatBot()
+        if chatbot.index_watcher:
+            self.addCleanup(chatbot.index_watcher.stop)
+        return chatbot
+
+    def test_reload_swaps_version(self):
+        """Test that a reload serves the new version while queries holding the old one finish on it"""
+        chatbot = self.chatbot()
+        self.assertEqual(chatbot.index_version, 'v1')
+        self.assertEqual(chatbot.busca_contexto('test context 4')[0], 'test context 4')
+
+        in_flight = chatbot.active_index
+        old = weakref.ref(in_flight)
+        self.publish('v2', ['wiper on a grid operator'] + CORPUS)
+        with patch('RAG.logger') as mock_logger:
+            self.assertEqual(chatbot.reload_index(), 'v2')
+        self.assertEqual(mock_logger.info.call_args.kwargs['extra']['props']['previous_index_version'], 'v1')
+        self.assertEqual(chatbot.faiss_index.index.ntotal, len(CORPUS) + 1)
+        self.assertEqual(chatbot.busca_contexto('wiper on a grid operator')[0], 'wiper on a grid operator')
+
+        # A query that started on v1 still sees v1, which is freed once it is done
+        _, results = chatbot._retrieve(in_flight, ['test context 4'], 1, None, 'vector')
+        self.assertEqual(results[0][0][1].page_content, 'test context 4')
+        del results
+        del in_flight
+        gc.collect()
+        self.assertIsNone(old())
+
+    def test_failed_reload_keeps_serving(self):
+        """Test that a version that cannot be loaded leaves the active one in place"""
+        chatbot = self.chatbot()
+        publish_version(self.root, 'missing', keep=3)
+        with patch('RAG.logger'), self.assertRaises(Exception):
+            chatbot.reload_index()
+        self.assertEqual((chatbot.index_version, chatbot.reload_failures), ('v1', 1))
+        self.assertEqual(chatbot.busca_contexto('test context 4')[0], 'test context 4')
+
+    def test_watcher_reloads_published_version(self):
+        """Test that INDEX_WATCH_INTERVAL picks up a newly published version"""
+        chatbot = self.chatbot(INDEX_WATCH_INTERVAL='0.02')
+        self.publish('v2', CORPUS[:4])
+        deadline = time.monotonic() + 5
+        while chatbot.index_version != 'v2' and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(chatbot.index_version, 'v2')
+        self.assertEqual(chatbot.faiss_index.index.ntotal, 4)
+
+class TestShardedIndex(unittest.TestCase):
+    """Test suite for searching an index built with build_index.py --sharded"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.embeddings = DeterministicFakeEmbedding(size=8)
+        # Alternating sources, so that every shard holds half of the corpus
+        documents = [
+            Document(page_content=text, metadata={"source": ("ALPHA", "BETA")[i % 2], "id": i, "year": 2020 + i % 3})
+            for i, text in enumerate(CORPUS)
+        ]
+        self.single, self.sharded = os.path.join(tmp.name, 'single'), os.path.join(tmp.name, 'sharded')
+        options = (self.embeddings, embedding_config(), index_config('flat'), 'v1')
+        with patch('builtins.print'):
+            update_index(self.single, [documents], *options, workers=1)
+            update_shards(self.sharded, {source: [documents[i::2]] for i, source in enumerate(("ALPHA", "BETA"))},
+                          *options, workers=1)
+        printing = patch('builtins.print')
+        printing.start()
+        self.addCleanup(printing.stop)
+
+    def chatbot(self, path):
+        with patch.dict(os.environ, {'FAISS_INDEX_PATH': path}), \
+             patch('RAG.HuggingFaceEmbeddings', return_value=self.embeddings):
+            chatbot = ChatBot()
+        self.addCleanup(chatbot.close)
+        return chatbot
+
+    def test_fan_out_matches_single_index(self):
+        """Test that searching the shards in parallel returns the same top k as one index"""
+        single, sharded = self.chatbot(self.single), self.chatbot(self.sharded)
+        self.assertEqual(sorted(sharded.active_index.shards), ['ALPHA', 'BETA'])
+        self.assertIsNone(sharded.faiss_index)
+        self.assertEqual(sharded.active_index.documents, len(CORPUS))
+        queries = ['test context 3', 'ransomware on water utilities', 'test context 8']
+        for mode in ('vector', 'lexical', 'hybrid'):
+            expected = single.retrieve(queries, k=4, mode=mode)
+            found = sharded.retrieve(queries, k=4, mode=mode)
+            for want, got in zip(expected, found):
+                self.assertEqual([hit[0] for hit in got][:1], [hit[0] for hit in want][:1])
+        expected = single.retrieve(queries, k=4, mode='vector')
+        found = sharded.retrieve(queries, k=4, mode='vector')
+        self.assertEqual([[hit[0] for hit in hits] for hits in found], [[hit[0] for hit in hits] for hits in expected])
+        self.assertIn('test context 3', sharded.build_context('test context 3'))
+
+    def test_source_filter_skips_shards(self):
+        """Test that a sources filter only searches the shards holding those sources"""
+        chatbot = self.chatbot(self.sharded)
+        index = chatbot.active_index
+        self.assertEqual([shard.sources for shard in index.parts({'sources': ['beta']})], [['BETA']])
+        with patch.object(chatbot, '_search_part_vectors', wraps=chatbot._search_part_vectors) as search:
+            hits = chatbot.retrieve(['test context 3'], k=3, filters={'sources': ['BETA'], 'year_from': 2021})[0]
+        self.assertEqual(search.call_count, 1)
+        self.assertTrue(hits)
+        self.assertTrue(all(document.metadata['source'] == 'BETA' and document.metadata['year'] >= 2021
+                            for _, document, _ in hits))
+
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+import tempfile
+import pandas as pd
+from unittest.mock import patch
+
+# Add parent directory to path so we can import sources
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import sources
+from sources import iter_documents, load_documents, read_source
+
+SOURCES = {
+    'ALPHA': {
+        'text': ['summary'],
+        'id': None,
+        'metadata': {'year': 'year', 'industry': 'sector'},
+        'keywords': ['actor'],
+        'dtypes': {'sector': 'category'}
+    },
+    'BETA': {
+        'text': ['title', 'details'],
+        'id': 'id',
+        'metadata': {},
+        'keywords': [],
+        'dtypes': {'id': 'int64'}
+    }
+}
+
+class TestSources(unittest.TestCase):
+    """Test suite for the source registry and the streaming reader"""
+
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        self.data_path = data_dir.name
+        pd.DataFrame({
+            'summary': [f'Incident {i}' for i in range(7)],
+            'year': [2020 + i for i in range(7)],
+            'sector': ['Water', 'Energy'] * 3 + ['Water'],
+            'actor': ['APT1', None] * 3 + ['Sandworm'],
+            'Europe': [1, 0, 1, 0, 1, 0, 1],
+            'unused': ['x'] * 7
+        }).to_csv(sources.source_path(self.data_path, 'ALPHA'), index=False)
+        pd.DataFrame({'id': [42, 7], 'title': ['Wiper', 'Ransomware'], 'details': ['on a grid', 'on a plant']}).to_csv(
+            sources.source_path(self.data_path, 'BETA'), index=False)
+
+    def test_chunked_read_matches_whole_read(self):
+        """Test that row ids, text and metadata do not depend on the chunk size"""
+        with patch('builtins.print'):
+            whole, _ = load_documents(self.data_path, SOURCES, chunk_size=100)
+            chunked = list(read_source(self.data_path, 'ALPHA', SOURCES['ALPHA'], chunk_size=3))
+        self.assertEqual([len(chunk) for chunk in chunked], [3, 3, 1])
+        self.assertEqual([d.metadata for chunk in chunked for d in chunk], [d.metadata for d in whole[:7]])
+        last = chunked[-1][0]
+        self.assertEqual((last.page_content, last.metadata['id'], last.metadata['year']), ('Incident 6', 6, 2026))
+        self.assertEqual((last.metadata['industry'], last.metadata['keywords'], last.metadata['regions']),
+                         ('Water', 'Sandworm', ['Europe']))
+        beta = whole[7:]
+        self.assertEqual([(d.metadata['id'], d.page_content) for d in beta], [(42, 'Wiper\n\non a grid'), (7, 'Ransomware\n\non a plant')])
+
+    def test_parallel_sources_and_report(self):
+        """Test that parallel readers deliver every chunk and report rows and bytes per source"""
+        report = {}
+        with patch('builtins.print'):
+            chunks = list(iter_documents(self.data_path, dict(SOURCES, GAMMA=SOURCES['BETA']), chunk_size=2, workers=3, report=report))
+        keys = sorted((d.metadata['source'], d.metadata['id']) for chunk in chunks for d in chunk)
+        self.assertEqual(keys, sorted([('ALPHA', i) for i in range(7)] + [('BETA', 42), ('BETA', 7)]))
+        self.assertEqual((report['ALPHA']['rows'], report['ALPHA']['status']), (7, 'ok'))
+        self.assertEqual(report['ALPHA']['bytes'], os.path.getsize(sources.source_path(self.data_path, 'ALPHA')))
+        self.assertEqual((report['GAMMA']['rows'], report['GAMMA']['status']), (0, 'missing'))
+
+    def test_missing_text_column_skips_source(self):
+        """Test that a source without its text column is reported and skipped"""
+        broken = {'ALPHA': dict(SOURCES['ALPHA'], text=['description'])}
+        with patch('builtins.print') as mock_print:
+            documents, report = load_documents(self.data_path, broken)
+        self.assertEqual(documents, [])
+        self.assertEqual(report['ALPHA']['status'], 'invalid')
+        mock_print.assert_any_call(f"ERROR: Column description not found in {sources.source_path(self.data_path, 'ALPHA')}. Skipping.")
+
+if __name__ == '__main__':
+    unittest.main()
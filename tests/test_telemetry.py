@@ -0,0 +1,63 @@
+import os
+import sys
+import asyncio
+import unittest
+
+# Add parent directory to path so we can import telemetry
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from telemetry import LatencyRecorder, LatencyHistogram, current_request_id
+
+class TestTelemetry(unittest.TestCase):
+    """Test suite for the per-stage latency recorder"""
+
+    def test_histogram_window_and_percentiles(self):
+        """Test that the histogram keeps only the last samples and buckets them"""
+        histogram = LatencyHistogram(window=100)
+        for ms in range(1, 201):
+            histogram.add(float(ms))
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 200)
+        self.assertEqual(snapshot["window"], 100)
+        self.assertAlmostEqual(snapshot["p50_ms"], 150.5)
+        self.assertEqual(snapshot["buckets_ms"], {"<=250": 100})
+        self.assertEqual(LatencyHistogram().snapshot(), {"count": 0, "window": 0})
+
+    def test_spans_add_to_the_current_request(self):
+        """Test that spans inside a request accumulate into its timings"""
+        recorder = LatencyRecorder()
+        with recorder.request("abc") as request:
+            self.assertEqual(current_request_id(), "abc")
+            with recorder.span("search"):
+                pass
+            with recorder.span("search"):
+                pass
+            recorder.record("llm_total", 12.5)
+        self.assertIsNone(current_request_id())
+
+        self.assertEqual(set(request["timings"]), {"search_ms", "llm_total_ms"})
+        self.assertEqual(request["timings"]["llm_total_ms"], 12.5)
+        snapshot = recorder.snapshot()
+        self.assertEqual(snapshot["search"]["count"], 2)
+        self.assertEqual(snapshot["llm_total"]["count"], 1)
+
+    def test_threads_started_with_the_context_share_the_request(self):
+        """Test that spans in asyncio.to_thread land in the awaiting request"""
+        recorder = LatencyRecorder()
+
+        def embed():
+            with recorder.span("embed"):
+                return current_request_id()
+
+        async def serve():
+            with recorder.request() as request:
+                seen = await asyncio.to_thread(embed)
+            return request, seen
+
+        request, seen = asyncio.run(serve())
+        self.assertEqual(seen, request["request_id"])
+        self.assertIn("embed_ms", request["timings"])
+
+if __name__ == '__main__':
+    unittest.main()